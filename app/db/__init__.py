@@ -1,4 +1,4 @@
 # Database package initialization
-from .db import get_connection, get_conn, fetch_query, execute_query, insert_location
+from .db import get_connection, get_conn, fetch_query, execute_query, execute_many, transaction, insert_location
 
-__all__ = ['get_connection', 'get_conn', 'fetch_query', 'execute_query', 'insert_location']
+__all__ = ['get_connection', 'get_conn', 'fetch_query', 'execute_query', 'execute_many', 'transaction', 'insert_location']
@@ -1,6 +1,8 @@
 import mysql.connector
 from mysql.connector import Error
+from contextlib import contextmanager
 import os
+from utils.data_versions import record_write
 #from dotenv import load_dotenv # Comment out for server
 #load_dotenv() # Comment out for server
 
@@ -55,6 +57,64 @@ def execute_query(query, params=None):
     conn.commit()
     cursor.close()
     conn.close()
+    record_write(query)
+
+def execute_many(query, rows):
+    """Run one statement for many parameter rows in a single round-trip.
+    mysql-connector rewrites INSERT ... VALUES into one multi-row insert."""
+    if not rows:
+        return 0
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.executemany(query, rows)
+    conn.commit()
+    count = cursor.rowcount
+    cursor.close()
+    conn.close()
+    record_write(query)
+    return count
+
+class _WriteTrackingCursor:
+    """Cursor wrapper that remembers the statements run through it (for data versions)"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.statements = []
+
+    def execute(self, query, params=None):
+        self.statements.append(query)
+        return self._cursor.execute(query, params)
+
+    def executemany(self, query, rows):
+        self.statements.append(query)
+        return self._cursor.executemany(query, rows)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+@contextmanager
+def transaction():
+    """Run several statements on one connection as a single transaction.
+    Yields a dictionary cursor; commits when the block ends, rolls back if it raises."""
+    conn = get_connection()
+    if not conn:
+        raise RuntimeError("Database connection failed")
+    cursor = _WriteTrackingCursor(conn.cursor(dictionary=True))
+    try:
+        conn.start_transaction()
+        yield cursor
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+    for query in cursor.statements:
+        record_write(query)
 
 def insert_location(user_id, property_id, time_in, time_out, notes=None):
     query = """
@@ -90,6 +90,42 @@ app.include_router(quickbooks_routes.router)
 app.include_router(email_routes.router)
 app.include_router(checkin_routes.router)
 
+import asyncio
+from fastapi.concurrency import run_in_threadpool
+from utils import http_clients
+from services.distance_matrix import distance_matrix
+
+@app.on_event("startup")
+async def start_background_tasks():
+    # Pooled keep-alive clients for every outbound integration
+    http_clients.startup()
+    # Keep the properties forecast and weather AI summary warm
+    app.state.weather_prefetcher = asyncio.create_task(weather_routes.weather_prefetch_loop())
+    # Pick up inbound texts that were stored but not processed before the last restart
+    await run_in_threadpool(sms_routes.requeue_unprocessed_sms)
+    # Paced, retrying sender for all outbound texts
+    sms_routes.outbound_sms.start()
+    # Write-behind persistence of SMS conversation state
+    sms_routes.conversation_store.start()
+    # Batched writes of crew GPS pings to event_checkins
+    checkin_routes.live_crews.start()
+    # Batched writes of GPS breadcrumb chunks
+    checkin_routes.breadcrumbs.start()
+    # Property-to-property driving distances for routing, assignment and ETAs
+    distance_matrix.start_warming()
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    app.state.weather_prefetcher.cancel()
+    # Unfinished inbound texts stay unprocessed in sms_messages and are re-queued on startup
+    sms_routes.inbound_queue.shutdown(wait=False)
+    # Give queued replies a few seconds to go out and write their delivery records
+    await run_in_threadpool(sms_routes.outbound_sms.stop, 5.0)
+    await run_in_threadpool(sms_routes.conversation_store.stop)
+    await run_in_threadpool(checkin_routes.live_crews.stop)
+    await run_in_threadpool(checkin_routes.breadcrumbs.stop)
+    await http_clients.shutdown()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8080, reload=False) # change for server hose 0.0.0.0 port 8080
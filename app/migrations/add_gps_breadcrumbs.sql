@@ -0,0 +1,28 @@
+-- GPS Breadcrumbs
+-- Crew tracks stored compactly: one row per (event, user, hour) holding the
+-- hour's points as delta-encoded varints (seconds into the hour, lat/lon in
+-- 1e-5 degrees; see app/utils/delta_codec.py), instead of one row per point
+
+CREATE TABLE IF NOT EXISTS gps_breadcrumb_chunks (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    winter_event_id INT NOT NULL,
+    user_id INT NOT NULL,
+
+    -- Chunk window and summary
+    hour_start DATETIME NOT NULL,
+    point_count INT NOT NULL DEFAULT 0,
+    first_point_at DATETIME NULL,
+    last_point_at DATETIME NULL,
+
+    -- Encoded points
+    data MEDIUMBLOB NOT NULL,
+
+    -- Timestamps
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+
+    FOREIGN KEY (winter_event_id) REFERENCES winter_events(id) ON DELETE CASCADE,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    UNIQUE KEY unique_breadcrumb_chunk (winter_event_id, user_id, hour_start),
+    INDEX idx_breadcrumb_user_hour (user_id, hour_start)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
@@ -0,0 +1,8 @@
+-- Property Geofences
+-- Optional per-property fence used to detect crews arriving at and leaving a
+-- site. Without these a circle of GEOFENCE_RADIUS_FEET around the property's
+-- coordinates is used.
+
+ALTER TABLE locations
+    ADD COLUMN geofence_radius_feet INT NULL COMMENT 'Circle radius around latitude/longitude',
+    ADD COLUMN geofence_polygon JSON NULL COMMENT '[[lat, lon], ...] outline; overrides the radius';
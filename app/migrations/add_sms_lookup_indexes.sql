@@ -0,0 +1,12 @@
+-- SMS Lookup Indexes
+-- Inbound texts are matched to a user and conversation by phone number, and
+-- processed messages are marked by Twilio SID; index those lookups
+
+-- users.phone_number had no index (full scan on every first contact)
+CREATE INDEX idx_users_phone_number ON users(phone_number);
+
+-- Latest conversation for a phone (WHERE phone_number = ? ORDER BY last_message_at DESC)
+CREATE INDEX idx_sms_conversations_phone_last ON sms_conversations(phone_number, last_message_at);
+
+-- UPDATE sms_messages ... WHERE twilio_sid = ? after each inbound text is interpreted
+CREATE INDEX idx_sms_messages_twilio_sid ON sms_messages(twilio_sid);
@@ -1,14 +1,20 @@
 from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from auth import get_current_user
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
 from db import fetch_query, execute_query
+from services.ai_context import get_user_context_block, invalidate_user_context
+from services.chat_history import cap_tool_result, compact_history, prune_tool_results
+from utils.cache import TTLCache
+from utils.http_clients import get_async_client
+import asyncio
 import os
 import httpx
 import json
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional
 from datetime import datetime
 from pathlib import Path
@@ -22,53 +28,16 @@ class ChatMessage(BaseModel):
 class ChatRequest(BaseModel):
     messages: List[ChatMessage]
     page_context: str = None  # Which page user is on (e.g., 'WinterOpsLog', 'MyTickets')
+    conversation_id: Optional[str] = None  # Client-generated; scopes memoised tool results
 
 class ChatResponse(BaseModel):
     message: str
     suggestions: List[str] = []
 
 def get_user_context(current_user: dict) -> str:
-    """Get relevant context about the current user"""
+    """Get relevant context about the current user (cached per user until their data changes)"""
     # JWT payload has "sub" (user ID as string) and "role"
-    user_id = int(current_user["sub"])
-    user_role = current_user["role"]
-
-    # Get user's name from database
-    user_info = fetch_query("SELECT name FROM users WHERE id = %s", (user_id,))
-    user_name = user_info[0]["name"] if user_info else "User"
-
-    # Get user's assigned properties
-    properties = fetch_query(
-        """SELECT l.id, l.name, l.address
-           FROM locations l
-           JOIN property_contractors pc ON l.id = pc.property_id
-           WHERE pc.contractor_id = %s AND pc.acceptance_status = 'accepted'""",
-        (user_id,)
-    )
-
-    # Get active tickets
-    active_tickets = fetch_query(
-        """SELECT w.id, l.name as property_name, w.time_in
-           FROM winter_ops_logs w
-           JOIN locations l ON w.property_id = l.id
-           WHERE w.contractor_id = %s AND w.time_out IS NULL
-           AND DATE(w.time_in) = CURDATE()""",
-        (user_id,)
-    )
-
-    context = f"User: {user_name} (Role: {user_role})\n"
-
-    if properties:
-        context += f"\nAssigned Properties ({len(properties)}):\n"
-        for prop in properties[:5]:  # Limit to 5 to avoid token bloat
-            context += f"- {prop['name']} ({prop['address']})\n"
-
-    if active_tickets:
-        context += f"\nActive Tickets ({len(active_tickets)}):\n"
-        for ticket in active_tickets:
-            context += f"- {ticket['property_name']} (started: {ticket['time_in']})\n"
-
-    return context
+    return get_user_context_block(int(current_user["sub"]), current_user["role"])
 
 def get_available_tools() -> List[Dict]:
     """Define tools (functions) that ChatGPT can call"""
@@ -394,6 +363,7 @@ def execute_tool(tool_name: str, arguments: Dict, current_user: dict) -> Dict:
 
         try:
             execute_query(query, params)
+            invalidate_user_context(user_id)
             return {"status": "success", "message": "Winter log created successfully"}
         except Exception as e:
             return {"status": "error", "message": str(e)}
@@ -474,19 +444,22 @@ The user is viewing property information. Help them with:
 """
     }
 
-    full_prompt = base_prompt + "\n" + user_context
+    # Static instructions first and per-user context last, so the prefix is
+    # identical across users on the same page and OpenAI can cache it
+    full_prompt = base_prompt
 
     if page_context and page_context in page_prompts:
         full_prompt += "\n" + page_prompts[page_context]
 
+    full_prompt += "\n" + user_context
+
     return full_prompt
 
-@router.post("/ai/chat/")
-async def chat_with_ai(
-    request: ChatRequest,
-    current_user: dict = Depends(get_current_user)
-) -> ChatResponse:
-    """Chat with AI assistant using OpenAI API"""
+OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
+AI_CHAT_MODEL = os.getenv("AI_CHAT_MODEL", "gpt-4o")  # GPT-4o is the latest model with better function calling
+
+def prepare_chat_messages(request: ChatRequest, current_user: dict):
+    """Resolve the OpenAI key and build the message list shared by the JSON and streaming endpoints"""
 
     # Load OpenAI API key from database (fallback to env var)
     try:
@@ -513,109 +486,271 @@ async def chat_with_ai(
     # Build messages for OpenAI
     messages = [{"role": "system", "content": system_prompt}]
 
-    # Add conversation history
-    for msg in request.messages:
-        messages.append({"role": msg.role, "content": msg.content})
+    # Add conversation history, compacted to the model's token budget
+    history = [{"role": msg.role, "content": msg.content} for msg in request.messages]
+    messages.extend(compact_history(history, AI_CHAT_MODEL))
+
+    return openai_api_key, messages
+
+# Tools that only read; safe to run concurrently and to memoise per conversation
+READ_ONLY_TOOLS = {"query_winter_logs", "generate_report", "get_properties", "get_winter_events"}
 
-    # Get available tools
-    tools = get_available_tools()
+# Rounds of tool calls allowed before the model must answer
+MAX_TOOL_ROUNDS = 4
 
-    # Call OpenAI API with function calling
+# Tools run blocking DB queries; give them their own pool so they run in parallel
+# without starving the request threadpool
+_tool_executor = ThreadPoolExecutor(max_workers=int(os.getenv("AI_TOOL_WORKERS", "8")), thread_name_prefix="ai-tool")
+
+# (user_id, conversation_id, tool_name, args_json) -> result
+_tool_memo = TTLCache(ttl_seconds=300, maxsize=2048)
+
+def completion_payload(messages: List[Dict], with_tools: bool) -> Dict:
+    payload = {
+        "model": AI_CHAT_MODEL,
+        "messages": prune_tool_results(messages),
+        "temperature": 0.7,
+        "max_tokens": 2000  # Increased for complex table operations
+    }
+    if with_tools:
+        payload["tools"] = get_available_tools()
+        payload["tool_choice"] = "auto"  # Let GPT decide when to use tools
+    return payload
+
+async def run_tool_call(tool_call: Dict, current_user: dict, conversation_id: Optional[str]) -> Dict:
+    """Execute one tool call in the tool pool, memoising read-only results for the conversation"""
+    function_name = tool_call["function"]["name"]
     try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            # First API call
-            response = await client.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {openai_api_key}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "gpt-4o",  # GPT-4o is the latest model with better function calling
-                    "messages": messages,
-                    "tools": tools,
-                    "tool_choice": "auto",  # Let GPT decide when to use tools
-                    "temperature": 0.7,
-                    "max_tokens": 2000  # Increased for complex table operations
-                }
-            )
+        function_args = json.loads(tool_call["function"]["arguments"] or "{}")
+    except ValueError:
+        return {"status": "error", "message": "Invalid tool arguments"}
+
+    memo_key = None
+    if conversation_id and function_name in READ_ONLY_TOOLS:
+        memo_key = (current_user["sub"], conversation_id, function_name, json.dumps(function_args, sort_keys=True))
+        cached = _tool_memo.get(memo_key)
+        if cached is not None:
+            return cached
+
+    logger.info(f"Executing tool: {function_name} with args: {function_args}")
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(_tool_executor, execute_tool, function_name, function_args, current_user)
+
+    if memo_key and result.get("status") == "success":
+        _tool_memo.set(memo_key, result)
+    elif conversation_id and function_name not in READ_ONLY_TOOLS:
+        # A write may have changed what earlier reads returned
+        _tool_memo.delete_where(lambda key: key[0] == current_user["sub"] and key[1] == conversation_id)
+
+    return result
+
+async def iter_tool_results(tool_calls: List[Dict], current_user: dict, conversation_id: Optional[str]):
+    """
+    Yield (tool_call, result) as tools finish. Read-only tools run concurrently;
+    write tools then run one at a time so they see each other's effects.
+    """
+    reads = [tc for tc in tool_calls if tc["function"]["name"] in READ_ONLY_TOOLS]
+    writes = [tc for tc in tool_calls if tc["function"]["name"] not in READ_ONLY_TOOLS]
 
-            if response.status_code != 200:
-                error_detail = response.json().get("error", {}).get("message", "Unknown error")
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"OpenAI API error: {error_detail}"
-                )
+    async def run_read(tool_call):
+        return tool_call, await run_tool_call(tool_call, current_user, conversation_id)
 
-            result = response.json()
-            assistant_message = result["choices"][0]["message"]
+    for finished in asyncio.as_completed([run_read(tc) for tc in reads]):
+        yield await finished
 
-            # Check if GPT wants to call a tool
-            if assistant_message.get("tool_calls"):
-                # Execute each tool call
-                messages.append(assistant_message)
+    for tool_call in writes:
+        yield tool_call, await run_tool_call(tool_call, current_user, conversation_id)
 
-                for tool_call in assistant_message["tool_calls"]:
-                    function_name = tool_call["function"]["name"]
-                    function_args = json.loads(tool_call["function"]["arguments"])
+def tool_result_message(tool_call: Dict, result: Dict) -> Dict:
+    return {
+        "role": "tool",
+        "tool_call_id": tool_call["id"],
+        "content": cap_tool_result(json.dumps(result, default=str), AI_CHAT_MODEL)
+    }
 
-                    print(f"[INFO] Executing tool: {function_name} with args: {function_args}")
+async def request_completion(openai_api_key: str, payload: Dict) -> Dict:
+    """Non-streaming chat completion; returns the assistant message"""
+    response = await get_async_client().post(
+        OPENAI_CHAT_URL,
+        timeout=60.0,
+        headers={
+            "Authorization": f"Bearer {openai_api_key}",
+            "Content-Type": "application/json"
+        },
+        json=payload
+    )
 
-                    # Execute the tool
-                    tool_result = execute_tool(function_name, function_args, current_user)
+    if response.status_code != 200:
+        error_detail = response.json().get("error", {}).get("message", "Unknown error")
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=f"OpenAI API error: {error_detail}"
+        )
 
-                    # Add tool result to messages
-                    messages.append({
-                        "role": "tool",
-                        "tool_call_id": tool_call["id"],
-                        "content": json.dumps(tool_result)
-                    })
+    return response.json()["choices"][0]["message"]
 
-                # Make second API call with tool results
-                response2 = await client.post(
-                    "https://api.openai.com/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {openai_api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": "gpt-4o",  # Use same model for consistency
-                        "messages": messages,
-                        "temperature": 0.7,
-                        "max_tokens": 2000  # Increased for complex responses
-                    }
-                )
+@router.post("/ai/chat/")
+async def chat_with_ai(
+    request: ChatRequest,
+    current_user: dict = Depends(get_current_user)
+) -> ChatResponse:
+    """Chat with AI assistant using OpenAI API"""
 
-                if response2.status_code != 200:
-                    error_detail = response2.json().get("error", {}).get("message", "Unknown error")
-                    raise HTTPException(
-                        status_code=response2.status_code,
-                        detail=f"OpenAI API error: {error_detail}"
-                    )
+    openai_api_key, messages = prepare_chat_messages(request, current_user)
 
-                result2 = response2.json()
-                final_message = result2["choices"][0]["message"]["content"]
+    # Call OpenAI API with function calling, looping while the model asks for tools
+    try:
+        for round_number in range(MAX_TOOL_ROUNDS + 1):
+            assistant_message = await request_completion(
+                openai_api_key,
+                completion_payload(messages, with_tools=round_number < MAX_TOOL_ROUNDS)
+            )
 
-                return ChatResponse(
-                    message=final_message,
-                    suggestions=[]
-                )
+            if not assistant_message.get("tool_calls"):
+                break
 
-            else:
-                # No tool calls, just return the message
-                ai_message = assistant_message.get("content", "I'm here to help!")
+            messages.append(assistant_message)
+            results = {}
+            async for tool_call, result in iter_tool_results(assistant_message["tool_calls"], current_user, request.conversation_id):
+                results[tool_call["id"]] = result
+            for tool_call in assistant_message["tool_calls"]:
+                messages.append(tool_result_message(tool_call, results[tool_call["id"]]))
 
-                return ChatResponse(
-                    message=ai_message,
-                    suggestions=[]
-                )
+        return ChatResponse(
+            message=assistant_message.get("content") or "I'm here to help!",
+            suggestions=[]
+        )
 
+    except HTTPException:
+        raise
     except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="AI assistant timed out. Please try again.")
     except Exception as e:
         logger.error(f"AI chat error: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"AI assistant error: {str(e)}")
 
+def sse_event(event: str, data) -> str:
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+async def stream_openai_completion(openai_api_key: str, payload: dict):
+    """Yield parsed chunks from a streaming chat completion"""
+    client = get_async_client()
+    async with client.stream(
+        "POST",
+        OPENAI_CHAT_URL,
+        timeout=60.0,
+        headers={
+            "Authorization": f"Bearer {openai_api_key}",
+            "Content-Type": "application/json"
+        },
+        json={**payload, "stream": True}
+    ) as response:
+        if response.status_code != 200:
+            body = await response.aread()
+            try:
+                error_detail = json.loads(body).get("error", {}).get("message", "Unknown error")
+            except ValueError:
+                error_detail = "Unknown error"
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"OpenAI API error: {error_detail}"
+            )
+
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            data = line[len("data: "):]
+            if data == "[DONE]":
+                break
+            yield json.loads(data)
+
+async def stream_chat_events(openai_api_key: str, messages: List[Dict], current_user: dict, conversation_id: Optional[str] = None):
+    """
+    Run the chat turn and emit SSE events as it progresses:
+    token (text delta), tool_call (tool started), tool_result (tool finished),
+    done (full final message) or error.
+    """
+    try:
+        for round_number in range(MAX_TOOL_ROUNDS + 1):
+            content_parts = []
+            tool_calls = {}
+
+            # Stream text and accumulate any tool-call deltas
+            async for chunk in stream_openai_completion(
+                openai_api_key,
+                completion_payload(messages, with_tools=round_number < MAX_TOOL_ROUNDS)
+            ):
+                if not chunk.get("choices"):
+                    continue
+                delta = chunk["choices"][0].get("delta") or {}
+
+                if delta.get("content"):
+                    content_parts.append(delta["content"])
+                    yield sse_event("token", {"text": delta["content"]})
+
+                for tool_delta in delta.get("tool_calls") or []:
+                    entry = tool_calls.setdefault(tool_delta["index"], {
+                        "id": None,
+                        "type": "function",
+                        "function": {"name": "", "arguments": ""}
+                    })
+                    if tool_delta.get("id"):
+                        entry["id"] = tool_delta["id"]
+                    function_delta = tool_delta.get("function") or {}
+                    entry["function"]["name"] += function_delta.get("name") or ""
+                    entry["function"]["arguments"] += function_delta.get("arguments") or ""
+
+            if not tool_calls:
+                break
+
+            assistant_message = {
+                "role": "assistant",
+                "content": "".join(content_parts) or None,
+                "tool_calls": [tool_calls[i] for i in sorted(tool_calls)]
+            }
+            messages.append(assistant_message)
+
+            for tool_call in assistant_message["tool_calls"]:
+                yield sse_event("tool_call", {"id": tool_call["id"], "name": tool_call["function"]["name"]})
+
+            results = {}
+            async for tool_call, result in iter_tool_results(assistant_message["tool_calls"], current_user, conversation_id):
+                results[tool_call["id"]] = result
+                yield sse_event("tool_result", {"id": tool_call["id"], "name": tool_call["function"]["name"], "status": result.get("status")})
+            for tool_call in assistant_message["tool_calls"]:
+                messages.append(tool_result_message(tool_call, results[tool_call["id"]]))
+
+        yield sse_event("done", {"message": "".join(content_parts) or "I'm here to help!"})
+
+    except HTTPException as e:
+        yield sse_event("error", {"status": e.status_code, "detail": e.detail})
+    except httpx.TimeoutException:
+        yield sse_event("error", {"status": 504, "detail": "AI assistant timed out. Please try again."})
+    except Exception as e:
+        logger.error(f"AI chat stream error: {str(e)}", exc_info=True)
+        yield sse_event("error", {"status": 500, "detail": f"AI assistant error: {str(e)}"})
+
+@router.post("/ai/chat/stream/")
+async def chat_with_ai_stream(
+    request: ChatRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Streaming variant of /ai/chat/ over server-sent events.
+    Sends tokens as they arrive plus tool-call progress; /ai/chat/ keeps the JSON contract.
+    """
+    openai_api_key, messages = prepare_chat_messages(request, current_user)
+
+    return StreamingResponse(
+        stream_chat_events(openai_api_key, messages, current_user, request.conversation_id),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # don't let nginx buffer the stream
+        }
+    )
+
 @router.get("/ai/suggestions/")
 async def get_suggestions(
     page: str = None,
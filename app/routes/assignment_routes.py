@@ -4,6 +4,7 @@ Handles acceptance/decline of property and route assignments
 """
 
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Optional
 from datetime import datetime
@@ -11,7 +12,12 @@ from auth import get_current_user
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
-from db import fetch_query, execute_query
+from db import fetch_query, execute_query, execute_many
+from services.ai_context import invalidate_user_context
+from services.crew_assignment import solve_assignments
+from services.distance_matrix import distance_matrix
+from services.dispatch import publish_assignment, publish_route_stop
+from services.route_eta import route_etas
 
 router = APIRouter()
 
@@ -105,6 +111,8 @@ def accept_property_assignment(
            VALUES ('property', %s, %s, %s, 'accepted', %s)""",
         (assignment_id, user_id, assignment[0]['property_id'], action.notes)
     )
+    invalidate_user_context(user_id)
+    publish_assignment('property', 'accepted', assignment[0], user_id)
 
     return {"message": "Property assignment accepted", "assignment_id": assignment_id}
 
@@ -155,6 +163,8 @@ def decline_property_assignment(
            VALUES ('property', %s, %s, %s, 'declined', %s)""",
         (assignment_id, user_id, assignment[0]['property_id'], action.notes)
     )
+    invalidate_user_context(user_id)
+    publish_assignment('property', 'declined', assignment[0], user_id)
 
     return {"message": "Property assignment declined", "assignment_id": assignment_id}
 
@@ -245,6 +255,8 @@ def accept_route_assignment(
            VALUES ('route', %s, %s, %s, 'accepted', %s)""",
         (assignment_id, user_id, assignment[0]['route_id'], action.notes)
     )
+    publish_assignment('route', 'accepted', assignment[0], user_id)
+    route_etas.forget(assignment_id)
 
     return {"message": "Route assignment accepted", "assignment_id": assignment_id}
 
@@ -294,6 +306,8 @@ def decline_route_assignment(
            VALUES ('route', %s, %s, %s, 'declined', %s)""",
         (assignment_id, user_id, assignment[0]['route_id'], action.notes)
     )
+    publish_assignment('route', 'declined', assignment[0], user_id)
+    route_etas.forget(assignment_id)
 
     return {"message": "Route assignment declined", "assignment_id": assignment_id}
 
@@ -363,6 +377,8 @@ def start_route_property(
            VALUES ('route', %s, %s, %s, %s, 'started')""",
         (assignment_id, user_id, assignment[0]['route_id'], property_id)
     )
+    publish_route_stop('started', assignment[0], property_id, user_id)
+    route_etas.stop_started(assignment_id, property_id)
 
     return {
         "message": "Started working on property",
@@ -419,6 +435,8 @@ def complete_route_property(
            VALUES ('route', %s, %s, %s, %s, 'completed')""",
         (assignment_id, user_id, assignment[0]['route_id'], property_id)
     )
+    publish_route_stop('completed', assignment[0], property_id, user_id)
+    route_etas.stop_completed(assignment_id, property_id)
 
     return {
         "message": "Property marked as complete",
@@ -427,11 +445,175 @@ def complete_route_property(
     }
 
 
+@router.get("/assignments/route/{assignment_id}/eta")
+def get_route_assignment_eta(
+    assignment_id: int,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Projected arrival/finish time for each remaining stop on an accepted route
+    assignment, with stops at risk of missing their open-by time flagged
+    """
+    user_id = current_user.get("user_id")
+
+    try:
+        projection = route_etas.projection(assignment_id)
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if not projection:
+        raise HTTPException(status_code=404, detail="Assignment not found or not accepted")
+
+    if projection["user_id"] != user_id and current_user['role'] not in ['Admin', 'Manager']:
+        raise HTTPException(status_code=403, detail="Not authorized to view this assignment")
+
+    return projection
+
+
+@router.get("/assignments/routes/eta")
+def get_route_etas(
+    at_risk_only: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    ETA projections for every accepted route assignment (Admin/Manager).
+    at_risk_only keeps assignments with a stop at risk or late.
+    """
+    if current_user['role'] not in ['Admin', 'Manager']:
+        raise HTTPException(status_code=403, detail="Only Admins and Managers can view route ETAs")
+
+    try:
+        projections = route_etas.projections(route_etas.accepted_assignment_ids())
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    rows = list(projections.values())
+    if at_risk_only:
+        rows = [p for p in rows if p["at_risk_count"] or p["late_count"]]
+    rows.sort(key=lambda p: (-(p["late_count"] + p["at_risk_count"]), p["projected_completion"] or datetime.max))
+    return {"count": len(rows), "assignments": rows}
+
+
 # ==================== AI-POWERED PROPERTY ASSIGNMENT ====================
 
 class PropertyListAssignmentRequest(BaseModel):
     property_list_id: int
     winter_event_id: Optional[int] = None
+    use_ai: bool = False  # Ask GPT instead of the local solver (falls back to the solver)
+
+
+def get_openai_api_key() -> Optional[str]:
+    import os
+
+    api_key = os.getenv('OPENAI_API_KEY')
+    if not api_key:
+        # Try to get from api_keys table
+        api_key_result = fetch_query(
+            "SELECT key_value FROM api_keys WHERE key_name = 'openai_api_key' AND user_id IS NULL LIMIT 1"
+        )
+        if api_key_result and api_key_result[0].get('key_value'):
+            api_key = api_key_result[0]['key_value']
+    return api_key
+
+
+def gpt_assign_properties(api_key: str, properties: list, sidewalk_crews: list, non_sidewalk_crews: list) -> list:
+    """Ask ChatGPT for an assignment; raises on any failure so the caller can fall back"""
+    import json
+    from utils.http_clients import get_openai_client
+
+    client = get_openai_client(api_key)
+
+    system_prompt = """You are an AI assistant that assigns snow removal properties to contractors.
+
+Your job is to intelligently assign properties to available crews, ensuring efficient routing and crew utilization.
+
+You will receive:
+1. A list of properties to assign
+2. Available sidewalk crews (with equipment names containing "sidewalk")
+3. Available non-sidewalk crews (with equipment for parking lots, driveways, etc.)
+
+Rules:
+- MUST assign at least one property to a sidewalk crew
+- MUST assign at least one property to a non-sidewalk crew
+- Try to balance workload across all crews
+- Consider proximity if addresses are provided
+- Sidewalk crews can ONLY handle sidewalk properties
+- Non-sidewalk crews can handle parking lots, driveways, roads, etc.
+
+Return ONLY a valid JSON array of assignments with no additional text:
+[
+  {
+    "property_id": 123,
+    "property_name": "Walmart",
+    "contractor_id": 5,
+    "contractor_name": "John Doe",
+    "crew_type": "sidewalk",
+    "reasoning": "Sidewalk crew assigned to handle walkways"
+  }
+]"""
+
+    properties_str = json.dumps([
+        {"id": p['id'], "name": p['name'], "address": p.get('address', 'N/A')}
+        for p in properties
+    ], indent=2)
+
+    sidewalk_crews_str = json.dumps([
+        {"id": c['id'], "name": c['name'], "equipment": c['default_equipment']}
+        for c in sidewalk_crews
+    ], indent=2)
+
+    non_sidewalk_crews_str = json.dumps([
+        {"id": c['id'], "name": c['name'], "equipment": c['default_equipment']}
+        for c in non_sidewalk_crews
+    ], indent=2)
+
+    response = client.chat.completions.create(
+        model="gpt-4o",
+        messages=[
+            {
+                "role": "system",
+                "content": system_prompt
+            },
+            {
+                "role": "user",
+                "content": f"""Properties to assign:
+{properties_str}
+
+Available sidewalk crews:
+{sidewalk_crews_str}
+
+Available non-sidewalk crews:
+{non_sidewalk_crews_str}
+
+Please assign all properties to crews, ensuring proper crew type distribution."""
+            }
+        ],
+        temperature=0.7,
+        max_tokens=4096
+    )
+
+    response_text = response.choices[0].message.content.strip()
+
+    # Extract JSON from response (may be wrapped in markdown code blocks)
+    if "```json" in response_text:
+        response_text = response_text.split("```json")[1].split("```")[0].strip()
+    elif "```" in response_text:
+        response_text = response_text.split("```")[1].split("```")[0].strip()
+
+    assignments = json.loads(response_text)
+
+    # Drop anything that doesn't reference a real property/crew from the request
+    property_ids = {p['id'] for p in properties}
+    crews = {c['id']: c for c in sidewalk_crews + non_sidewalk_crews}
+    valid = [
+        a for a in assignments
+        if a.get('property_id') in property_ids and a.get('contractor_id') in crews
+    ]
+    for a in valid:
+        a['crew_type'] = crews[a['contractor_id']]['crew_type']
+    if not valid:
+        raise ValueError("ChatGPT returned no usable assignments")
+    return valid
 
 
 @router.post("/ai-assign-property-list")
@@ -440,16 +622,22 @@ async def ai_assign_property_list(
     current_user: dict = Depends(get_current_user)
 ):
     """
-    AI-powered property list assignment with sidewalk/non-sidewalk crew validation
+    Property list assignment with sidewalk/non-sidewalk crew validation
     Ensures at least one sidewalk crew and one non-sidewalk crew are assigned
     Only assigns to available crews (not working on open tickets)
+
+    Assignments come from the local solver (services/crew_assignment.py):
+    balanced by estimated service time, travel-aware, deterministic, and
+    explained per property. Pass use_ai=true to ask ChatGPT instead.
     """
     if current_user['role'] not in ['Admin', 'Manager']:
         raise HTTPException(status_code=403, detail="Admin/Manager only")
 
     # Get properties in the list
     properties = fetch_query(
-        """SELECT l.id, l.name, l.address
+        """SELECT l.id, l.name, l.address, l.sqft, l.plow, l.salt,
+                  l.trigger_type, l.trigger_amount, l.contract_tier, l.open_by_time,
+                  l.latitude, l.longitude, l.sidewalk_snow_rate, l.sidewalk_deice_rate
            FROM locations l
            JOIN property_lists_properties plp ON l.id = plp.property_id
            WHERE plp.list_id = %s""",
@@ -459,19 +647,26 @@ async def ai_assign_property_list(
     if not properties:
         raise HTTPException(status_code=404, detail="No properties found in this list")
 
-    # Get available contractors (ALLOWING multiple open tickets per contractor)
+    # Get available contractors (ALLOWING multiple open tickets per contractor),
+    # with their last reported position when they're checked in to the event
     available_contractors = fetch_query(
         """SELECT DISTINCT
             u.id, u.name, u.default_equipment, u.phone_number,
+            ec.last_location_lat, ec.last_location_lon,
             CASE
-                WHEN u.default_equipment LIKE '%sidewalk%' THEN 'sidewalk'
+                WHEN u.default_equipment LIKE '%%sidewalk%%' THEN 'sidewalk'
                 ELSE 'non-sidewalk'
             END as crew_type
         FROM users u
+        LEFT JOIN event_checkins ec
+          ON ec.user_id = u.id
+         AND ec.winter_event_id = %s
+         AND ec.checked_out_at IS NULL
         WHERE u.status = 'active'
           AND u.available_for_assignment = TRUE
           AND u.role IN ('Contractor', 'Subcontractor', 'User')
-        ORDER BY u.id"""
+        ORDER BY u.id""",
+        (request.winter_event_id,)
     )
 
     if not available_contractors:
@@ -508,205 +703,99 @@ async def ai_assign_property_list(
             }
         }
 
-    # Use AI to intelligently assign properties
-    import json
-    import os
-
-    OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-    if not OPENAI_API_KEY:
-        # Try to get from api_keys table
-        api_key_result = fetch_query(
-            "SELECT key_value FROM api_keys WHERE key_name = 'openai_api_key' AND user_id IS NULL LIMIT 1"
-        )
-        if api_key_result and api_key_result[0].get('key_value'):
-            OPENAI_API_KEY = api_key_result[0]['key_value']
-
-    if not OPENAI_API_KEY:
-        # Fallback to round-robin assignment
-        assignments = []
-        all_crews = sidewalk_crews + non_sidewalk_crews
-        crew_index = 0
-
-        for property in properties:
-            contractor = all_crews[crew_index % len(all_crews)]
-            assignments.append({
-                "property_id": property['id'],
-                "property_name": property['name'],
-                "contractor_id": contractor['id'],
-                "contractor_name": contractor['name'],
-                "crew_type": contractor['crew_type']
-            })
-            crew_index += 1
-    else:
-        # Use ChatGPT for intelligent assignment
-        from openai import OpenAI
-
-        client = OpenAI(api_key=OPENAI_API_KEY)
-
-        system_prompt = """You are an AI assistant that assigns snow removal properties to contractors.
-
-Your job is to intelligently assign properties to available crews, ensuring efficient routing and crew utilization.
-
-You will receive:
-1. A list of properties to assign
-2. Available sidewalk crews (with equipment names containing "sidewalk")
-3. Available non-sidewalk crews (with equipment for parking lots, driveways, etc.)
-
-Rules:
-- MUST assign at least one property to a sidewalk crew
-- MUST assign at least one property to a non-sidewalk crew
-- Try to balance workload across all crews
-- Consider proximity if addresses are provided
-- Sidewalk crews can ONLY handle sidewalk properties
-- Non-sidewalk crews can handle parking lots, driveways, roads, etc.
-
-Return ONLY a valid JSON array of assignments with no additional text:
-[
-  {
-    "property_id": 123,
-    "property_name": "Walmart",
-    "contractor_id": 5,
-    "contractor_name": "John Doe",
-    "crew_type": "sidewalk",
-    "reasoning": "Sidewalk crew assigned to handle walkways"
-  }
-]"""
+    assignments = None
+    plan = None
+    method = "solver"
 
-        properties_str = json.dumps([
-            {"id": p['id'], "name": p['name'], "address": p.get('address', 'N/A')}
-            for p in properties
-        ], indent=2)
-
-        sidewalk_crews_str = json.dumps([
-            {"id": c['id'], "name": c['name'], "equipment": c['default_equipment']}
-            for c in sidewalk_crews
-        ], indent=2)
-
-        non_sidewalk_crews_str = json.dumps([
-            {"id": c['id'], "name": c['name'], "equipment": c['default_equipment']}
-            for c in non_sidewalk_crews
-        ], indent=2)
-
-        try:
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": system_prompt
-                    },
-                    {
-                        "role": "user",
-                        "content": f"""Properties to assign:
-{properties_str}
-
-Available sidewalk crews:
-{sidewalk_crews_str}
-
-Available non-sidewalk crews:
-{non_sidewalk_crews_str}
-
-Please assign all properties to crews, ensuring proper crew type distribution."""
-                    }
-                ],
-                temperature=0.7,
-                max_tokens=4096
-            )
-
-            response_text = response.choices[0].message.content.strip()
+    if request.use_ai:
+        api_key = get_openai_api_key()
+        if api_key:
+            try:
+                assignments = await run_in_threadpool(
+                    gpt_assign_properties, api_key, properties, sidewalk_crews, non_sidewalk_crews
+                )
+                method = "ai"
+            except Exception as e:
+                logger.error(f"ChatGPT assignment failed, using solver: {e}", exc_info=True)
 
-            # Extract JSON from response (may be wrapped in markdown code blocks)
-            if "```json" in response_text:
-                response_text = response_text.split("```json")[1].split("```")[0].strip()
-            elif "```" in response_text:
-                response_text = response_text.split("```")[1].split("```")[0].strip()
-
-            assignments = json.loads(response_text)
-        except Exception as e:
-            logger.error(f"ChatGPT assignment failed: {e}", exc_info=True)
-            # Fallback to round-robin
-            assignments = []
-            all_crews = sidewalk_crews + non_sidewalk_crews
-            crew_index = 0
-
-            for property in properties:
-                contractor = all_crews[crew_index % len(all_crews)]
-                assignments.append({
-                    "property_id": property['id'],
-                    "property_name": property['name'],
-                    "contractor_id": contractor['id'],
-                    "contractor_name": contractor['name'],
-                    "crew_type": contractor['crew_type']
-                })
-                crew_index += 1
+    if assignments is None:
+        plan = await run_in_threadpool(solve_assignments, properties, sidewalk_crews, non_sidewalk_crews, distance_matrix)
+        assignments = plan["assignments"]
 
     # Execute assignments in database
+    assigned_by = 'AI' if method == 'ai' else 'Solver'
+    pairs = list(dict.fromkeys((a['property_id'], a['contractor_id']) for a in assignments))
+    crew_types = {(a['property_id'], a['contractor_id']): a['crew_type'] for a in assignments}
+
+    # One lookup for every pair that is already assigned, whatever its status:
+    # (property_id, contractor_id) is unique in property_contractors
+    existing = {}
+    if pairs:
+        placeholders = ", ".join(["(%s, %s)"] * len(pairs))
+        rows = fetch_query(
+            f"""SELECT property_id, contractor_id, acceptance_status FROM property_contractors
+                WHERE (property_id, contractor_id) IN ({placeholders})""",
+            tuple(v for pair in pairs for v in pair)
+        ) or []
+        existing = {(r['property_id'], r['contractor_id']): r['acceptance_status'] for r in rows}
+
+    new_pairs = [pair for pair in pairs if pair not in existing]
+
+    # One multi-row insert for the rest; IGNORE skips a pair assigned since the lookup
+    # instead of failing every other row with it
     assigned_count = 0
-    sms_notifications = []
-
-    for assignment in assignments:
+    insert_failed = False
+    if new_pairs:
         try:
-            # Check if assignment already exists
-            existing = fetch_query(
-                """SELECT id FROM property_contractors
-                   WHERE property_id = %s AND contractor_id = %s AND acceptance_status = 'pending'""",
-                (assignment['property_id'], assignment['contractor_id'])
+            assigned_count = execute_many(
+                """INSERT IGNORE INTO property_contractors
+                   (property_id, contractor_id, acceptance_status, assigned_date, notes)
+                   VALUES (%s, %s, 'pending', NOW(), %s)""",
+                [(property_id, contractor_id,
+                  f"{assigned_by}-assigned for crew type: {crew_types[(property_id, contractor_id)]}")
+                 for property_id, contractor_id in new_pairs]
             )
-
-            if not existing:
-                # Create new assignment
-                execute_query(
-                    """INSERT INTO property_contractors
-                       (property_id, contractor_id, acceptance_status, assigned_date, notes)
-                       VALUES (%s, %s, 'pending', NOW(), %s)""",
-                    (assignment['property_id'], assignment['contractor_id'],
-                     f"AI-assigned for crew type: {assignment['crew_type']}")
-                )
-
-                # Get contractor phone for SMS notification
-                contractor = fetch_query(
-                    "SELECT phone_number FROM users WHERE id = %s",
-                    (assignment['contractor_id'],)
-                )
-
-                if contractor and contractor[0].get('phone_number'):
-                    sms_notifications.append({
-                        "contractor_id": assignment['contractor_id'],
-                        "property_id": assignment['property_id'],
-                        "phone": contractor[0]['phone_number']
-                    })
-
-                assigned_count += 1
+            if assigned_count < len(new_pairs):
+                logger.warning(f"{len(new_pairs) - assigned_count} property assignments already existed at insert time")
         except Exception as e:
-            logger.error(f"Failed to assign property {assignment['property_id']}: {e}", exc_info=True)
+            logger.error(f"Failed to insert property assignments: {e}", exc_info=True)
+            insert_failed = True
+
+    assignment_results = []
+    for property_id, contractor_id in pairs:
+        result = {"property_id": property_id, "contractor_id": contractor_id}
+        if (property_id, contractor_id) in existing:
+            result["status"] = "already_assigned"
+            result["acceptance_status"] = existing[(property_id, contractor_id)]
+        else:
+            result["status"] = "error" if insert_failed else "assigned"
+        assignment_results.append(result)
+    if insert_failed:
+        new_pairs = []
+
+    # Property names/addresses and crew phones/equipment are already loaded above
+    property_info = {p['id']: p for p in properties}
+    contractor_info = {c['id']: c for c in available_contractors}
 
-    # Send SMS notifications
-    if sms_notifications:
-        from sms_routes import send_sms
-        for notif in sms_notifications:
-            try:
-                property_info = fetch_query(
-                    "SELECT name, address FROM locations WHERE id = %s",
-                    (notif['property_id'],)
-                )
-
-                contractor_info = fetch_query(
-                    "SELECT name, default_equipment FROM users WHERE id = %s",
-                    (notif['contractor_id'],)
-                )
-
-                if property_info and contractor_info:
-                    message = f"""📍 New Assignment!
+    sms_notifications = []
+    for property_id, contractor_id in new_pairs:
+        prop = property_info[property_id]
+        contractor = contractor_info.get(contractor_id)
+        if contractor and contractor.get('phone_number'):
+            message = f"""📍 New Assignment!
 
-Property: {property_info[0]['name']}
-Address: {property_info[0]['address']}
-Your Equipment: {contractor_info[0]['default_equipment']}
+Property: {prop['name']}
+Address: {prop['address']}
+Your Equipment: {contractor['default_equipment']}
 
 Reply START / OMW when you begin work."""
+            sms_notifications.append((contractor['phone_number'], message))
 
-                    send_sms(notif['phone'], message)
-            except Exception as e:
-                logger.error(f"Failed to send SMS notification: {e}", exc_info=True)
+    # Send SMS notifications concurrently
+    sms_sent = 0
+    if sms_notifications:
+        from routes.sms_routes import send_sms_batch
+        sms_sent = await run_in_threadpool(send_sms_batch, sms_notifications)
 
     return {
         "success": True,
@@ -714,7 +803,10 @@ Reply START / OMW when you begin work."""
         "assigned_count": assigned_count,
         "total_properties": len(properties),
         "assignments": assignments,
-        "sms_notifications_sent": len(sms_notifications),
+        "assignment_results": assignment_results,
+        "method": method,
+        "plan": {"crews": plan["crews"], "summary": plan["summary"]} if plan else None,
+        "sms_notifications_sent": sms_sent,
         "available_crews": {
             "sidewalk": len(sidewalk_crews),
             "non_sidewalk": len(non_sidewalk_crews),
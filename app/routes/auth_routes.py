@@ -1,8 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Form
+from fastapi import APIRouter, Depends, HTTPException, status, Form, Request, Response
 from fastapi.security import OAuth2PasswordRequestForm
 from db import execute_query, fetch_query
 from auth import hash_password, verify_password, create_access_token, decode_access_token
 from utils.logger import get_logger
+from services.ai_context import invalidate_user_context
+from services.sms_conversations import conversation_store
+from utils.conditional import drop_validators, not_modified
 
 logger = get_logger(__name__)
 from pydantic import BaseModel
@@ -37,8 +40,12 @@ def get_users(current_user: dict = Depends(get_current_user)):
     return users if users else []
 
 @router.get("/contractors/")
-def get_contractors():
+def get_contractors(request: Request, response: Response):
     """Get all active users (anyone can be assigned to plow in a snowstorm)"""
+    cached = not_modified(request, response, ("users",))
+    if cached:
+        return cached
+
     query = """
         SELECT id, name, phone, email, role, default_equipment
         FROM users
@@ -46,6 +53,8 @@ def get_contractors():
         ORDER BY name
     """
     contractors = fetch_query(query)
+    if contractors is None:
+        drop_validators(response)
     return contractors if contractors else []
 
 @router.post("/add-user/")
@@ -74,6 +83,8 @@ def update_user(user_id: int, user: User, current_user: dict = Depends(get_curre
     query = "UPDATE users SET name = %s, phone = %s, address = %s, username = %s, email = %s, role = %s, contractor_id = %s, default_equipment = %s, password = %s, password_hash = %s, updated_at = NOW() WHERE id = %s"
     values = (user.name, user.phone, user.address, username, user.email, user.role, user.contractor_id, user.default_equipment, hashed_pw, hashed_pw, user_id)
     execute_query(query, values)
+    invalidate_user_context(user_id)
+    conversation_store.forget_user(user_id)
     return {"message": "User updated successfully!"}
 
 @router.delete("/delete-user/{user_id}")
@@ -81,6 +92,7 @@ def delete_user(user_id: int, current_user: dict = Depends(get_current_user)):
     if current_user["role"] != "Admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admins only!")
     execute_query("DELETE FROM users WHERE id = %s", (user_id,))
+    conversation_store.forget_user(user_id)
     return {"message": "User deleted successfully!"}
 
 #@router.post("/api/login/")
@@ -1,12 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta
 from db import fetch_query, execute_query
 from auth import get_current_user
+from services.breadcrumbs import breadcrumbs
+from services.crew_locations import live_crews
+from services.dispatch import dispatch_feed
+from services import geofence, proximity
+from utils.cache import TTLCache
+from utils.spatial import to_float
+from utils.event_stream import sse_response
 
 router = APIRouter()
 
+MAX_BREADCRUMBS_PER_REQUEST = 2000
+
+# (event, user) pairs that have checked in to the event, so repeat uploads skip the lookup
+_breadcrumb_crews = TTLCache(ttl_seconds=600, maxsize=5000)
+
 class CheckInRequest(BaseModel):
     winter_event_id: int
     equipment_in_use: Optional[str] = None
@@ -21,6 +33,14 @@ class LocationUpdate(BaseModel):
     current_property_id: Optional[int] = None
     status: Optional[str] = None
 
+class BreadcrumbPoint(BaseModel):
+    lat: float
+    lon: float
+    t: datetime
+
+class BreadcrumbBatch(BaseModel):
+    points: List[BreadcrumbPoint]
+
 class StatusUpdate(BaseModel):
     status: str  # checked_in, working, completed, unavailable
     current_property_id: Optional[int] = None
@@ -59,6 +79,7 @@ async def check_in(event_id: int, data: CheckInRequest, current_user: dict = Dep
             data.notes,
             existing_checkin[0]["id"]
         ))
+        live_crews.refresh(event_id, user_id)
 
         return {
             "message": "Check-in updated successfully",
@@ -78,6 +99,7 @@ async def check_in(event_id: int, data: CheckInRequest, current_user: dict = Dep
         data.equipment_in_use or current_user.get("default_equipment"),
         data.notes
     ))
+    live_crews.refresh(event_id, user_id)
 
     return {
         "message": "Checked in successfully",
@@ -108,6 +130,7 @@ async def check_out(event_id: int, data: CheckOutRequest, current_user: dict = D
 
     checkout_note = f"\n[Checkout] {data.notes}" if data.notes else ""
     execute_query(update_query, (checkout_note, checkin[0]["id"]))
+    live_crews.refresh(event_id, user_id)
 
     return {"message": "Checked out successfully"}
 
@@ -136,27 +159,8 @@ async def get_event_checkins(event_id: int, current_user: dict = Depends(get_cur
 
 @router.get("/events/{event_id}/checkins/active")
 async def get_active_checkins(event_id: int, current_user: dict = Depends(get_current_user)):
-    """Get currently checked-in crews for an event"""
-    query = """
-        SELECT
-            ec.*,
-            u.name as user_name,
-            u.role as user_role,
-            u.default_equipment,
-            l.name as current_property_name,
-            l.address as current_property_address,
-            TIMESTAMPDIFF(MINUTE, ec.checked_in_at, NOW()) as minutes_active
-        FROM event_checkins ec
-        JOIN users u ON ec.user_id = u.id
-        LEFT JOIN locations l ON ec.current_property_id = l.id
-        WHERE ec.winter_event_id = %s
-        AND ec.checked_out_at IS NULL
-        AND ec.status IN ('checked_in', 'working')
-        ORDER BY ec.status DESC, ec.checked_in_at ASC
-    """
-
-    checkins = fetch_query(query, (event_id,))
-    return checkins
+    """Get currently checked-in crews for an event (served from the live crew store)"""
+    return live_crews.active_checkins(event_id)
 
 @router.get("/events/{event_id}/available-crews")
 async def get_available_crews(event_id: int, current_user: dict = Depends(get_current_user)):
@@ -164,60 +168,155 @@ async def get_available_crews(event_id: int, current_user: dict = Depends(get_cu
     if current_user["role"] not in ["Admin", "Manager"]:
         raise HTTPException(status_code=403, detail="Admin/Manager access required")
 
-    query = """
-        SELECT
-            ec.*,
-            u.name as user_name,
-            u.role as user_role,
-            u.phone as user_phone,
-            TIMESTAMPDIFF(MINUTE, ec.last_location_update, NOW()) as minutes_since_location_update
-        FROM event_checkins ec
-        JOIN users u ON ec.user_id = u.id
-        WHERE ec.winter_event_id = %s
-        AND ec.checked_out_at IS NULL
-        AND ec.status = 'checked_in'
-        AND ec.current_property_id IS NULL
-        ORDER BY ec.checked_in_at ASC
+    return live_crews.available_crews(event_id)
+
+@router.get("/events/{event_id}/dispatch/stream")
+async def stream_dispatch_events(event_id: int, request: Request, current_user: dict = Depends(get_current_user)):
+    """
+    Server-sent events for dispatch views of one winter event (Admin/Manager only).
+    Load the crew and board endpoints once, then apply crew, location,
+    route_stop and assignment events; reconnect with Last-Event-ID to resume.
     """
+    if current_user["role"] not in ["Admin", "Manager"]:
+        raise HTTPException(status_code=403, detail="Admin/Manager access required")
 
-    crews = fetch_query(query, (event_id,))
-    return crews
+    return sse_response(dispatch_feed(event_id), request)
+
+@router.get("/events/{event_id}/properties/{property_id}/nearest-crews")
+async def get_nearest_crews(
+    event_id: int,
+    property_id: int,
+    k: int = 5,
+    max_miles: Optional[float] = None,
+    include_busy: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    """Closest checked-in crews to a property, nearest first (Admin/Manager only)"""
+    if current_user["role"] not in ["Admin", "Manager"]:
+        raise HTTPException(status_code=403, detail="Admin/Manager access required")
 
-@router.put("/events/{event_id}/checkin/location")
-async def update_location(event_id: int, data: LocationUpdate, current_user: dict = Depends(get_current_user)):
-    """Update current location and property"""
-    user_id = int(current_user["sub"])
+    position = proximity.property_position(property_id)
+    if not position:
+        raise HTTPException(status_code=404, detail="Property not found or has no coordinates")
 
-    # Find active check-in
-    checkin = fetch_query(
-        "SELECT id FROM event_checkins WHERE winter_event_id = %s AND user_id = %s AND checked_out_at IS NULL",
-        (event_id, user_id)
+    crews = proximity.nearest_crews(
+        event_id, position[0], position[1], k=min(k, 50), max_miles=max_miles, available_only=not include_busy
     )
+    return {"property_id": property_id, "lat": position[0], "lon": position[1], "crews": crews}
+
+@router.get("/events/{event_id}/crews/{user_id}/nearby-properties")
+async def get_nearby_properties(
+    event_id: int,
+    user_id: int,
+    k: int = 10,
+    max_miles: Optional[float] = None,
+    include_serviced: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    """Closest properties to a crew's last position not yet ticketed in this event (Admin/Manager, or the crew)"""
+    if current_user["role"] not in ["Admin", "Manager"] and int(current_user["sub"]) != user_id:
+        raise HTTPException(status_code=403, detail="Admin/Manager access required")
 
-    if not checkin:
+    crew = live_crews.get(event_id, user_id)
+    if not crew:
         raise HTTPException(status_code=404, detail="No active check-in found")
 
-    # Update location
-    update_query = """
-        UPDATE event_checkins
-        SET last_location_lat = %s,
-            last_location_lon = %s,
-            last_location_update = NOW(),
-            current_property_id = %s,
-            status = COALESCE(%s, status)
-        WHERE id = %s
-    """
+    lat, lon = to_float(crew.get("last_location_lat")), to_float(crew.get("last_location_lon"))
+    if lat is None or lon is None:
+        raise HTTPException(status_code=400, detail="Crew has not reported a location yet")
 
-    execute_query(update_query, (
+    properties = proximity.nearby_properties(
+        event_id, lat, lon, k=min(k, 100), max_miles=max_miles, unserviced_only=not include_serviced
+    )
+    return {"user_id": user_id, "lat": lat, "lon": lon, "properties": properties}
+
+@router.get("/events/{event_id}/crews/{user_id}/geofence")
+async def get_crew_geofence_visit(event_id: int, user_id: int, current_user: dict = Depends(get_current_user)):
+    """The property a crew is currently inside (by geofence), with a suggested ticket start time"""
+    if current_user["role"] not in ["Admin", "Manager"] and int(current_user["sub"]) != user_id:
+        raise HTTPException(status_code=403, detail="Admin/Manager access required")
+
+    return {"user_id": user_id, **geofence.crew_visit(event_id, user_id)}
+
+@router.put("/events/{event_id}/checkin/location")
+async def update_location(event_id: int, data: LocationUpdate, current_user: dict = Depends(get_current_user)):
+    """Update current location and property (applied in memory, written to the database in batches)"""
+    user_id = int(current_user["sub"])
+
+    crew = live_crews.record_ping(
+        event_id,
+        user_id,
         data.lat,
         data.lon,
-        data.current_property_id,
-        data.status,
-        checkin[0]["id"]
-    ))
+        current_property_id=data.current_property_id,
+        status=data.status
+    )
+
+    if not crew:
+        raise HTTPException(status_code=404, detail="No active check-in found")
 
     return {"message": "Location updated successfully"}
 
+@router.post("/events/{event_id}/breadcrumbs")
+async def upload_breadcrumbs(event_id: int, data: BreadcrumbBatch, current_user: dict = Depends(get_current_user)):
+    """Upload a batch of GPS points recorded by the mobile app (may include points buffered offline)"""
+    user_id = int(current_user["sub"])
+
+    if len(data.points) > MAX_BREADCRUMBS_PER_REQUEST:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BREADCRUMBS_PER_REQUEST} points per upload")
+
+    if not _breadcrumb_crews.get((event_id, user_id)):
+        checkin = fetch_query(
+            "SELECT id FROM event_checkins WHERE winter_event_id = %s AND user_id = %s LIMIT 1",
+            (event_id, user_id)
+        )
+        if not checkin:
+            raise HTTPException(status_code=404, detail="No check-in found for this event")
+        _breadcrumb_crews.set((event_id, user_id), True)
+
+    latest_allowed = datetime.now() + timedelta(minutes=5)
+    points = []
+    rejected = 0
+    for point in data.points:
+        # Store local time like the rest of the schema
+        moment = point.t.astimezone().replace(tzinfo=None) if point.t.tzinfo else point.t
+        if not (-90 <= point.lat <= 90 and -180 <= point.lon <= 180) or moment > latest_allowed:
+            rejected += 1
+            continue
+        points.append((moment, point.lat, point.lon))
+
+    result = breadcrumbs.add_points(event_id, user_id, points) if points else {"accepted": 0, "duplicates": 0}
+
+    # A fresh point doubles as a location ping for the live dispatch view
+    if points:
+        newest = max(points)
+        crew = live_crews.get(event_id, user_id)
+        if crew and newest[0] >= datetime.now() - timedelta(minutes=2):
+            live_crews.record_ping(event_id, user_id, newest[1], newest[2],
+                                   current_property_id=crew.get("current_property_id"))
+
+    return {**result, "rejected": rejected}
+
+@router.get("/events/{event_id}/crews/{user_id}/track")
+async def get_crew_track(
+    event_id: int,
+    user_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """A crew's GPS track for the event, optionally limited to a time window (Admin/Manager, or the crew)"""
+    if current_user["role"] not in ["Admin", "Manager"] and int(current_user["sub"]) != user_id:
+        raise HTTPException(status_code=403, detail="Admin/Manager access required")
+
+    start = start.astimezone().replace(tzinfo=None) if start and start.tzinfo else start
+    end = end.astimezone().replace(tzinfo=None) if end and end.tzinfo else end
+    if start and end and end < start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+
+    points = breadcrumbs.track(event_id, user_id, start, end)
+    return {"user_id": user_id, "winter_event_id": event_id, "point_count": len(points), "points": points}
+
 @router.put("/events/{event_id}/checkin/status")
 async def update_status(event_id: int, data: StatusUpdate, current_user: dict = Depends(get_current_user)):
     """Update check-in status (working, completed, unavailable)"""
@@ -254,6 +353,7 @@ async def update_status(event_id: int, data: StatusUpdate, current_user: dict =
         status_note,
         checkin[0]["id"]
     ))
+    live_crews.refresh(event_id, user_id)
 
     return {"message": "Status updated successfully", "status": data.status}
 
@@ -262,24 +362,15 @@ async def get_my_checkin(event_id: int, current_user: dict = Depends(get_current
     """Get current user's check-in status for an event"""
     user_id = int(current_user["sub"])
 
-    query = """
-        SELECT
-            ec.*,
-            l.name as current_property_name,
-            TIMESTAMPDIFF(MINUTE, ec.checked_in_at, NOW()) as minutes_active
-        FROM event_checkins ec
-        LEFT JOIN locations l ON ec.current_property_id = l.id
-        WHERE ec.winter_event_id = %s AND ec.user_id = %s AND ec.checked_out_at IS NULL
-        ORDER BY ec.checked_in_at DESC
-        LIMIT 1
-    """
-
-    checkin = fetch_query(query, (event_id, user_id))
+    crew = live_crews.get(event_id, user_id)
 
-    if not checkin:
+    if not crew:
         return {"checked_in": False}
 
+    checkin = {k: v for k, v in crew.items() if k not in ("user_name", "user_role", "default_equipment", "user_phone", "current_property_address")}
+    checkin["minutes_active"] = int((datetime.now() - crew["checked_in_at"]).total_seconds() // 60) if crew.get("checked_in_at") else None
+
     return {
         "checked_in": True,
-        "checkin": checkin[0]
+        "checkin": checkin
     }
@@ -1,7 +1,8 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from pydantic import BaseModel
 from db import execute_query, fetch_query
 from auth import get_current_user
+from utils.conditional import drop_validators, not_modified
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
@@ -14,13 +15,20 @@ class EquipmentRate(BaseModel):
     description: str | None = None
 
 @router.get("/equipment-rates/")
-def get_equipment_rates(current_user: dict = Depends(get_current_user)):
+def get_equipment_rates(request: Request, response: Response, current_user: dict = Depends(get_current_user)):
     """Get all equipment with their hourly rates (pricing hidden for Subcontractors)"""
+    hide_pricing = current_user["role"] in ["Subcontractor", "User"]
+    cached = not_modified(request, response, ("equipment_rates",), variant="unpriced" if hide_pricing else "")
+    if cached:
+        return cached
+
     query = "SELECT id, equipment_name, hourly_rate, description FROM equipment_rates ORDER BY equipment_name"
     rates = fetch_query(query)
+    if rates is None:
+        drop_validators(response)
     
     # Hide pricing information for Subcontractors and Users
-    if rates and current_user["role"] in ["Subcontractor", "User"]:
+    if rates and hide_pricing:
         for rate in rates:
             rate["hourly_rate"] = None
     
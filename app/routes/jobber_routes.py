@@ -13,6 +13,7 @@ import requests
 import secrets
 from auth import get_current_user
 from utils.logger import get_logger
+from utils.http_clients import get_session
 
 logger = get_logger(__name__)
 from db import fetch_query, execute_query
@@ -112,7 +113,7 @@ async def jobber_callback(code: str, state: str):
     }
 
     try:
-        response = requests.post(JOBBER_TOKEN_URL, data=token_data)
+        response = get_session().post(JOBBER_TOKEN_URL, data=token_data)
         response.raise_for_status()
         tokens = response.json()
     except Exception as e:
@@ -196,7 +197,7 @@ def get_jobber_access_token(tenant_id: int = 1) -> str:
         }
 
         try:
-            response = requests.post(JOBBER_TOKEN_URL, data=token_data)
+            response = get_session().post(JOBBER_TOKEN_URL, data=token_data)
             response.raise_for_status()
             tokens = response.json()
 
@@ -237,7 +238,7 @@ def execute_jobber_query(query: str, variables: dict = None, tenant_id: int = 1)
         payload["variables"] = variables
 
     try:
-        response = requests.post(JOBBER_API_URL, json=payload, headers=headers)
+        response = get_session().post(JOBBER_API_URL, json=payload, headers=headers)
         response.raise_for_status()
         result = response.json()
 
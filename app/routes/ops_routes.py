@@ -3,6 +3,7 @@ from pydantic import BaseModel
 from db import execute_query, fetch_query
 from auth import get_current_user
 from utils.logger import get_logger
+from services.ai_context import invalidate_all_user_contexts, invalidate_user_context
 
 logger = get_logger(__name__)
 router = APIRouter()
@@ -108,6 +109,7 @@ def submit_winter_log(log: WinterOpsLog, current_user: dict = Depends(get_curren
         winter_event_id
     )
     result = execute_query(query, values)
+    invalidate_user_context(log.contractor_id, log.user_id)
 
     # Get the ID of the inserted log
     log_id = result if result else None
@@ -159,7 +161,7 @@ def close_winter_log(log_id: int, time_out: str, current_user: dict = Depends(ge
 
     # Verify this log belongs to the current user and is open
     verify_query = """
-        SELECT id, user_id, status FROM winter_ops_logs
+        SELECT id, user_id, contractor_id, status FROM winter_ops_logs
         WHERE id = %s
     """
     log = fetch_query(verify_query, (log_id,))
@@ -180,6 +182,7 @@ def close_winter_log(log_id: int, time_out: str, current_user: dict = Depends(ge
         WHERE id = %s
     """
     execute_query(query, (time_out, log_id))
+    invalidate_user_context(log[0]['contractor_id'], log[0]['user_id'])
 
     return {"message": "Log closed successfully", "log_id": log_id}
 
@@ -190,7 +193,7 @@ def update_winter_log(log_id: int, log: WinterOpsLog, current_user: dict = Depen
     user_role = current_user["role"]
 
     # Check if log exists and get its owner
-    existing_log = fetch_query("SELECT user_id FROM winter_ops_logs WHERE id = %s", (log_id,))
+    existing_log = fetch_query("SELECT user_id, contractor_id FROM winter_ops_logs WHERE id = %s", (log_id,))
     if not existing_log:
         raise HTTPException(status_code=404, detail="Log not found")
 
@@ -240,6 +243,7 @@ def update_winter_log(log_id: int, log: WinterOpsLog, current_user: dict = Depen
             log.customer_provided, log.notes, winter_event_id, log_id
         )
         execute_query(query, values)
+        invalidate_user_context(existing_log[0]['contractor_id'], log_owner_id, log.contractor_id, log.user_id)
 
         message = "Winter log updated successfully!"
         if time_based_event:
@@ -258,6 +262,7 @@ def delete_winter_log(log_id: int, current_user: dict = Depends(get_current_user
 
     try:
         execute_query("DELETE FROM winter_ops_logs WHERE id = %s", (log_id,))
+        invalidate_all_user_contexts()
         return {"message": "Winter log deleted successfully!"}
     except Exception as e:
         logger.error(f"Failed to delete winter log: {str(e)}", exc_info=True)
@@ -1,16 +1,29 @@
 # Handles add/update/delete/fetch property routes
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from db import fetch_query, execute_query
 from auth import get_current_user
 from utils.logger import get_logger
+from services.ai_context import invalidate_all_user_contexts, invalidate_user_context
+from services.proximity import invalidate_properties
+from services.geofence import DEFAULT_RADIUS_FEET, fence_outline
+from services.property_import import PropertyImport, SUPPORTED_EXTENSIONS, read_chunks
+from utils.conditional import drop_validators, not_modified
 
 logger = get_logger(__name__)
+import json
 import pandas as pd
-from io import BytesIO
+from datetime import date
 
 router = APIRouter()
 
+# Tables each cached listing reads (for ETags); parents included since deletes cascade
+PROPERTIES_TABLES = ("locations",)
+BOARD_TABLES = ("locations", "property_contractors", "users")
+MY_PROPERTIES_TABLES = ("locations", "property_contractors", "users", "winter_ops_logs")
+
 class PropertyData(BaseModel):
     name: str
     address: str
@@ -31,6 +44,10 @@ class PropertyData(BaseModel):
 class PropertyUpdate(PropertyData):
     id: int
 
+class PropertyGeofence(BaseModel):
+    radius_feet: int | None = None  # None = default radius
+    polygon: list[list[float]] | None = None  # [[lat, lon], ...]; overrides the radius
+
 @router.post("/add-property/")
 def add_property(property_data: PropertyData):
     # Check if property with this address already exists
@@ -66,14 +83,21 @@ def add_property(property_data: PropertyData):
     )
     try:
         execute_query(query, params)
+        invalidate_properties()
         return {"message": "Property added successfully"}
     except Exception as e:
         logger.error(f"Failed to add property: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to add property: {str(e)}")
 
 @router.get("/properties/")
-def get_properties():
+def get_properties(request: Request, response: Response):
+    cached = not_modified(request, response, PROPERTIES_TABLES)
+    if cached:
+        return cached
+
     properties = fetch_query("SELECT * FROM locations")
+    if properties is None:
+        drop_validators(response)
     # Return empty array instead of 404 if no properties exist
     return properties if properties else []
 
@@ -106,6 +130,8 @@ def update_property(property_data: PropertyUpdate):
     )
     try:
         execute_query(query, params)
+        invalidate_all_user_contexts()
+        invalidate_properties()
         return {"message": "Property updated successfully"}
     except Exception as e:
         logger.error(f"Failed to update property: {str(e)}", exc_info=True)
@@ -116,6 +142,8 @@ def delete_property(property_id: int):
     query = "DELETE FROM locations WHERE id = %s"
     try:
         execute_query(query, (property_id,))
+        invalidate_all_user_contexts()
+        invalidate_properties()
         return {"message": "Property deleted successfully"}
     except Exception as e:
         logger.error(f"Failed to delete property: {str(e)}", exc_info=True)
@@ -124,128 +152,86 @@ def delete_property(property_id: int):
 @router.post("/bulk-import-properties/")
 async def bulk_import_properties(
     file: UploadFile = File(...),
+    update_existing: bool = False,
+    stream: bool = False,
     current_user: dict = Depends(get_current_user)
 ):
     """
-    Bulk import properties from Excel file.
-    Expected Excel structure (from 'locations' sheet):
+    Bulk import properties from an Excel ('locations' sheet) or CSV file.
+    Expected columns:
     - Property Name
     - Address
     - trigger (ignored)
     - area manager
     - Lot Sq Ft
     - PLOW/SALT (format: "Yes/Yes", "Yes/No", etc.)
+
+    Properties whose address already exists are skipped, or updated from the
+    file with update_existing=true. With stream=true the response is NDJSON:
+    one line per row as it is processed ({"row", "status", ...}), then a
+    {"summary": ...} line.
     """
     if current_user["role"] not in ["Admin", "Manager"]:
         raise HTTPException(status_code=403, detail="Only Admins and Managers can import properties")
 
     # Validate file extension
-    if not file.filename.endswith(('.xlsx', '.xls')):
-        raise HTTPException(status_code=400, detail="Only Excel files (.xlsx, .xls) are supported")
+    if not file.filename.lower().endswith(SUPPORTED_EXTENSIONS):
+        raise HTTPException(status_code=400, detail="Only Excel (.xlsx, .xls) and CSV files are supported")
 
     try:
-        # Read Excel file
-        contents = await file.read()
-        df = pd.read_excel(BytesIO(contents), sheet_name='locations')
-
-        # Clean up column names (remove leading/trailing spaces)
-        df.columns = df.columns.str.strip()
-
-        # Validate required columns
-        required_columns = ['Property Name', 'Address', 'area manager', 'Lot Sq Ft', 'PLOW/SALT']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        if missing_columns:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Missing required columns: {', '.join(missing_columns)}"
-            )
-
-        # Filter out rows where Property Name is null (like index rows)
-        df = df[df['Property Name'].notna()]
-
-        imported_count = 0
-        skipped_count = 0
-        errors = []
-
-        for index, row in df.iterrows():
-            try:
-                # Parse PLOW/SALT field
-                plow_salt = str(row['PLOW/SALT']).strip().lower()
-                plow = 'yes' in plow_salt.split('/')[0] if '/' in plow_salt else False
-                salt = 'yes' in plow_salt.split('/')[1] if '/' in plow_salt and len(plow_salt.split('/')) > 1 else False
-
-                # Convert sqft to integer
-                sqft = int(row['Lot Sq Ft'])
-
-                address = str(row['Address']).strip()
-
-                # Check if property with this address already exists
-                check_query = "SELECT id FROM locations WHERE address = %s"
-                existing = fetch_query(check_query, (address,))
-
-                if existing:
-                    # Property already exists, skip it
-                    skipped_count += 1
-                    continue
-
-                # Insert property
-                query = """
-                    INSERT INTO locations (name, address, sqft, area_manager, plow, salt)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                """
-                params = (
-                    str(row['Property Name']).strip(),
-                    address,
-                    sqft,
-                    str(row['area manager']).strip(),
-                    plow,
-                    salt
-                )
-                execute_query(query, params)
-                imported_count += 1
-
-            except Exception as e:
-                errors.append(f"Row {index + 2}: {str(e)}")
-
-        # Prepare response
-        message = f"Successfully imported {imported_count} properties"
-        if skipped_count > 0:
-            message += f", skipped {skipped_count} duplicates"
-        if errors:
-            message += f". {len(errors)} errors occurred."
-            return {
-                "message": message,
-                "count": imported_count,
-                "skipped": skipped_count,
-                "errors": errors[:10]  # Limit to first 10 errors
-            }
-
-        return {
-            "message": message,
-            "count": imported_count,
-            "skipped": skipped_count
-        }
-
+        chunks = await run_in_threadpool(read_chunks, file.file, file.filename)
     except pd.errors.EmptyDataError:
-        raise HTTPException(status_code=400, detail="Excel file is empty")
+        raise HTTPException(status_code=400, detail="File is empty")
     except ValueError as e:
-        if "Worksheet named 'locations' not found" in str(e):
-            raise HTTPException(
-                status_code=400,
-                detail="Excel file must contain a sheet named 'locations'"
-            )
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to read import file: {str(e)}")
+
+    importer = PropertyImport(update_existing=update_existing)
+
+    def finish():
+        if importer.counts["imported"] or importer.counts["updated"]:
+            invalidate_properties()
+
+    if stream:
+        def lines():
+            try:
+                for result in importer.results(chunks):
+                    yield json.dumps(result) + "\n"
+            except Exception as e:
+                logger.error(f"Property import failed: {str(e)}", exc_info=True)
+                yield json.dumps({"error": f"Failed to import properties: {str(e)}"}) + "\n"
+            finally:
+                finish()
+            yield json.dumps({"summary": importer.summary()}) + "\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    try:
+        results = await run_in_threadpool(lambda: list(importer.results(chunks)))
+    except Exception as e:
+        finish()
         raise HTTPException(status_code=500, detail=f"Failed to import properties: {str(e)}")
+    finish()
+
+    response = importer.summary()
+    errors = [f"Row {r['row']}: {r['error']}" for r in results if r["status"] == "error"]
+    if errors:
+        response["errors"] = errors
+    return response
 
 # ===== PROPERTY-CONTRACTOR ASSIGNMENT ROUTES (KANBAN BOARD) =====
 
 @router.get("/properties/board/")
-def get_property_board(current_user: dict = Depends(get_current_user)):
+def get_property_board(request: Request, response: Response, current_user: dict = Depends(get_current_user)):
     """
     Get all properties with their assigned contractors for Kanban board view.
     Returns properties with nested contractor lists.
     """
+    cached = not_modified(request, response, BOARD_TABLES)
+    if cached:
+        return cached
+
     try:
         # Get all properties
         properties_query = """
@@ -257,6 +243,8 @@ def get_property_board(current_user: dict = Depends(get_current_user)):
         properties = fetch_query(properties_query)
 
         if not properties:
+            if properties is None:
+                drop_validators(response)
             return []
 
         # Get all contractor assignments grouped by property
@@ -378,6 +366,7 @@ def assign_contractor_to_property(
     """
     try:
         execute_query(query, (property_id, assignment.contractor_id, assignment.is_primary))
+        invalidate_user_context(assignment.contractor_id)
         return {"message": "Contractor assigned successfully"}
     except Exception as e:
         logger.error(f"Failed to assign contractor: {str(e)}", exc_info=True)
@@ -396,6 +385,7 @@ def remove_contractor_from_property(
     query = "DELETE FROM property_contractors WHERE property_id = %s AND contractor_id = %s"
     try:
         execute_query(query, (property_id, contractor_id))
+        invalidate_user_context(contractor_id)
         return {"message": "Contractor removed from property"}
     except Exception as e:
         logger.error(f"Failed to remove contractor: {str(e)}", exc_info=True)
@@ -429,11 +419,65 @@ def set_primary_contractor(
         logger.error(f"Failed to set primary contractor: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to set primary contractor: {str(e)}")
 
+@router.get("/properties/{property_id}/geofence")
+def get_property_geofence(property_id: int, current_user: dict = Depends(get_current_user)):
+    """The fence used to detect crews arriving at and leaving a property"""
+    rows = fetch_query(
+        "SELECT id, latitude, longitude, geofence_radius_feet, geofence_polygon FROM locations WHERE id = %s",
+        (property_id,)
+    )
+    if not rows:
+        raise HTTPException(status_code=404, detail="Property not found")
+
+    row = rows[0]
+    polygon = json.loads(row["geofence_polygon"]) if isinstance(row["geofence_polygon"], str) else row["geofence_polygon"]
+    radius_feet = row["geofence_radius_feet"] or DEFAULT_RADIUS_FEET
+    if not polygon and row["latitude"] is not None and row["longitude"] is not None:
+        outline = fence_outline(float(row["latitude"]), float(row["longitude"]), radius_feet)
+    else:
+        outline = polygon
+    return {
+        "property_id": property_id,
+        "type": "polygon" if polygon else "radius",
+        "radius_feet": radius_feet,
+        "polygon": polygon,
+        "outline": outline
+    }
+
+@router.put("/properties/{property_id}/geofence")
+def update_property_geofence(property_id: int, fence: PropertyGeofence, current_user: dict = Depends(get_current_user)):
+    """Set a property's fence radius or outline (Admin/Manager only)"""
+    if current_user["role"] not in ["Admin", "Manager"]:
+        raise HTTPException(status_code=403, detail="Only Admins and Managers can edit geofences")
+
+    if fence.polygon is not None and (
+        len(fence.polygon) < 3 or any(len(p) != 2 or not (-90 <= p[0] <= 90 and -180 <= p[1] <= 180) for p in fence.polygon)
+    ):
+        raise HTTPException(status_code=400, detail="polygon needs at least 3 [lat, lon] points")
+    if fence.radius_feet is not None and not 25 <= fence.radius_feet <= 5280:
+        raise HTTPException(status_code=400, detail="radius_feet must be between 25 and 5280")
+
+    try:
+        execute_query(
+            "UPDATE locations SET geofence_radius_feet = %s, geofence_polygon = %s WHERE id = %s",
+            (fence.radius_feet, json.dumps(fence.polygon) if fence.polygon else None, property_id)
+        )
+        invalidate_properties()
+        return {"message": "Geofence updated"}
+    except Exception as e:
+        logger.error(f"Failed to update geofence: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Failed to update geofence: {str(e)}")
+
 @router.get("/my-properties/")
-def get_my_assigned_properties(current_user: dict = Depends(get_current_user)):
+def get_my_assigned_properties(request: Request, response: Response, current_user: dict = Depends(get_current_user)):
     """Get all properties assigned to the current user"""
     user_id = int(current_user["sub"])
 
+    # has_active_ticket is for today, so the date is part of the version
+    cached = not_modified(request, response, MY_PROPERTIES_TABLES, variant=f"{user_id}:{date.today()}")
+    if cached:
+        return cached
+
     query = """
         SELECT
             l.id, l.name, l.address, l.sqft, l.area_manager, l.plow, l.salt,
@@ -451,6 +495,8 @@ def get_my_assigned_properties(current_user: dict = Depends(get_current_user)):
 
     try:
         properties = fetch_query(query, (user_id, user_id))
+        if properties is None:
+            drop_validators(response)
         return properties if properties else []
     except Exception as e:
         logger.error(f"Failed to get user's properties: {str(e)}", exc_info=True)
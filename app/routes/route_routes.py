@@ -1,8 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List, Optional
-from db import fetch_query, execute_query
+from datetime import datetime
+from db import fetch_query, execute_query, transaction
 from auth import get_current_user
+from services.distance_matrix import distance_matrix
+from services.route_eta import route_etas
+from services.route_optimizer import optimize_route
 
 router = APIRouter()
 
@@ -32,6 +37,22 @@ class RouteAssignUsers(BaseModel):
     route_id: int
     user_ids: List[int]
 
+class RouteOrder(BaseModel):
+    property_ids: List[int]  # every property on the route, in visiting order
+
+class RouteUserSet(BaseModel):
+    user_ids: List[int]
+
+class RoutePropertySet(BaseModel):
+    property_ids: List[int]  # the route's properties in visiting order; others are removed
+    estimated_time_minutes: int | None = None  # for newly added properties
+
+class RouteOptimize(BaseModel):
+    start_lat: float | None = None  # e.g. the yard or the crew's position
+    start_lon: float | None = None
+    start_time: datetime | None = None  # when the route starts (for open_by_time); default now
+    apply: bool = True  # save the new order; False to preview
+
 @router.get("/routes/")
 async def get_routes(current_user: dict = Depends(get_current_user)):
     """Get all routes for current user"""
@@ -94,12 +115,14 @@ async def create_route(
         VALUES (%s, %s, %s, %s)
     """
 
-    route_id = execute_query(query, (
-        route_data.name,
-        route_data.description,
-        user_id,
-        route_data.is_template
-    ))
+    with transaction() as cursor:
+        cursor.execute(query, (
+            route_data.name,
+            route_data.description,
+            user_id,
+            route_data.is_template
+        ))
+        route_id = cursor.lastrowid
 
     return {
         "message": "Route created successfully",
@@ -157,6 +180,7 @@ async def delete_route(route_id: int, current_user: dict = Depends(get_current_u
     # Delete the route (cascade will delete route_properties)
     query = "DELETE FROM routes WHERE id = %s"
     execute_query(query, (route_id,))
+    route_etas.invalidate_route(route_id)
 
     return {"message": "Route deleted successfully"}
 
@@ -168,40 +192,29 @@ async def add_property_to_route(
     """Add a property to a route"""
     user_id = int(current_user["sub"])
 
-    # Verify route ownership
-    check_query = "SELECT user_id FROM routes WHERE id = %s"
-    result = fetch_query(check_query, (data.route_id,))
-
-    if not result:
-        raise HTTPException(status_code=404, detail="Route not found")
-
-    if result[0]["user_id"] != user_id:
-        raise HTTPException(status_code=403, detail="Not authorized to modify this route")
-
-    # Check if property exists
-    prop_check = "SELECT id FROM locations WHERE id = %s"
-    prop_result = fetch_query(prop_check, (data.property_id,))
-
-    if not prop_result:
-        raise HTTPException(status_code=404, detail="Property not found")
-
-    # Add to route (or update if exists)
-    query = """
-        INSERT INTO route_properties (route_id, property_id, sequence_order, estimated_time_minutes, notes)
-        VALUES (%s, %s, %s, %s, %s)
-        ON DUPLICATE KEY UPDATE
-            sequence_order = VALUES(sequence_order),
-            estimated_time_minutes = VALUES(estimated_time_minutes),
-            notes = VALUES(notes)
-    """
-
-    execute_query(query, (
-        data.route_id,
-        data.property_id,
-        data.sequence_order,
-        data.estimated_time_minutes,
-        data.notes
-    ))
+    with transaction() as cursor:
+        lock_owned_route(cursor, data.route_id, user_id)
+
+        cursor.execute("SELECT id FROM locations WHERE id = %s", (data.property_id,))
+        if not cursor.fetchall():
+            raise HTTPException(status_code=404, detail="Property not found")
+
+        # Add to route (or update if exists)
+        cursor.execute("""
+            INSERT INTO route_properties (route_id, property_id, sequence_order, estimated_time_minutes, notes)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                sequence_order = VALUES(sequence_order),
+                estimated_time_minutes = VALUES(estimated_time_minutes),
+                notes = VALUES(notes)
+        """, (
+            data.route_id,
+            data.property_id,
+            data.sequence_order,
+            data.estimated_time_minutes,
+            data.notes
+        ))
+    route_etas.invalidate_route(data.route_id)
 
     return {"message": "Property added to route"}
 
@@ -227,6 +240,7 @@ async def remove_property_from_route(
     # Remove from route
     query = "DELETE FROM route_properties WHERE route_id = %s AND property_id = %s"
     execute_query(query, (route_id, property_id))
+    route_etas.invalidate_route(route_id)
 
     return {"message": "Property removed from route"}
 
@@ -238,28 +252,11 @@ async def reorder_route_properties(
     """Reorder properties in a route"""
     user_id = int(current_user["sub"])
 
-    # Verify route ownership
-    check_query = "SELECT user_id FROM routes WHERE id = %s"
-    result = fetch_query(check_query, (data.route_id,))
-
-    if not result:
-        raise HTTPException(status_code=404, detail="Route not found")
-
-    if result[0]["user_id"] != user_id:
-        raise HTTPException(status_code=403, detail="Not authorized to modify this route")
-
-    # Update sequence orders
-    for item in data.property_orders:
-        query = """
-            UPDATE route_properties
-            SET sequence_order = %s
-            WHERE route_id = %s AND property_id = %s
-        """
-        execute_query(query, (
-            item["sequence_order"],
-            data.route_id,
-            item["property_id"]
-        ))
+    orders = [(item["property_id"], item["sequence_order"]) for item in data.property_orders]
+    with transaction() as cursor:
+        lock_owned_route(cursor, data.route_id, user_id)
+        set_sequence_orders(cursor, data.route_id, orders)
+    route_etas.invalidate_route(data.route_id)
 
     return {"message": "Route properties reordered successfully"}
 
@@ -271,27 +268,10 @@ async def assign_users_to_route(
     """Assign users to a route"""
     user_id = int(current_user["sub"])
 
-    # Verify route ownership
-    check_query = "SELECT user_id FROM routes WHERE id = %s"
-    result = fetch_query(check_query, (data.route_id,))
-
-    if not result:
-        raise HTTPException(status_code=404, detail="Route not found")
-
-    if result[0]["user_id"] != user_id:
-        raise HTTPException(status_code=403, detail="Not authorized to modify this route")
-
-    # First, remove all existing assignments for this route
-    delete_query = "DELETE FROM route_assignments WHERE route_id = %s"
-    execute_query(delete_query, (data.route_id,))
-
-    # Then add new assignments
-    for assigned_user_id in data.user_ids:
-        insert_query = """
-            INSERT INTO route_assignments (route_id, user_id)
-            VALUES (%s, %s)
-        """
-        execute_query(insert_query, (data.route_id, assigned_user_id))
+    with transaction() as cursor:
+        lock_owned_route(cursor, data.route_id, user_id)
+        replace_route_users(cursor, data.route_id, data.user_ids)
+    route_etas.invalidate_route(data.route_id)
 
     return {"message": f"Route assigned to {len(data.user_ids)} user(s)"}
 
@@ -322,3 +302,216 @@ async def get_route_assigned_users(
     assigned_users = fetch_query(query, (route_id,))
 
     return assigned_users if assigned_users else []
+
+# ==================== SET-BASED ROUTE EDITING ====================
+# Each edit runs in one transaction on one connection: the route row is locked,
+# the current state read once, and the change applied with set-based statements.
+
+def lock_owned_route(cursor, route_id: int, user_id: int):
+    """Lock the route row for this transaction; 404/403 unless the user owns it"""
+    cursor.execute("SELECT user_id FROM routes WHERE id = %s FOR UPDATE", (route_id,))
+    route = cursor.fetchone()
+
+    if not route:
+        raise HTTPException(status_code=404, detail="Route not found")
+
+    if route["user_id"] != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to modify this route")
+
+def route_sequence(cursor, route_id: int) -> dict:
+    """{property_id: sequence_order} for a route"""
+    cursor.execute("SELECT property_id, sequence_order FROM route_properties WHERE route_id = %s", (route_id,))
+    return {row["property_id"]: row["sequence_order"] for row in cursor.fetchall()}
+
+def set_sequence_orders(cursor, route_id: int, orders: List[tuple]):
+    """Set sequence_order for many (property_id, sequence_order) pairs in one UPDATE"""
+    if not orders:
+        return
+    cases = " ".join(["WHEN %s THEN %s"] * len(orders))
+    placeholders = ", ".join(["%s"] * len(orders))
+    cursor.execute(
+        f"""UPDATE route_properties
+            SET sequence_order = CASE property_id {cases} END
+            WHERE route_id = %s AND property_id IN ({placeholders})""",
+        tuple([value for pair in orders for value in pair] + [route_id] + [pair[0] for pair in orders])
+    )
+
+def sequence_diff(before: dict, after: dict) -> list:
+    return [
+        {"property_id": property_id, "from": before[property_id], "to": position}
+        for property_id, position in after.items()
+        if property_id in before and before[property_id] != position
+    ]
+
+def replace_route_users(cursor, route_id: int, user_ids: List[int]) -> dict:
+    """Make the route's assigned users exactly user_ids; returns the diff"""
+    wanted = list(dict.fromkeys(user_ids))
+    cursor.execute("SELECT user_id FROM route_assignments WHERE route_id = %s", (route_id,))
+    current = {row["user_id"] for row in cursor.fetchall()}
+
+    added = [uid for uid in wanted if uid not in current]
+    removed = sorted(current - set(wanted))
+
+    if added:
+        placeholders = ", ".join(["%s"] * len(added))
+        cursor.execute(f"SELECT id FROM users WHERE id IN ({placeholders})", tuple(added))
+        unknown = set(added) - {row["id"] for row in cursor.fetchall()}
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown user ids: {sorted(unknown)}")
+
+    if removed:
+        placeholders = ", ".join(["%s"] * len(removed))
+        cursor.execute(
+            f"DELETE FROM route_assignments WHERE route_id = %s AND user_id IN ({placeholders})",
+            (route_id, *removed)
+        )
+    if added:
+        cursor.execute(
+            f"INSERT INTO route_assignments (route_id, user_id) VALUES {', '.join(['(%s, %s)'] * len(added))}",
+            tuple(value for uid in added for value in (route_id, uid))
+        )
+
+    return {"added": added, "removed": removed, "unchanged": sorted(current & set(wanted))}
+
+@router.put("/routes/{route_id}/order")
+async def set_route_order(
+    route_id: int,
+    data: RouteOrder,
+    current_user: dict = Depends(get_current_user)
+):
+    """Apply a complete new visiting order (every property on the route, once)"""
+    user_id = int(current_user["sub"])
+
+    with transaction() as cursor:
+        lock_owned_route(cursor, route_id, user_id)
+        before = route_sequence(cursor, route_id)
+
+        if len(data.property_ids) != len(set(data.property_ids)) or set(data.property_ids) != set(before):
+            missing = sorted(set(before) - set(data.property_ids))
+            extra = sorted(set(data.property_ids) - set(before))
+            raise HTTPException(
+                status_code=400,
+                detail=f"property_ids must list each route property once (missing: {missing}, not on route: {extra})"
+            )
+
+        after = {property_id: position for position, property_id in enumerate(data.property_ids, start=1)}
+        moved = sequence_diff(before, after)
+        set_sequence_orders(cursor, route_id, [(m["property_id"], m["to"]) for m in moved])
+    route_etas.invalidate_route(route_id)
+
+    return {"route_id": route_id, "moved": moved, "unchanged": len(after) - len(moved)}
+
+@router.put("/routes/{route_id}/users")
+async def set_route_users(
+    route_id: int,
+    data: RouteUserSet,
+    current_user: dict = Depends(get_current_user)
+):
+    """Make the route's assigned users exactly this set"""
+    user_id = int(current_user["sub"])
+
+    with transaction() as cursor:
+        lock_owned_route(cursor, route_id, user_id)
+        diff = replace_route_users(cursor, route_id, data.user_ids)
+    route_etas.invalidate_route(route_id)
+
+    return {"route_id": route_id, **diff}
+
+@router.put("/routes/{route_id}/properties")
+async def set_route_properties(
+    route_id: int,
+    data: RoutePropertySet,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Make the route's properties exactly this list, in this order. Properties
+    not listed are removed; existing ones keep their time estimate and notes.
+    """
+    user_id = int(current_user["sub"])
+
+    if len(data.property_ids) != len(set(data.property_ids)):
+        raise HTTPException(status_code=400, detail="property_ids contains duplicates")
+
+    with transaction() as cursor:
+        lock_owned_route(cursor, route_id, user_id)
+        before = route_sequence(cursor, route_id)
+
+        added = [pid for pid in data.property_ids if pid not in before]
+        removed = sorted(set(before) - set(data.property_ids))
+
+        if added:
+            placeholders = ", ".join(["%s"] * len(added))
+            cursor.execute(f"SELECT id FROM locations WHERE id IN ({placeholders})", tuple(added))
+            unknown = set(added) - {row["id"] for row in cursor.fetchall()}
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown property ids: {sorted(unknown)}")
+
+        if removed:
+            placeholders = ", ".join(["%s"] * len(removed))
+            cursor.execute(
+                f"DELETE FROM route_properties WHERE route_id = %s AND property_id IN ({placeholders})",
+                (route_id, *removed)
+            )
+
+        after = {property_id: position for position, property_id in enumerate(data.property_ids, start=1)}
+        moved = sequence_diff(before, after)
+        # New rows and re-sequenced ones in one statement
+        rows = [(pid, after[pid]) for pid in added] + [(m["property_id"], m["to"]) for m in moved]
+        if rows:
+            cursor.execute(
+                f"""INSERT INTO route_properties (route_id, property_id, sequence_order, estimated_time_minutes)
+                    VALUES {', '.join(['(%s, %s, %s, %s)'] * len(rows))}
+                    ON DUPLICATE KEY UPDATE sequence_order = VALUES(sequence_order)""",
+                tuple(v for pid, position in rows for v in (route_id, pid, position, data.estimated_time_minutes))
+            )
+    route_etas.invalidate_route(route_id)
+
+    return {"route_id": route_id, "added": added, "removed": removed, "moved": moved}
+
+@router.post("/routes/{route_id}/optimize")
+async def optimize_route_order(
+    route_id: int,
+    data: RouteOptimize,
+    current_user: dict = Depends(get_current_user)
+):
+    """Compute a short visiting order for a route (open_by_time as soft deadlines) and save it"""
+    user_id = int(current_user["sub"])
+
+    # Verify route ownership
+    check_query = "SELECT user_id FROM routes WHERE id = %s"
+    result = fetch_query(check_query, (route_id,))
+
+    if not result:
+        raise HTTPException(status_code=404, detail="Route not found")
+
+    if result[0]["user_id"] != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to modify this route")
+
+    if (data.start_lat is None) != (data.start_lon is None):
+        raise HTTPException(status_code=400, detail="start_lat and start_lon must be given together")
+
+    properties_query = """
+        SELECT l.*, rp.sequence_order, rp.estimated_time_minutes
+        FROM locations l
+        JOIN route_properties rp ON l.id = rp.property_id
+        WHERE rp.route_id = %s
+        ORDER BY rp.sequence_order ASC
+    """
+    properties = fetch_query(properties_query, (route_id,)) or []
+
+    start = (data.start_lat, data.start_lon) if data.start_lat is not None else None
+    # Local search and distance lookups block; keep them off the event loop
+    plan = await run_in_threadpool(
+        optimize_route, properties, start=start, start_time=data.start_time, distances=distance_matrix
+    )
+
+    if data.apply:
+        with transaction() as cursor:
+            lock_owned_route(cursor, route_id, user_id)
+            before = route_sequence(cursor, route_id)
+            after = {property_id: position for position, property_id in enumerate(plan["order"], start=1)}
+            moved = sequence_diff(before, after)
+            set_sequence_orders(cursor, route_id, [(m["property_id"], m["to"]) for m in moved])
+        route_etas.invalidate_route(route_id)
+
+    return {"route_id": route_id, "applied": data.apply, **plan}
@@ -5,8 +5,9 @@ Handles Twilio webhooks and AI-powered SMS conversation management
 
 from fastapi import APIRouter, Request, HTTPException, Depends, Form
 from fastapi.responses import Response
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional, Tuple
 import json
 import os
 from datetime import datetime
@@ -14,8 +15,16 @@ from auth import get_current_user
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
-from db import fetch_query, execute_query
-from openai import OpenAI
+from db import fetch_query, execute_query, execute_many
+from utils.http_clients import get_openai_client, get_session
+from services.ai_context import invalidate_user_context
+from utils.work_queue import KeyedWorkQueue
+from utils.cache import TTLCache
+from services.sms_dispatcher import PermanentSendError, SmsDispatcher
+from services.sms_commands import COMMAND_INTENTS, known_equipment, parse_sms
+from services.sms_conversations import conversation_store
+from services.crew_locations import live_crews
+from utils.event_stream import EventFeed, sse_response
 
 router = APIRouter()
 
@@ -53,41 +62,158 @@ def get_api_key(key_name: str, user_id: int = None) -> str:
         return os.getenv(env_var, "")
     return ""
 
-def send_sms(to_phone: str, message: str, conversation_id: int = None):
-    """Send SMS via Twilio"""
-    try:
+_twilio_clients = {}
+
+def get_twilio_client(account_sid: str, auth_token: str):
+    """Twilio REST client reused per credential pair so its HTTP session stays warm"""
+    key = (account_sid, auth_token)
+    client = _twilio_clients.get(key)
+    if client is None:
         from twilio.rest import Client
+        from twilio.http.http_client import TwilioHttpClient
 
-        # Get Twilio credentials from database or environment
-        account_sid = get_api_key('twilio_account_sid')
-        auth_token = get_api_key('twilio_auth_token')
-        phone_number = get_api_key('twilio_phone_number')
+        client = Client(account_sid, auth_token, http_client=TwilioHttpClient(pool_connections=True))
+        _twilio_clients.clear()  # credentials rotated; drop the old client
+        _twilio_clients[key] = client
+    return client
 
-        if not account_sid or not auth_token or not phone_number:
-            raise Exception("Twilio credentials not configured")
+_twilio_credentials = TTLCache(ttl_seconds=60, maxsize=1)
 
-        client = Client(account_sid, auth_token)
 
-        message_obj = client.messages.create(
-            body=message,
-            from_=phone_number,
-            to=to_phone
+def get_twilio_credentials() -> Tuple[str, str, str]:
+    """(account_sid, auth_token, from_number), cached briefly so bulk sends don't re-query api_keys"""
+    credentials = _twilio_credentials.get("twilio")
+    if credentials is None:
+        credentials = (
+            get_api_key('twilio_account_sid'),
+            get_api_key('twilio_auth_token'),
+            get_api_key('twilio_phone_number')
         )
+        _twilio_credentials.set("twilio", credentials)
+    return credentials
+
+
+def twilio_send(to_phone: str, message: str) -> Tuple[str, str]:
+    """One Twilio API call; returns (sid, status)"""
+    account_sid, auth_token, phone_number = get_twilio_credentials()
+
+    if not account_sid or not auth_token or not phone_number:
+        raise PermanentSendError("Twilio credentials not configured")
+
+    client = get_twilio_client(account_sid, auth_token)
+
+    message_obj = client.messages.create(
+        body=message,
+        from_=phone_number,
+        to=to_phone
+    )
+    return message_obj.sid, message_obj.status
+
+
+# Live feed for the SMS dispatcher page: new messages, interpretations and state changes
+sms_feed = EventFeed("sms")
+
+
+def conversation_summary(conversation: dict) -> dict:
+    """Conversation in the /sms/conversations list shape"""
+    try:
+        context_data = json.loads(conversation.get('context_data') or '{}')
+    except (TypeError, ValueError):
+        context_data = {}
+    return {
+        'id': conversation['id'],
+        'phone_number': conversation['phone_number'],
+        'conversation_state': conversation['conversation_state'],
+        'active_ticket_id': conversation.get('active_ticket_id'),
+        'last_message_at': conversation.get('last_message_at'),
+        'user_name': conversation.get('user_name'),
+        'property_name': context_data.get('property_name') if conversation.get('active_property_id') else None
+    }
+
+
+def publish_conversation(conversation: dict):
+    sms_feed.publish("conversation", conversation_summary(conversation))
+
+
+conversation_store.add_listener(publish_conversation)
+
+
+def record_outbound_sms(rows: List[tuple]):
+    """Bulk-log outbound messages: rows of (conversation_id, phone, body, sid, status)"""
+    execute_many(
+        """INSERT INTO sms_messages
+           (conversation_id, phone_number, direction, message_body, twilio_sid, twilio_status)
+           VALUES (%s, %s, 'outbound', %s, %s, %s)""",
+        rows
+    )
+    now = datetime.now()
+    for conversation_id, phone_number, body, sid, status in rows:
+        sms_feed.publish("message", {
+            'conversation_id': conversation_id,
+            'phone_number': phone_number,
+            'direction': 'outbound',
+            'message_body': body,
+            'twilio_sid': sid,
+            'twilio_status': status,
+            'created_at': now
+        })
+
+
+def send_sms(to_phone: str, message: str, conversation_id: int = None):
+    """
+    Send SMS via Twilio and wait for the result.
+    Only for callers that need to report success (test sends); everything
+    else should use queue_sms.
+    """
+    try:
+        sid, status = twilio_send(to_phone, message)
 
         # Log outbound message
-        execute_query(
-            """INSERT INTO sms_messages
-               (conversation_id, phone_number, direction, message_body, twilio_sid, twilio_status)
-               VALUES (%s, %s, 'outbound', %s, %s, %s)""",
-            (conversation_id, to_phone, message, message_obj.sid, message_obj.status)
-        )
+        record_outbound_sms([(conversation_id, to_phone, message, sid, status)])
 
-        return message_obj
+        return {"sid": sid, "status": status}
     except Exception as e:
         logger.error(f"Failed to send SMS: {e}", exc_info=True)
         return None
 
 
+# Outbound texts go through one dispatcher that paces sends to Twilio's limits
+outbound_sms = SmsDispatcher(
+    send=twilio_send,
+    record=record_outbound_sms,
+    account_rate_per_second=float(os.getenv("SMS_ACCOUNT_RATE_PER_SECOND", "1")),
+    account_burst=int(os.getenv("SMS_ACCOUNT_BURST", "5")),
+    per_number_interval_seconds=float(os.getenv("SMS_PER_NUMBER_INTERVAL_SECONDS", "1")),
+    workers=int(os.getenv("SMS_SEND_WORKERS", "8")),
+    max_retries=int(os.getenv("SMS_MAX_RETRIES", "3"))
+)
+
+
+def queue_sms(to_phone: str, message: str, conversation_id: int = None):
+    """Queue a text for the outbound dispatcher; returns immediately"""
+    outbound_sms.enqueue(to_phone, message, conversation_id)
+
+
+def send_sms_batch(messages: List[Tuple[str, str]], conversation_id: int = None) -> int:
+    """Queue many (to_phone, message) texts; returns how many were queued"""
+    return outbound_sms.enqueue_many(messages, conversation_id)
+
+
+def broadcast_to_event(winter_event_id: int, message: str) -> int:
+    """Queue one message to every crew currently checked in to a winter event"""
+    crews = fetch_query(
+        """SELECT DISTINCT u.phone_number
+           FROM event_checkins ec
+           JOIN users u ON ec.user_id = u.id
+           WHERE ec.winter_event_id = %s
+             AND ec.checked_out_at IS NULL
+             AND u.phone_number IS NOT NULL AND u.phone_number != ''
+             AND COALESCE(u.sms_notifications_enabled, TRUE)""",
+        (winter_event_id,)
+    ) or []
+    return send_sms_batch([(c['phone_number'], message) for c in crews])
+
+
 def get_ai_interpretation(user_message: str, conversation_context: dict):
     """Use ChatGPT to interpret SMS message and extract ticket data"""
 
@@ -96,7 +222,7 @@ def get_ai_interpretation(user_message: str, conversation_context: dict):
     if not api_key:
         raise Exception("OpenAI API key not configured")
 
-    client = OpenAI(api_key=api_key)
+    client = get_openai_client(api_key)
 
     system_prompt = """You are an AI assistant helping contractors manage winter service tickets via SMS.
 
@@ -171,77 +297,33 @@ Respond ONLY with valid JSON, no other text."""
 
 
 def get_or_create_conversation(phone_number: str, user_id: int = None):
-    """Get existing conversation or create new one"""
-
-    # Try to find existing conversation
-    conv = fetch_query(
-        "SELECT * FROM sms_conversations WHERE phone_number = %s ORDER BY last_message_at DESC LIMIT 1",
-        (phone_number,)
-    )
-
-    if conv:
-        return conv[0]
-
-    # Find user by phone number if user_id not provided
-    if not user_id:
-        user = fetch_query(
-            "SELECT id FROM users WHERE phone_number = %s LIMIT 1",
-            (phone_number,)
-        )
-        if user:
-            user_id = user[0]['id']
-        else:
-            # Unknown phone number
-            return None
+    """Get existing conversation or create new one (served from the in-memory store)"""
+    return conversation_store.get(phone_number, user_id)
 
-    # Create new conversation
-    execute_query(
-        """INSERT INTO sms_conversations (user_id, phone_number, conversation_state)
-           VALUES (%s, %s, 'idle')""",
-        (user_id, phone_number)
-    )
 
-    conv = fetch_query(
-        "SELECT * FROM sms_conversations WHERE phone_number = %s ORDER BY id DESC LIMIT 1",
-        (phone_number,)
-    )
-    return conv[0] if conv else None
+EMPTY_TWIML = "<?xml version='1.0' encoding='UTF-8'?><Response></Response>"
 
 
-@router.post("/sms/webhook")
-async def sms_webhook(
-    From: str = Form(...),
-    Body: str = Form(...),
-    MessageSid: str = Form(...)
-):
+def process_inbound_sms(job: dict):
     """
-    Twilio webhook endpoint for incoming SMS messages
-    This endpoint receives SMS from contractors and processes them with AI
+    Worker-side handling of one inbound text (runs in the inbound queue,
+    in order per phone number): n8n forwarding, interpretation, intent
+    processing and the reply.
     """
+    phone_number = job['phone_number']
+    message_body = job['message_body']
+    message_sid = job['message_sid']
 
-    phone_number = From
-    message_body = Body.strip()
-
-    print(f"[SMS] Received from {phone_number}: {message_body}")
-
-    # Get or create conversation
+    # Re-read the conversation so earlier messages from this phone are reflected
     conversation = get_or_create_conversation(phone_number)
 
     if not conversation:
         # Unknown phone number - send registration message
-        send_sms(
+        queue_sms(
             phone_number,
             "📱 Welcome! Your phone number is not registered. Please contact your administrator to add your phone number to your account."
         )
-        return Response(content="<?xml version='1.0' encoding='UTF-8'?><Response></Response>", media_type="application/xml")
-
-    # Log inbound message
-    execute_query(
-        """INSERT INTO sms_messages
-           (conversation_id, phone_number, direction, message_body, twilio_sid)
-           VALUES (%s, %s, 'inbound', %s, %s)""",
-        (conversation['id'], phone_number, message_body, MessageSid)
-    )
+        return
 
     # Get conversation context
     context_data = json.loads(conversation['context_data']) if conversation['context_data'] else {}
@@ -250,41 +332,52 @@ async def sms_webhook(
     if message_body.upper().strip() in ['1', '2', '3', 'FIX', 'IGNORE', 'CUSTOM'] or 'ERROR ID:' in context_data.get('last_message', ''):
         # Forward to N8N webhook
         try:
-            import requests
             n8n_url = "http://localhost:5678/webhook/human-decision"
             payload = {
                 "body": {
                     "error_id": context_data.get('error_id', 'unknown'),
                     "message": message_body,
                     "phone": phone_number,
-                    "timestamp": datetime.now().isoformat()
+                    "timestamp": job['received_at'].isoformat()
                 }
             }
-            requests.post(n8n_url, json=payload, timeout=10)
+            get_session().post(n8n_url, json=payload, timeout=10)
+            # Handled: keep the startup requeue from replaying the forward
+            execute_query(
+                "UPDATE sms_messages SET ai_processed = TRUE WHERE twilio_sid = %s",
+                (message_sid,)
+            )
 
             # Send confirmation
-            send_sms(phone_number, f"✅ Decision received: {message_body}\\n\\nProcessing your request...")
-            return Response(content="<?xml version='1.0' encoding='UTF-8'?><Response></Response>", media_type="application/xml")
+            queue_sms(phone_number, f"✅ Decision received: {message_body}\\n\\nProcessing your request...")
+            return
         except Exception as e:
             print(f"[SMS] Failed to forward to N8N: {e}")
 
-    # Use AI to interpret the message
-    interpretation = get_ai_interpretation(message_body, {
-        'state': conversation['conversation_state'],
-        'property_name': context_data.get('property_name'),
-        'partial_data': context_data.get('partial_data')
-    })
+    # Commands and plain ticket details are parsed locally; only ambiguous text goes to the LLM
+    interpretation = parse_sms(message_body, conversation['conversation_state'], known_equipment())
+    if interpretation is None:
+        interpretation = get_ai_interpretation(message_body, {
+            'state': conversation['conversation_state'],
+            'property_name': context_data.get('property_name'),
+            'partial_data': context_data.get('partial_data')
+        })
 
     # Log AI interpretation
     execute_query(
         """UPDATE sms_messages
            SET ai_processed = TRUE, ai_interpretation = %s
            WHERE twilio_sid = %s""",
-        (json.dumps(interpretation), MessageSid)
+        (json.dumps(interpretation), message_sid)
     )
+    sms_feed.publish("interpretation", {
+        'conversation_id': conversation['id'],
+        'twilio_sid': message_sid,
+        'ai_interpretation': json.dumps(interpretation)
+    })
 
     # Process based on intent
-    response_message = await process_sms_intent(
+    response_message = process_sms_intent(
         conversation=conversation,
         interpretation=interpretation,
         message_body=message_body
@@ -292,13 +385,143 @@ async def sms_webhook(
 
     # Send response
     if response_message:
-        send_sms(phone_number, response_message, conversation['id'])
+        queue_sms(phone_number, response_message, conversation['id'])
+
+
+# Inbound texts are processed off the request so Twilio gets its TwiML at once;
+# keyed by phone number so one crew's messages are handled in the order sent
+SMS_INBOUND_WORKERS = int(os.getenv("SMS_INBOUND_WORKERS", "4"))
+inbound_queue = KeyedWorkQueue("sms-inbound", process_inbound_sms, workers=SMS_INBOUND_WORKERS)
+
+
+def enqueue_inbound_sms(phone_number: str, message_body: str, message_sid: str, received_at: datetime = None):
+    inbound_queue.submit(phone_number, {
+        'phone_number': phone_number,
+        'message_body': message_body,
+        'message_sid': message_sid,
+        'received_at': received_at or datetime.now()
+    })
+
+
+def requeue_unprocessed_sms(max_age_minutes: int = 15) -> int:
+    """
+    Re-enqueue recent inbound texts that were stored but never processed
+    (e.g. the app restarted with work still queued). Called at startup.
+    """
+    rows = fetch_query(
+        """SELECT phone_number, message_body, twilio_sid, created_at
+           FROM sms_messages
+           WHERE direction = 'inbound' AND ai_processed = FALSE
+             AND created_at >= NOW() - INTERVAL %s MINUTE
+           ORDER BY created_at ASC, id ASC""",
+        (max_age_minutes,)
+    ) or []
+    for row in rows:
+        enqueue_inbound_sms(row['phone_number'], row['message_body'], row['twilio_sid'], row['created_at'])
+    if rows:
+        logger.info(f"Re-queued {len(rows)} unprocessed inbound SMS")
+    return len(rows)
+
+
+@router.post("/sms/webhook")
+async def sms_webhook(
+    From: str = Form(...),
+    Body: str = Form(...),
+    MessageSid: str = Form(...)
+):
+    """
+    Twilio webhook endpoint for incoming SMS messages
+    Stores the message and acknowledges immediately; interpretation and the
+    reply happen in the inbound worker queue (see process_inbound_sms)
+    """
+
+    phone_number = From
+    message_body = Body.strip()
+
+    print(f"[SMS] Received from {phone_number}: {message_body}")
+
+    def persist():
+        # Get or create conversation
+        conversation = get_or_create_conversation(phone_number)
+
+        # Log inbound message
+        if conversation:
+            execute_query(
+                """INSERT INTO sms_messages
+                   (conversation_id, phone_number, direction, message_body, twilio_sid)
+                   VALUES (%s, %s, 'inbound', %s, %s)""",
+                (conversation['id'], phone_number, message_body, MessageSid)
+            )
+            sms_feed.publish("message", {
+                'conversation_id': conversation['id'],
+                'phone_number': phone_number,
+                'direction': 'inbound',
+                'message_body': message_body,
+                'twilio_sid': MessageSid,
+                'created_at': datetime.now(),
+                'conversation': conversation_summary(conversation)
+            })
+
+    await run_in_threadpool(persist)
+    enqueue_inbound_sms(phone_number, message_body, MessageSid)
 
     # Return empty TwiML response
-    return Response(content="<?xml version='1.0' encoding='UTF-8'?><Response></Response>", media_type="application/xml")
+    return Response(content=EMPTY_TWIML, media_type="application/xml")
+
+
+@router.get("/sms/queue/stats")
+async def get_sms_queue_stats(current_user: dict = Depends(get_current_user)):
+    """Inbound processing and outbound dispatch queue stats (Admin/Manager only)"""
+
+    if current_user['role'] not in ['Admin', 'Manager']:
+        raise HTTPException(status_code=403, detail="Admin/Manager only")
+
+    return {
+        "inbound": inbound_queue.stats(),
+        "outbound": outbound_sms.stats(),
+        "conversations": conversation_store.stats(),
+        "feed": sms_feed.stats()
+    }
 
 
-async def process_sms_intent(conversation: dict, interpretation: dict, message_body: str):
+@router.get("/sms/stream")
+async def stream_sms_events(request: Request, current_user: dict = Depends(get_current_user)):
+    """
+    Server-sent events for the SMS dispatcher page (Admin/Manager only):
+    message (inbound/outbound text), interpretation (parsed inbound text),
+    conversation (state change), reset (reload the list).
+    Reconnect with Last-Event-ID to receive missed events.
+    """
+
+    if current_user['role'] not in ['Admin', 'Manager']:
+        raise HTTPException(status_code=403, detail="Admin/Manager only")
+
+    return sse_response(sms_feed, request)
+
+
+class BroadcastRequest(BaseModel):
+    message: str
+
+
+@router.post("/sms/broadcast/event/{event_id}")
+async def broadcast_event_sms(
+    event_id: int,
+    request: BroadcastRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """Text every crew checked in to a winter event (Admin/Manager only); sends in the background"""
+
+    if current_user['role'] not in ['Admin', 'Manager']:
+        raise HTTPException(status_code=403, detail="Admin/Manager only")
+
+    if not request.message.strip():
+        raise HTTPException(status_code=400, detail="Message is required")
+
+    queued = await run_in_threadpool(broadcast_to_event, event_id, request.message.strip())
+    return {"message": f"Queued {queued} messages", "queued": queued}
+
+
+def process_sms_intent(conversation: dict, interpretation: dict, message_body: str):
     """Process the AI interpretation and manage conversation state"""
 
     intent = interpretation.get('intent')
@@ -306,9 +529,11 @@ async def process_sms_intent(conversation: dict, interpretation: dict, message_b
     phone_number = conversation['phone_number']
     context_data = json.loads(conversation['context_data']) if conversation['context_data'] else {}
 
-    # Get user info
-    user = fetch_query("SELECT name, role FROM users WHERE id = %s", (user_id,))
-    user_name = user[0]['name'] if user else 'Unknown'
+    # Get user info (loaded with the conversation)
+    user_name = conversation.get('user_name')
+    if user_name is None:
+        user = fetch_query("SELECT name FROM users WHERE id = %s", (user_id,))
+        user_name = user[0]['name'] if user else 'Unknown'
 
     # START TICKET (also triggered by "OMW" or "ON MY WAY")
     if intent == 'start_ticket' or message_body.lower() in ['omw', 'on my way']:
@@ -338,15 +563,12 @@ async def process_sms_intent(conversation: dict, interpretation: dict, message_b
             context_data['property_id'] = property_id
             context_data['property_name'] = property_name
 
-            execute_query(
-                """UPDATE sms_conversations
-                   SET conversation_state = 'collecting_ticket_details',
-                       active_ticket_id = %s,
-                       active_property_id = %s,
-                       context_data = %s,
-                       last_message_at = NOW()
-                   WHERE id = %s""",
-                (ticket_id, property_id, json.dumps(context_data), conversation['id'])
+            conversation_store.update(
+                phone_number,
+                conversation_state='collecting_ticket_details',
+                active_ticket_id=ticket_id,
+                active_property_id=property_id,
+                context_data=json.dumps(context_data)
             )
 
             return f"✅ Ticket started for {property_name}!\n\nPlease reply with:\n- Equipment used\n- Salt quantities\n- Any notes\n\nExample: Plow truck, 3 yards bulk salt, parking lot clear"
@@ -356,27 +578,24 @@ async def process_sms_intent(conversation: dict, interpretation: dict, message_b
             props_list = "\n".join([f"{i+1}. {p['name']} - {p['address']}" for i, p in enumerate(assigned)])
             context_data['available_properties'] = [{'id': p['id'], 'name': p['name']} for p in assigned]
 
-            execute_query(
-                """UPDATE sms_conversations
-                   SET conversation_state = 'awaiting_start_confirmation',
-                       context_data = %s,
-                       last_message_at = NOW()
-                   WHERE id = %s""",
-                (json.dumps(context_data), conversation['id'])
+            conversation_store.update(
+                phone_number,
+                conversation_state='awaiting_start_confirmation',
+                context_data=json.dumps(context_data)
             )
 
             return f"📍 Which property?\n\n{props_list}\n\nReply with the number or property name."
 
     # AWAITING START CONFIRMATION (user selecting property)
-    elif conversation['conversation_state'] == 'awaiting_start_confirmation':
+    elif conversation['conversation_state'] == 'awaiting_start_confirmation' and intent not in COMMAND_INTENTS:
         available_props = context_data.get('available_properties', [])
 
         # Try to match property
         selected_property = None
 
         # Check if it's a number
-        if message_body.isdigit():
-            idx = int(message_body) - 1
+        if intent == 'select_property' or message_body.isdigit():
+            idx = int(interpretation.get('selection') or message_body) - 1
             if 0 <= idx < len(available_props):
                 selected_property = available_props[idx]
         else:
@@ -396,21 +615,18 @@ async def process_sms_intent(conversation: dict, interpretation: dict, message_b
         context_data['property_id'] = selected_property['id']
         context_data['property_name'] = selected_property['name']
 
-        execute_query(
-            """UPDATE sms_conversations
-               SET conversation_state = 'collecting_ticket_details',
-                   active_ticket_id = %s,
-                   active_property_id = %s,
-                   context_data = %s,
-                   last_message_at = NOW()
-               WHERE id = %s""",
-            (ticket_id, selected_property['id'], json.dumps(context_data), conversation['id'])
+        conversation_store.update(
+            phone_number,
+            conversation_state='collecting_ticket_details',
+            active_ticket_id=ticket_id,
+            active_property_id=selected_property['id'],
+            context_data=json.dumps(context_data)
         )
 
         return f"✅ Ticket started for {selected_property['name']}!\n\nPlease reply with:\n- Equipment used\n- Salt quantities\n- Any notes\n\nExample: Plow truck, 3 yards bulk salt"
 
     # COLLECTING TICKET DETAILS
-    elif intent == 'provide_details' or conversation['conversation_state'] == 'collecting_ticket_details':
+    elif intent == 'provide_details' or (conversation['conversation_state'] == 'collecting_ticket_details' and intent not in COMMAND_INTENTS):
         # Update ticket with provided details
         ticket_id = conversation['active_ticket_id']
 
@@ -452,10 +668,7 @@ async def process_sms_intent(conversation: dict, interpretation: dict, message_b
             execute_query(query, tuple(params))
 
             # Update conversation context
-            execute_query(
-                "UPDATE sms_conversations SET context_data = %s, last_message_at = NOW() WHERE id = %s",
-                (json.dumps(context_data), conversation['id'])
-            )
+            conversation_store.update(phone_number, context_data=json.dumps(context_data))
 
             return "✅ Ticket updated!\n\nReply DONE when finished, or send more details to update."
         else:
@@ -495,27 +708,19 @@ async def process_sms_intent(conversation: dict, interpretation: dict, message_b
         query = f"UPDATE winter_ops_logs SET {', '.join(updates)} WHERE id = %s"
         params.append(ticket_id)
         execute_query(query, tuple(params))
+        invalidate_user_context(user_id)
 
         # Reset conversation state
-        execute_query(
-            """UPDATE sms_conversations
-               SET conversation_state = 'idle',
-                   active_ticket_id = NULL,
-                   active_property_id = NULL,
-                   context_data = '{}',
-                   last_message_at = NOW()
-               WHERE id = %s""",
-            (conversation['id'],)
-        )
+        conversation_store.reset(phone_number)
 
         property_name = context_data.get('property_name', 'Property')
         return f"✅ Ticket completed for {property_name}!\n\nThank you. Reply START when you begin the next job."
 
     # STATUS UPDATE COMMAND - Update check-in status
-    elif message_body.lower() in ['working', 'busy', 'on site', 'servicing']:
+    elif intent == 'status_working' or message_body.lower() in ['working', 'busy', 'on site', 'servicing']:
         # Get active check-in
         active_checkin = fetch_query(
-            """SELECT ec.id, we.event_name
+            """SELECT ec.id, ec.winter_event_id, we.event_name
                FROM event_checkins ec
                JOIN winter_events we ON ec.winter_event_id = we.id
                WHERE ec.user_id = %s AND ec.checked_out_at IS NULL
@@ -533,11 +738,12 @@ async def process_sms_intent(conversation: dict, interpretation: dict, message_b
                WHERE id = %s""",
             (active_checkin[0]['id'],)
         )
+        live_crews.refresh(active_checkin[0]['winter_event_id'], user_id)
 
         return f"✅ Status updated to WORKING for {active_checkin[0]['event_name']}.\n\nReply READY when available for new assignments, or HOME when finished."
 
     # CHECK-IN COMMAND - Check in for active event
-    elif message_body.lower() in ['ready', 'checkin', 'check in', 'check-in', 'available']:
+    elif intent == 'check_in' or message_body.lower() in ['ready', 'checkin', 'check in', 'check-in', 'available']:
         # Get active winter event
         active_event = fetch_query(
             "SELECT id, event_name FROM winter_events WHERE status = 'active' LIMIT 1"
@@ -570,6 +776,7 @@ async def process_sms_intent(conversation: dict, interpretation: dict, message_b
                    WHERE id = %s""",
                 (default_equipment, existing_checkin[0]['id'])
             )
+            live_crews.refresh(event_id, user_id)
             return f"✅ You're already checked in for {event_name}!\n\nStatus updated to READY. You may receive assignments soon.\n\nReply WORKING when servicing a property, or HOME when finished."
         else:
             # Create new check-in
@@ -578,13 +785,14 @@ async def process_sms_intent(conversation: dict, interpretation: dict, message_b
                    VALUES (%s, %s, %s, 'checked_in', 'Checked in via SMS')""",
                 (event_id, user_id, default_equipment)
             )
+            live_crews.refresh(event_id, user_id)
             return f"✅ Checked in for {event_name}!\n\nEquipment: {default_equipment or 'Not specified'}\n\nYou may receive assignments soon.\n\nReply:\n- WORKING when servicing\n- HOME when finished"
 
     # HOME COMMAND - Check out and mark user as unavailable
-    elif message_body.lower() in ['home', 'off', 'offline']:
+    elif intent == 'go_home' or message_body.lower() in ['home', 'off', 'offline']:
         # Check out from any active events
         active_checkin = fetch_query(
-            """SELECT ec.id, we.event_name
+            """SELECT ec.id, ec.winter_event_id, we.event_name
                FROM event_checkins ec
                JOIN winter_events we ON ec.winter_event_id = we.id
                WHERE ec.user_id = %s AND ec.checked_out_at IS NULL
@@ -599,6 +807,7 @@ async def process_sms_intent(conversation: dict, interpretation: dict, message_b
                    WHERE id = %s""",
                 (active_checkin[0]['id'],)
             )
+            live_crews.refresh(active_checkin[0]['winter_event_id'], user_id)
 
         # Mark user as unavailable for auto-assignment
         execute_query(
@@ -613,24 +822,16 @@ async def process_sms_intent(conversation: dict, interpretation: dict, message_b
                WHERE user_id = %s AND status = 'open'""",
             (user_id,)
         )
+        invalidate_user_context(user_id)
 
         # Reset conversation
-        execute_query(
-            """UPDATE sms_conversations
-               SET conversation_state = 'idle',
-                   active_ticket_id = NULL,
-                   active_property_id = NULL,
-                   context_data = '{}',
-                   last_message_at = NOW()
-               WHERE id = %s""",
-            (conversation['id'],)
-        )
+        conversation_store.reset(phone_number)
 
         return "🏠 You're marked as HOME. Checked out and any open tickets have been closed. You won't receive new assignments until a manager re-enables you. Drive safe!"
 
     # UNKNOWN / HELP
     else:
-        if 'help' in message_body.lower():
+        if intent == 'help' or 'help' in message_body.lower():
             return """📱 SMS Commands:
 
 🔔 EVENT CHECK-IN:
@@ -687,6 +888,7 @@ def create_ticket_from_sms(user_id: int, user_name: str, property_id: int):
         (property_id, user_id, user_id, user_name, user_name, default_equipment,
          time_in, f'Ticket started via SMS at {now.strftime("%I:%M %p")}', winter_event_id)
     )
+    invalidate_user_context(user_id)
 
     # Get the created ticket ID
     ticket = fetch_query(
@@ -740,9 +942,9 @@ Default Equipment: {default_equipment}
 Reply START / OMW / ON MY WAY when you begin work.
 Reply HELP for commands."""
 
-    send_sms(contractor[0]['phone_number'], message)
+    queue_sms(contractor[0]['phone_number'], message)
 
-    return {"message": "SMS notification sent", "phone": contractor[0]['phone_number']}
+    return {"message": "SMS notification queued", "phone": contractor[0]['phone_number']}
 
 
 @router.post("/sms/send-test")
@@ -802,7 +1004,7 @@ async def get_conversation_messages(
         raise HTTPException(status_code=403, detail="Admin/Manager only")
 
     messages = fetch_query(
-        """SELECT id, direction, message_body, ai_interpretation, created_at
+        """SELECT id, direction, message_body, ai_interpretation, twilio_sid, created_at
         FROM sms_messages
         WHERE conversation_id = %s
         ORDER BY created_at ASC""",
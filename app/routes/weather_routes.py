@@ -1,17 +1,45 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List, Optional
 from db import fetch_query, execute_query
 from auth import get_current_user
-import requests
+from utils.cache import TTLCache
+from utils.logger import get_logger
+from utils.http_clients import get_openai_client, get_session
+from utils.spatial import cluster_points, haversine_miles, to_float
+import asyncio
+import hashlib
 import os
+import threading
 from datetime import datetime, timedelta
 import json
 
+logger = get_logger(__name__)
+
 router = APIRouter()
 
 WEATHER_API_BASE = "https://api.openweathermap.org/data/2.5"
 
+# Properties within this distance of each other share one forecast lookup
+WEATHER_CLUSTER_RADIUS_MILES = float(os.getenv("WEATHER_CLUSTER_RADIUS_MILES", "2.0"))
+# Upper bound on upstream forecast calls per properties-forecast refresh
+WEATHER_MAX_CALLS = int(os.getenv("WEATHER_MAX_CALLS", "50"))
+# How often the background prefetcher refreshes the properties forecast
+WEATHER_PREFETCH_MINUTES = int(os.getenv("WEATHER_PREFETCH_MINUTES", "30"))
+# How long a failed AI summary blocks another attempt for the same input
+WEATHER_AI_RETRY_SECONDS = int(os.getenv("WEATHER_AI_RETRY_SECONDS", "300"))
+
+# Latest properties forecast computed by the prefetcher (or on demand)
+_forecast_snapshot = {"data": None, "fetched_at": None}
+
+# AI summary keyed by a hash of the properties-needing-service payload
+_ai_summary_cache = {"input_hash": None, "result": None}
+_ai_summary_lock = threading.Lock()
+_ai_summary_refreshing = set()
+# Error text for inputs whose last generation failed, until the retry backoff expires
+_ai_summary_failures = TTLCache(WEATHER_AI_RETRY_SECONDS, maxsize=64)
+
 def get_api_key(key_name: str, user_id: int = None) -> str:
     """Get API key from database or environment variable"""
     # First try database (user-specific or system-wide)
@@ -76,7 +104,7 @@ async def get_current_weather(
             "units": "imperial"
         }
 
-        response = requests.get(url, params=params, timeout=10)
+        response = get_session().get(url, params=params, timeout=10)
         response.raise_for_status()
 
         data = response.json()
@@ -92,6 +120,48 @@ async def get_current_weather(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch weather: {str(e)}")
 
+def fetch_forecast_by_coords(lat: float, lon: float) -> dict:
+    """Fetch and normalise the 5-day forecast for a coordinate (blocking)"""
+    WEATHER_API_KEY = get_api_key("openweather_api_key")
+    if not WEATHER_API_KEY:
+        raise HTTPException(status_code=500, detail="Weather API key not configured")
+
+    url = f"{WEATHER_API_BASE}/forecast"
+    params = {
+        "lat": lat,
+        "lon": lon,
+        "appid": WEATHER_API_KEY,
+        "units": "imperial"
+    }
+
+    response = get_session().get(url, params=params, timeout=10)
+    response.raise_for_status()
+
+    data = response.json()
+
+    # Process forecast data
+    forecasts = []
+    for item in data["list"]:
+        # Check for snow in weather conditions
+        snow_amount = 0
+        if "snow" in item and "3h" in item["snow"]:
+            # Convert from mm to inches (1mm = 0.0393701 inches)
+            snow_amount = item["snow"]["3h"] * 0.0393701
+
+        forecasts.append({
+            "datetime": item["dt_txt"],
+            "temperature": item["main"]["temp"],
+            "description": item["weather"][0]["description"],
+            "snow_3h": snow_amount,
+            "precipitation_probability": item.get("pop", 0) * 100,
+            "wind_speed": item["wind"]["speed"]
+        })
+
+    return {
+        "city": data["city"]["name"],
+        "forecasts": forecasts
+    }
+
 @router.get("/weather/forecast/")
 async def get_weather_forecast(
     lat: float,
@@ -99,54 +169,15 @@ async def get_weather_forecast(
     current_user: dict = Depends(get_current_user)
 ):
     """Get 5-day weather forecast"""
-    WEATHER_API_KEY = get_api_key("openweather_api_key")
-    if not WEATHER_API_KEY:
-        raise HTTPException(status_code=500, detail="Weather API key not configured")
-
     try:
-        url = f"{WEATHER_API_BASE}/forecast"
-        params = {
-            "lat": lat,
-            "lon": lon,
-            "appid": WEATHER_API_KEY,
-            "units": "imperial"
-        }
-
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-
-        data = response.json()
-
-        # Process forecast data
-        forecasts = []
-        for item in data["list"]:
-            # Check for snow in weather conditions
-            snow_amount = 0
-            if "snow" in item and "3h" in item["snow"]:
-                # Convert from mm to inches (1mm = 0.0393701 inches)
-                snow_amount = item["snow"]["3h"] * 0.0393701
-
-            forecasts.append({
-                "datetime": item["dt_txt"],
-                "temperature": item["main"]["temp"],
-                "description": item["weather"][0]["description"],
-                "snow_3h": snow_amount,
-                "precipitation_probability": item.get("pop", 0) * 100,
-                "wind_speed": item["wind"]["speed"]
-            })
-
-        return {
-            "city": data["city"]["name"],
-            "forecasts": forecasts
-        }
+        return await run_in_threadpool(fetch_forecast_by_coords, lat, lon)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch forecast: {str(e)}")
 
-@router.get("/weather/properties-forecast/")
-async def get_properties_weather_forecast(
-    current_user: dict = Depends(get_current_user)
-):
-    """Get weather forecast for all properties with coordinates"""
+def build_properties_forecast() -> dict:
+    """Compute the forecast for every property with a location (blocking)"""
 
     # Get all properties
     query = """
@@ -163,22 +194,16 @@ async def get_properties_weather_forecast(
     # Group properties by location (coordinates or ZIP code)
     location_groups = {}
     properties_without_location = []
-    
+    properties_by_id = {}
+    coordinate_points = []
+
     for prop in properties:
+        lat = to_float(prop["latitude"])
+        lon = to_float(prop["longitude"])
         # Try coordinates first
-        if prop["latitude"] and prop["longitude"]:
-            lat_rounded = round(prop["latitude"], 2)
-            lon_rounded = round(prop["longitude"], 2)
-            key = f"coord:{lat_rounded},{lon_rounded}"
-
-            if key not in location_groups:
-                location_groups[key] = {
-                    "type": "coordinates",
-                    "lat": lat_rounded,
-                    "lon": lon_rounded,
-                    "properties": []
-                }
-            location_groups[key]["properties"].append(prop)
+        if lat is not None and lon is not None:
+            properties_by_id[prop["id"]] = (prop, lat, lon)
+            coordinate_points.append((prop["id"], lat, lon))
         else:
             # Try ZIP code fallback
             zip_code = extract_zip_from_address(prop["address"])
@@ -194,22 +219,38 @@ async def get_properties_weather_forecast(
             else:
                 properties_without_location.append(prop)
 
+    # Cluster coordinate properties so each forecast lookup covers every property
+    # within WEATHER_CLUSTER_RADIUS_MILES, widening the radius if needed to stay
+    # within the per-refresh call budget (ZIP groups count against it too).
+    coordinate_budget = max(1, WEATHER_MAX_CALLS - len(location_groups))
+    clusters, _ = cluster_points(
+        coordinate_points,
+        max_error_miles=WEATHER_CLUSTER_RADIUS_MILES,
+        max_clusters=coordinate_budget
+    )
+    for cluster in clusters:
+        key = f"coord:{cluster['lat']},{cluster['lon']}"
+        group_properties = []
+        for prop_id in cluster["members"]:
+            prop, lat, lon = properties_by_id[prop_id]
+            prop["forecast_distance_miles"] = round(haversine_miles(lat, lon, cluster["lat"], cluster["lon"]), 2)
+            group_properties.append(prop)
+        location_groups[key] = {
+            "type": "coordinates",
+            "lat": cluster["lat"],
+            "lon": cluster["lon"],
+            "properties": group_properties
+        }
+
     # Fetch forecast for each location group
     results = []
     for key, group in location_groups.items():
         try:
             # Fetch based on location type
             if group["type"] == "coordinates":
-                forecast = await get_weather_forecast(
-                    lat=group["lat"],
-                    lon=group["lon"],
-                    current_user=current_user
-                )
+                forecast = fetch_forecast_by_coords(group["lat"], group["lon"])
             elif group["type"] == "zip":
-                forecast = await get_weather_by_zip(
-                    zip_code=group["zip_code"],
-                    current_user=current_user
-                )
+                forecast = fetch_forecast_by_zip(group["zip_code"])
             else:
                 continue
 
@@ -242,6 +283,7 @@ async def get_properties_weather_forecast(
                     "forecast_snow_24h": round(total_snow_24h, 2),
                     "needs_service": needs_service,
                     "open_by_time": prop["open_by_time"],
+                    "forecast_distance_miles": prop.get("forecast_distance_miles"),
                     "forecast": forecast["forecasts"][:8]  # Next 24 hours (8 x 3-hour periods)
                 })
         except Exception as e:
@@ -251,42 +293,55 @@ async def get_properties_weather_forecast(
     return {
         "total_properties": len(results),
         "properties_needing_service": sum(1 for r in results if r["needs_service"]),
+        "forecast_lookups": len(location_groups),
         "properties": results
     }
 
-@router.get("/weather/ai-summary/")
-async def get_weather_ai_summary(current_user: dict = Depends(get_current_user)):
-    """Get AI-powered weather summary and recommendations"""
+def store_forecast_snapshot(forecast_data: dict):
+    _forecast_snapshot["data"] = forecast_data
+    _forecast_snapshot["fetched_at"] = datetime.now()
 
-    OPENAI_API_KEY = get_api_key("openai_api_key")
-    if not OPENAI_API_KEY:
-        return {
-            "message": "AI summary requires OpenAI API key",
-            "summary": "Configure OPENAI_API_KEY environment variable for AI-powered summaries."
-        }
+def get_fresh_forecast_snapshot() -> Optional[dict]:
+    """Return the prefetched forecast if it is newer than one prefetch interval"""
+    fetched_at = _forecast_snapshot["fetched_at"]
+    if fetched_at and datetime.now() - fetched_at < timedelta(minutes=WEATHER_PREFETCH_MINUTES):
+        return _forecast_snapshot["data"]
+    return None
 
-    # Get forecast for all properties
-    forecast_data = await get_properties_weather_forecast(current_user)
-
-    # Check if we have data
-    if not forecast_data or "properties" not in forecast_data:
-        return {
-            "summary": "No property data available. Add coordinates to properties on the Property Map page.",
-            "properties_needing_service": 0,
-            "recommended_actions": []
+@router.get("/weather/properties-forecast/")
+async def get_properties_weather_forecast(
+    current_user: dict = Depends(get_current_user)
+):
+    """Get weather forecast for all properties with coordinates"""
+    forecast_data = await run_in_threadpool(build_properties_forecast)
+    if forecast_data.get("properties"):
+        store_forecast_snapshot(forecast_data)
+    return forecast_data
+
+def get_summary_input(forecast_data: dict) -> List[dict]:
+    """The prompt-relevant slice of each property needing service"""
+    return [
+        {
+            "property_name": p["property_name"],
+            "address": p["address"],
+            "trigger_amount": p["trigger_amount"],
+            "forecast_snow_24h": p["forecast_snow_24h"],
+            "open_by_time": p["open_by_time"],
+            "area_manager": p["area_manager"]
         }
+        for p in forecast_data.get("properties", []) if p.get("needs_service")
+    ]
 
-    # Count properties needing service
-    properties_needing_service = sum(1 for p in forecast_data["properties"] if p.get("needs_service", False))
-    
-    if properties_needing_service == 0:
-        return {
-            "summary": "No snow forecasted for the next 24 hours. All properties are clear.",
-            "properties_needing_service": 0,
-            "recommended_actions": []
-        }
+def hash_summary_input(forecast_data: dict) -> str:
+    payload = {
+        "total_properties": forecast_data.get("total_properties"),
+        "needing_service": get_summary_input(forecast_data)
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
 
-    # Prepare data for AI
+def generate_weather_ai_summary(forecast_data: dict, openai_api_key: str) -> dict:
+    """Call the LLM to summarise the properties needing service (blocking)"""
     properties_needing_service = [
         p for p in forecast_data["properties"] if p["needs_service"]
     ]
@@ -311,10 +366,9 @@ Properties requiring service in next 24 hours:
     prompt += "\n\nProvide:\n1. A 2-3 sentence executive summary\n2. Recommended start time for snow removal\n3. Priority properties (those with earliest open-by times)\n4. Estimated crew requirements"
 
     try:
-        import openai
-        openai.api_key = OPENAI_API_KEY
+        client = get_openai_client(openai_api_key)
 
-        response = openai.chat.completions.create(
+        response = client.chat.completions.create(
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": "You are a snow removal operations manager."},
@@ -336,9 +390,138 @@ Properties requiring service in next 24 hours:
         return {
             "summary": f"Error generating AI summary: {str(e)}",
             "properties_needing_service": properties_needing_service,
-            "properties": properties_needing_service
+            "properties": properties_needing_service,
+            "error": True
         }
 
+def refresh_weather_ai_summary(forecast_data: dict, input_hash: str = None):
+    """Regenerate and cache the AI summary for this forecast unless already cached (blocking)"""
+    input_hash = input_hash or hash_summary_input(forecast_data)
+    with _ai_summary_lock:
+        if _ai_summary_cache["input_hash"] == input_hash or input_hash in _ai_summary_refreshing:
+            return
+        # Failed recently for this input; wait out the backoff instead of paying for another call
+        if _ai_summary_failures.get(input_hash) is not None:
+            return
+        _ai_summary_refreshing.add(input_hash)
+
+    try:
+        openai_api_key = get_api_key("openai_api_key")
+        if not openai_api_key:
+            return
+        result = generate_weather_ai_summary(forecast_data, openai_api_key)
+        if result.get("error"):
+            _ai_summary_failures.set(input_hash, result["summary"])
+        else:
+            with _ai_summary_lock:
+                _ai_summary_cache["input_hash"] = input_hash
+                _ai_summary_cache["result"] = result
+    except Exception as e:
+        logger.error(f"Weather AI summary refresh failed: {e}", exc_info=True)
+        _ai_summary_failures.set(input_hash, f"Error generating AI summary: {str(e)}")
+    finally:
+        with _ai_summary_lock:
+            _ai_summary_refreshing.discard(input_hash)
+
+@router.get("/weather/ai-summary/")
+async def get_weather_ai_summary(current_user: dict = Depends(get_current_user)):
+    """
+    Get AI-powered weather summary and recommendations.
+    Served from cache; when the properties-needing-service input has changed the
+    summary is regenerated in the background and the previous one is returned
+    with "stale": true in the meantime. A failed generation is reported with
+    "error": true and not retried for WEATHER_AI_RETRY_SECONDS.
+    """
+
+    OPENAI_API_KEY = await run_in_threadpool(get_api_key, "openai_api_key")
+    if not OPENAI_API_KEY:
+        return {
+            "message": "AI summary requires OpenAI API key",
+            "summary": "Configure OPENAI_API_KEY environment variable for AI-powered summaries."
+        }
+
+    # Get forecast for all properties (prefetched when available)
+    forecast_data = get_fresh_forecast_snapshot()
+    if forecast_data is None:
+        forecast_data = await get_properties_weather_forecast(current_user)
+
+    # Check if we have data
+    if not forecast_data or "properties" not in forecast_data:
+        return {
+            "summary": "No property data available. Add coordinates to properties on the Property Map page.",
+            "properties_needing_service": 0,
+            "recommended_actions": []
+        }
+
+    # Count properties needing service
+    properties_needing_service = sum(1 for p in forecast_data["properties"] if p.get("needs_service", False))
+    
+    if properties_needing_service == 0:
+        return {
+            "summary": "No snow forecasted for the next 24 hours. All properties are clear.",
+            "properties_needing_service": 0,
+            "recommended_actions": []
+        }
+
+    input_hash = hash_summary_input(forecast_data)
+    with _ai_summary_lock:
+        cached_hash = _ai_summary_cache["input_hash"]
+        cached_result = _ai_summary_cache["result"]
+
+    if cached_hash == input_hash:
+        return cached_result
+
+    # Last attempt for this input failed: report it rather than polling into another paid call
+    failure = _ai_summary_failures.get(input_hash)
+    if failure is not None:
+        if cached_result:
+            return {**cached_result, "stale": True, "error": True, "error_message": failure,
+                    "retry_after": WEATHER_AI_RETRY_SECONDS}
+        properties_list = [p for p in forecast_data["properties"] if p["needs_service"]]
+        return {
+            "summary": failure,
+            "properties_needing_service": properties_list,
+            "properties": properties_list,
+            "error": True,
+            "retry_after": WEATHER_AI_RETRY_SECONDS
+        }
+
+    # Input changed (or nothing cached yet) - regenerate off the request path
+    asyncio.get_running_loop().run_in_executor(None, refresh_weather_ai_summary, forecast_data, input_hash)
+
+    if cached_result:
+        return {**cached_result, "stale": True}
+
+    properties_list = [p for p in forecast_data["properties"] if p["needs_service"]]
+    return {
+        "summary": "AI summary is being prepared. Check back in a few seconds.",
+        "properties_needing_service": properties_list,
+        "properties": properties_list,
+        "pending": True
+    }
+
+def prefetch_weather():
+    """Refresh the forecast snapshot and, if its needs-service input changed, the AI summary (blocking)"""
+    if not get_api_key("openweather_api_key"):
+        return
+
+    forecast_data = build_properties_forecast()
+    if not forecast_data.get("properties"):
+        return
+    store_forecast_snapshot(forecast_data)
+
+    if forecast_data["properties_needing_service"] and get_api_key("openai_api_key"):
+        refresh_weather_ai_summary(forecast_data)
+
+async def weather_prefetch_loop():
+    """Background task started at app startup; refreshes every WEATHER_PREFETCH_MINUTES"""
+    while True:
+        try:
+            await run_in_threadpool(prefetch_weather)
+        except Exception as e:
+            logger.error(f"Weather prefetch failed: {e}", exc_info=True)
+        await asyncio.sleep(WEATHER_PREFETCH_MINUTES * 60)
+
 @router.post("/weather/send-alert/")
 async def send_weather_alert(
     alert: WeatherAlert,
@@ -370,58 +553,64 @@ async def get_weather_settings(current_user: dict = Depends(get_current_user)):
         "weather_api_configured": bool(weather_key),
         "ai_enabled": bool(openai_key),
         "api_provider": "OpenWeatherMap" if weather_key else "Not configured",
-        "forecast_interval_minutes": 30,
+        "forecast_interval_minutes": WEATHER_PREFETCH_MINUTES,
         "alert_threshold_hours": 24
     }
 
-@router.get("/weather/by-zip/")
-async def get_weather_by_zip(
-    zip_code: str,
-    country_code: str = "US",
-    current_user: dict = Depends(get_current_user)
-):
-    """Get weather forecast by ZIP code"""
+def fetch_forecast_by_zip(zip_code: str, country_code: str = "US") -> dict:
+    """Fetch and normalise the next-24h forecast for a ZIP code (blocking)"""
     WEATHER_API_KEY = get_api_key("openweather_api_key")
     if not WEATHER_API_KEY:
         raise HTTPException(status_code=500, detail="Weather API key not configured")
 
-    try:
-        url = f"{WEATHER_API_BASE}/forecast"
-        params = {
-            "zip": f"{zip_code},{country_code}",
-            "appid": WEATHER_API_KEY,
-            "units": "imperial"
-        }
+    url = f"{WEATHER_API_BASE}/forecast"
+    params = {
+        "zip": f"{zip_code},{country_code}",
+        "appid": WEATHER_API_KEY,
+        "units": "imperial"
+    }
 
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
+    response = get_session().get(url, params=params, timeout=10)
+    response.raise_for_status()
 
-        data = response.json()
+    data = response.json()
 
-        # Process forecast data
-        forecasts = []
-        for item in data["list"][:8]:  # Next 24 hours
-            snow_amount = 0
-            if "snow" in item and "3h" in item["snow"]:
-                snow_amount = item["snow"]["3h"] * 0.0393701  # mm to inches
+    # Process forecast data
+    forecasts = []
+    for item in data["list"][:8]:  # Next 24 hours
+        snow_amount = 0
+        if "snow" in item and "3h" in item["snow"]:
+            snow_amount = item["snow"]["3h"] * 0.0393701  # mm to inches
 
-            forecasts.append({
-                "datetime": item["dt_txt"],
-                "temperature": item["main"]["temp"],
-                "description": item["weather"][0]["description"],
-                "snow_3h": snow_amount,
-                "precipitation_probability": item.get("pop", 0) * 100
-            })
+        forecasts.append({
+            "datetime": item["dt_txt"],
+            "temperature": item["main"]["temp"],
+            "description": item["weather"][0]["description"],
+            "snow_3h": snow_amount,
+            "precipitation_probability": item.get("pop", 0) * 100
+        })
 
-        return {
-            "zip_code": zip_code,
-            "city": data["city"]["name"],
-            "forecasts": forecasts,
-            "coordinates": {
-                "lat": data["city"]["coord"]["lat"],
-                "lon": data["city"]["coord"]["lon"]
-            }
+    return {
+        "zip_code": zip_code,
+        "city": data["city"]["name"],
+        "forecasts": forecasts,
+        "coordinates": {
+            "lat": data["city"]["coord"]["lat"],
+            "lon": data["city"]["coord"]["lon"]
         }
+    }
+
+@router.get("/weather/by-zip/")
+async def get_weather_by_zip(
+    zip_code: str,
+    country_code: str = "US",
+    current_user: dict = Depends(get_current_user)
+):
+    """Get weather forecast by ZIP code"""
+    try:
+        return await run_in_threadpool(fetch_forecast_by_zip, zip_code, country_code)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch weather by ZIP: {str(e)}")
 
@@ -451,7 +640,7 @@ async def get_weather_by_city(
             "units": "imperial"
         }
 
-        response = requests.get(url, params=params, timeout=10)
+        response = get_session().get(url, params=params, timeout=10)
         response.raise_for_status()
 
         data = response.json()
@@ -4,12 +4,16 @@ Handles manual tracking of winter storm events for billing and reporting
 Accessible by Managers and Admins only
 """
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from pydantic import BaseModel
 from typing import Optional
 from datetime import datetime
 from auth import get_current_user
 from db import fetch_query, execute_query
+from services.crew_locations import live_crews
+from services.dispatch import invalidate_active_events
+from services import geofence, proximity
+from utils.conditional import drop_validators, not_modified
 
 router = APIRouter()
 
@@ -25,7 +29,7 @@ class WinterEventComplete(BaseModel):
 
 
 @router.get("/winter-events/")
-def get_winter_events(current_user: dict = Depends(get_current_user)):
+def get_winter_events(request: Request, response: Response, current_user: dict = Depends(get_current_user)):
     """
     Get all winter events
     Accessible by Admins and Managers
@@ -36,6 +40,11 @@ def get_winter_events(current_user: dict = Depends(get_current_user)):
             detail="Manager or Admin access required"
         )
 
+    # Log/property counts change with every ticket, so winter_ops_logs is part of the version
+    cached = not_modified(request, response, ("winter_events", "winter_ops_logs", "users", "locations"))
+    if cached:
+        return cached
+
     # Get all winter events with stats
     query = """
         SELECT
@@ -49,6 +58,8 @@ def get_winter_events(current_user: dict = Depends(get_current_user)):
     """
 
     events = fetch_query(query)
+    if events is None:
+        drop_validators(response)
     return events if events else []
 
 
@@ -147,6 +158,7 @@ def create_winter_event(
                 current_user.get("user_id")
             )
         )
+        invalidate_active_events()
 
         return {
             "message": "Winter event started successfully",
@@ -203,6 +215,7 @@ def complete_winter_event(
 
     try:
         execute_query(query, (complete_data.end_date, event_id))
+        invalidate_active_events()
 
         return {
             "message": "Winter event completed successfully",
@@ -252,6 +265,7 @@ def cancel_winter_event(
             "UPDATE winter_events SET status = 'cancelled' WHERE id = %s",
             (event_id,)
         )
+        invalidate_active_events()
 
         return {
             "message": "Winter event cancelled",
@@ -294,6 +308,10 @@ def delete_winter_event(
 
     try:
         execute_query("DELETE FROM winter_events WHERE id = %s", (event_id,))
+        live_crews.forget_event(event_id)
+        proximity.forget_event(event_id)
+        geofence.forget_event(event_id)
+        invalidate_active_events()
 
         return {
             "message": f"Winter event '{event[0]['event_name']}' deleted",
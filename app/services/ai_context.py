@@ -0,0 +1,109 @@
+"""
+AI Context Cache
+Per-user context block for the AI assistant's system prompt.
+
+Built once from the user's name, accepted property assignments and today's
+open tickets, trimmed to a token budget, and reused across chat turns until
+something it depends on changes. Routes that write property_contractors,
+winter_ops_logs or users call invalidate_user_context() so the next turn
+rebuilds it.
+"""
+
+import os
+from datetime import date
+from db import fetch_query
+from utils.cache import TTLCache
+from utils.tokens import estimate_tokens
+
+# Token budget for the whole context block
+AI_CONTEXT_TOKEN_BUDGET = int(os.getenv("AI_CONTEXT_TOKEN_BUDGET", "400"))
+
+# Safety net for writes made outside this app (MCP server, n8n, manual SQL)
+AI_CONTEXT_TTL_SECONDS = int(os.getenv("AI_CONTEXT_TTL_SECONDS", "900"))
+
+# (user_id, role, date) -> context block
+_context_cache = TTLCache(ttl_seconds=AI_CONTEXT_TTL_SECONDS, maxsize=4096)
+
+
+def build_user_context(user_id: int, user_role: str) -> str:
+    """Query the user's name, accepted properties and open tickets into a prompt block"""
+    # Get user's name from database
+    user_info = fetch_query("SELECT name FROM users WHERE id = %s", (user_id,))
+    user_name = user_info[0]["name"] if user_info else "User"
+
+    # Get user's assigned properties
+    properties = fetch_query(
+        """SELECT l.id, l.name, l.address
+           FROM locations l
+           JOIN property_contractors pc ON l.id = pc.property_id
+           WHERE pc.contractor_id = %s AND pc.acceptance_status = 'accepted'
+           ORDER BY pc.is_primary DESC, l.name""",
+        (user_id,)
+    )
+
+    # Get active tickets
+    active_tickets = fetch_query(
+        """SELECT w.id, l.name as property_name, w.time_in
+           FROM winter_ops_logs w
+           JOIN locations l ON w.property_id = l.id
+           WHERE w.contractor_id = %s AND w.time_out IS NULL
+           AND DATE(w.time_in) = CURDATE()""",
+        (user_id,)
+    )
+
+    context = f"User: {user_name} (Role: {user_role})\n"
+    budget = AI_CONTEXT_TOKEN_BUDGET - estimate_tokens(context)
+
+    # Active tickets first - they matter most to the current conversation
+    if active_tickets:
+        section = f"\nActive Tickets ({len(active_tickets)}):\n"
+        budget -= estimate_tokens(section)
+        lines = []
+        for ticket in active_tickets:
+            line = f"- {ticket['property_name']} (started: {ticket['time_in']})\n"
+            cost = estimate_tokens(line)
+            if cost > budget:
+                break
+            lines.append(line)
+            budget -= cost
+        context += section + "".join(lines)
+
+    if properties:
+        section = f"\nAssigned Properties ({len(properties)}):\n"
+        budget -= estimate_tokens(section)
+        lines = []
+        for prop in properties:
+            line = f"- {prop['name']} ({prop['address']})\n"
+            cost = estimate_tokens(line)
+            if cost > budget:
+                break
+            lines.append(line)
+            budget -= cost
+        omitted = len(properties) - len(lines)
+        if omitted:
+            lines.append(f"- ...and {omitted} more (use the get_properties tool)\n")
+        context += section + "".join(lines)
+
+    return context
+
+
+def get_user_context_block(user_id: int, user_role: str) -> str:
+    """Cached context block; rebuilt after invalidation, TTL expiry or at midnight"""
+    key = (user_id, user_role, date.today())
+    context = _context_cache.get(key)
+    if context is None:
+        context = build_user_context(user_id, user_role)
+        _context_cache.set(key, context)
+    return context
+
+
+def invalidate_user_context(*user_ids: int):
+    """Drop cached context for these users (None entries are ignored)"""
+    targets = {int(u) for u in user_ids if u is not None}
+    if targets:
+        _context_cache.delete_where(lambda key: key[0] in targets)
+
+
+def invalidate_all_user_contexts():
+    """Drop every cached context (e.g. a property was renamed or deleted)"""
+    _context_cache.clear()
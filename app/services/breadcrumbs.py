@@ -0,0 +1,226 @@
+"""
+GPS Breadcrumb Store
+Crew tracks for proving time on site. Points arrive in batches from the
+mobile app and are kept per (event, user, hour) chunk: in memory while the
+hour is recent, written to gps_breadcrumb_chunks as one delta-encoded blob
+per chunk (a few bytes per point) every BREADCRUMB_FLUSH_SECONDS.
+
+Points are stored at one-second resolution and 1e-5 degrees (~1 m);
+duplicates for the same second are dropped and late points are merged into
+their hour in order.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from db import execute_many, fetch_query
+from utils.delta_codec import decode_deltas, encode_deltas
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+COORD_SCALE = 100000  # 1e-5 degrees
+
+# Chunks untouched this long are written (if needed) and dropped from memory
+CHUNK_IDLE_SECONDS = 2 * 3600
+
+_UPSERT_QUERY = """
+    INSERT INTO gps_breadcrumb_chunks
+        (winter_event_id, user_id, hour_start, point_count, first_point_at, last_point_at, data)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        point_count = VALUES(point_count),
+        first_point_at = VALUES(first_point_at),
+        last_point_at = VALUES(last_point_at),
+        data = VALUES(data)
+"""
+
+ChunkKey = Tuple[int, int, datetime]
+
+
+def hour_of(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+class _Chunk:
+    """One hour of one crew's points: {second into hour: (lat_e5, lon_e5)}"""
+
+    __slots__ = ("points", "used_at")
+
+    def __init__(self, points: Optional[Dict[int, Tuple[int, int]]] = None):
+        self.points = points or {}
+        self.used_at = time.monotonic()
+
+    def encode(self) -> bytes:
+        return encode_deltas([(s, lat, lon) for s, (lat, lon) in sorted(self.points.items())], 3)
+
+    @classmethod
+    def decode(cls, data: bytes) -> "_Chunk":
+        return cls({s: (lat, lon) for s, lat, lon in decode_deltas(data)})
+
+
+class BreadcrumbStore:
+    def __init__(self, flush_interval_seconds: float = 30.0):
+        self.flush_interval = flush_interval_seconds
+        self._lock = threading.Lock()
+        self._chunks: Dict[ChunkKey, _Chunk] = {}
+        self._dirty: set = set()
+        self._counts = {"points": 0, "duplicates": 0, "flushed_chunks": 0, "flushes": 0}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ----- lifecycle -----
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="breadcrumb-flush", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    # ----- ingest -----
+
+    def add_points(self, event_id: int, user_id: int, points: Iterable[Tuple[datetime, float, float]]) -> Dict:
+        """Add (timestamp, lat, lon) points; returns accepted/duplicate counts"""
+        by_chunk: Dict[ChunkKey, List[Tuple[int, int, int]]] = {}
+        for moment, lat, lon in points:
+            hour = hour_of(moment)
+            second = int((moment - hour).total_seconds())
+            by_chunk.setdefault((event_id, user_id, hour), []).append(
+                (second, round(lat * COORD_SCALE), round(lon * COORD_SCALE))
+            )
+
+        # Chunks for earlier hours may already be in the database (late sync, restart)
+        missing = [key for key in by_chunk if key not in self._chunks]
+        loaded = self._load_chunks(missing) if missing else {}
+
+        accepted = duplicates = 0
+        with self._lock:
+            for key, rows in by_chunk.items():
+                chunk = self._chunks.get(key) or loaded.get(key) or _Chunk()
+                self._chunks[key] = chunk
+                for second, lat, lon in rows:
+                    if second in chunk.points:
+                        duplicates += 1
+                        continue
+                    chunk.points[second] = (lat, lon)
+                    accepted += 1
+                chunk.used_at = time.monotonic()
+                self._dirty.add(key)
+            self._counts["points"] += accepted
+            self._counts["duplicates"] += duplicates
+        if not self._thread or not self._thread.is_alive():
+            self.start()
+        return {"accepted": accepted, "duplicates": duplicates}
+
+    # ----- queries -----
+
+    def track(self, event_id: int, user_id: int, start: Optional[datetime] = None,
+              end: Optional[datetime] = None) -> List[Dict]:
+        """Points for one crew between start and end (inclusive), oldest first"""
+        conditions = ["winter_event_id = %s", "user_id = %s"]
+        params: list = [event_id, user_id]
+        if start:
+            conditions.append("hour_start >= %s")
+            params.append(hour_of(start))
+        if end:
+            conditions.append("hour_start <= %s")
+            params.append(hour_of(end))
+        rows = fetch_query(
+            f"SELECT hour_start, data FROM gps_breadcrumb_chunks WHERE {' AND '.join(conditions)} ORDER BY hour_start",
+            tuple(params)
+        )
+        if rows is None:
+            raise RuntimeError("Could not load breadcrumbs")
+
+        chunks = {row["hour_start"]: _Chunk.decode(row["data"]) for row in rows}
+        # Unflushed points in memory are newer than the stored copy
+        with self._lock:
+            for (e, u, hour), chunk in self._chunks.items():
+                if e == event_id and u == user_id and (not start or hour >= hour_of(start)) and (not end or hour <= hour_of(end)):
+                    chunks[hour] = _Chunk(dict(chunk.points))
+
+        track = []
+        for hour in sorted(chunks):
+            for second, (lat, lon) in sorted(chunks[hour].points.items()):
+                moment = hour + timedelta(seconds=second)
+                if (start and moment < start) or (end and moment > end):
+                    continue
+                track.append({"t": moment, "lat": lat / COORD_SCALE, "lon": lon / COORD_SCALE})
+        return track
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"chunks": len(self._chunks), "dirty": len(self._dirty), **self._counts}
+
+    # ----- persistence -----
+
+    def flush(self) -> int:
+        """Upsert every changed chunk in one batch; returns how many were written"""
+        with self._lock:
+            if not self._dirty:
+                return 0
+            keys, self._dirty = self._dirty, set()
+            rows = []
+            for key in keys:
+                chunk = self._chunks.get(key)
+                if not chunk or not chunk.points:
+                    continue
+                event_id, user_id, hour = key
+                seconds = sorted(chunk.points)
+                rows.append((
+                    event_id, user_id, hour, len(seconds),
+                    hour + timedelta(seconds=seconds[0]), hour + timedelta(seconds=seconds[-1]),
+                    chunk.encode()
+                ))
+        try:
+            execute_many(_UPSERT_QUERY, rows)
+        except Exception as e:
+            logger.error(f"Failed to persist {len(rows)} breadcrumb chunks: {e}", exc_info=True)
+            with self._lock:
+                self._dirty.update(keys)
+            return 0
+        with self._lock:
+            self._counts["flushed_chunks"] += len(rows)
+            self._counts["flushes"] += 1
+        return len(rows)
+
+    def _load_chunks(self, keys: List[ChunkKey]) -> Dict[ChunkKey, _Chunk]:
+        loaded = {}
+        for event_id, user_id in {(k[0], k[1]) for k in keys}:
+            hours = [k[2] for k in keys if k[0] == event_id and k[1] == user_id]
+            placeholders = ", ".join(["%s"] * len(hours))
+            rows = fetch_query(
+                f"""SELECT hour_start, data FROM gps_breadcrumb_chunks
+                    WHERE winter_event_id = %s AND user_id = %s AND hour_start IN ({placeholders})""",
+                (event_id, user_id, *hours)
+            )
+            if rows is None:
+                raise RuntimeError("Could not load breadcrumbs")
+            for row in rows:
+                loaded[(event_id, user_id, row["hour_start"])] = _Chunk.decode(row["data"])
+        return loaded
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - CHUNK_IDLE_SECONDS
+        with self._lock:
+            for key in [k for k, c in self._chunks.items() if c.used_at < cutoff and k not in self._dirty]:
+                del self._chunks[key]
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+            self._evict_idle()
+
+
+breadcrumbs = BreadcrumbStore(flush_interval_seconds=float(os.getenv("BREADCRUMB_FLUSH_SECONDS", "30")))
@@ -0,0 +1,146 @@
+"""
+AI Chat History Compaction
+Keeps /ai/chat/ requests a roughly constant size as conversations grow.
+
+The widget sends the whole conversation every turn. Recent turns are kept
+verbatim up to a per-model token budget; older turns are folded into a short
+extractive summary so the model keeps the thread without the full text. The
+compaction point moves in fixed steps so the summary (and therefore the
+request prefix OpenAI caches) stays identical across several turns.
+
+Within a turn, tool results from earlier tool rounds are replaced with a stub
+once the model has answered them, and any single result is capped.
+"""
+
+import os
+from typing import Dict, List
+
+from utils.tokens import estimate_tokens, truncate_to_tokens
+
+# Tokens of conversation history (excluding the system prompt) sent per request
+MODEL_HISTORY_BUDGETS = {
+    "gpt-4o": 6000,
+    "gpt-4o-mini": 6000,
+    "gpt-4-turbo": 6000,
+    "gpt-4": 3000,
+    "gpt-3.5-turbo": 3000,
+}
+DEFAULT_HISTORY_BUDGET = 4000
+
+# Share of the history budget reserved for the summary of older turns
+SUMMARY_SHARE = 0.2
+
+# Older turns are compacted this many messages at a time (keeps the summary stable)
+COMPACT_STEP = 6
+
+# Longest excerpt of a single older message kept in the summary
+SUMMARY_LINE_TOKENS = 40
+
+# Cap on any one tool result sent back to the model
+TOOL_RESULT_TOKEN_BUDGET = int(os.getenv("AI_TOOL_RESULT_TOKEN_BUDGET", "1500"))
+
+STALE_TOOL_RESULT = '{"status": "omitted", "message": "Result already used in an earlier step"}'
+
+
+def history_budget(model: str) -> int:
+    """History token budget for a model (AI_HISTORY_TOKEN_BUDGET overrides)"""
+    override = os.getenv("AI_HISTORY_TOKEN_BUDGET")
+    if override:
+        return int(override)
+    for name in sorted(MODEL_HISTORY_BUDGETS, key=len, reverse=True):
+        if model.startswith(name):
+            return MODEL_HISTORY_BUDGETS[name]
+    return DEFAULT_HISTORY_BUDGET
+
+
+def message_tokens(message: Dict, model: str) -> int:
+    """Tokens for one chat message, including per-message overhead"""
+    return estimate_tokens(message.get("content") or "", model) + 4
+
+
+def summarize_turns(messages: List[Dict], budget: int, model: str) -> str:
+    """Extractive summary of older turns, newest lines kept when over budget"""
+    header = "Summary of earlier conversation (older messages omitted):\n"
+    budget -= estimate_tokens(header, model)
+    lines = []
+    for message in reversed(messages):
+        speaker = "User" if message["role"] == "user" else "Assistant"
+        text = " ".join((message.get("content") or "").split())
+        if not text:
+            continue
+        line = f"- {speaker}: {truncate_to_tokens(text, SUMMARY_LINE_TOKENS, model)}\n"
+        cost = estimate_tokens(line, model)
+        if cost > budget:
+            break
+        lines.append(line)
+        budget -= cost
+    return header + "".join(reversed(lines))
+
+
+def compact_history(history: List[Dict], model: str) -> List[Dict]:
+    """
+    Fit client-supplied chat history into the model's budget.
+    Returns the messages to send after the system prompt: an optional summary
+    system message followed by the most recent turns verbatim.
+    """
+    budget = history_budget(model)
+    costs = [message_tokens(m, model) for m in history]
+    if sum(costs) <= budget:
+        return list(history)
+
+    summary_budget = int(budget * SUMMARY_SHARE)
+    recent_budget = budget - summary_budget
+
+    # Walk back from the newest message until the recent budget is spent
+    cut = len(history)
+    used = 0
+    while cut > 0 and used + costs[cut - 1] <= recent_budget:
+        cut -= 1
+        used += costs[cut]
+
+    if cut == len(history):
+        # The latest message alone is over budget; send a trimmed copy of it
+        last = dict(history[-1])
+        last["content"] = truncate_to_tokens(last.get("content") or "", recent_budget - 4, model)
+        cut = len(history) - 1
+        recent = [last]
+    else:
+        # Snap the cut back to a step boundary when it still fits, so the
+        # summary only changes every COMPACT_STEP messages
+        aligned = (cut // COMPACT_STEP) * COMPACT_STEP
+        if aligned < cut and sum(costs[aligned:]) <= recent_budget + summary_budget // 2:
+            cut = aligned
+        recent = list(history[cut:])
+
+    if cut == 0:
+        return recent
+
+    summary = summarize_turns(history[:cut], summary_budget, model)
+    return [{"role": "system", "content": summary}] + recent
+
+
+def prune_tool_results(messages: List[Dict]) -> List[Dict]:
+    """
+    Replace tool results from earlier tool rounds with a stub.
+    Results answering the latest assistant tool call are kept (capped in size);
+    each tool message stays so every tool_call_id still has a response.
+    """
+    last_tool_round = None
+    for index in range(len(messages) - 1, -1, -1):
+        if messages[index].get("role") == "assistant" and messages[index].get("tool_calls"):
+            last_tool_round = index
+            break
+    if last_tool_round is None:
+        return messages
+
+    pruned = []
+    for index, message in enumerate(messages):
+        if message.get("role") == "tool" and index < last_tool_round:
+            message = {**message, "content": STALE_TOOL_RESULT}
+        pruned.append(message)
+    return pruned
+
+
+def cap_tool_result(content: str, model: str) -> str:
+    """Trim a serialized tool result to TOOL_RESULT_TOKEN_BUDGET tokens"""
+    return truncate_to_tokens(content, TOOL_RESULT_TOKEN_BUDGET, model)
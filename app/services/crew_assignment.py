@@ -0,0 +1,397 @@
+"""
+Crew Assignment Solver
+Deterministic property-to-crew assignment for ai_assign_property_list.
+
+Sidewalk work goes to sidewalk crews and lot work (plow/salt) to the other
+crews, as before. Each pool is solved separately:
+
+1. Every property gets an estimated service time from sqft, services and
+   trigger, and a priority from contract tier, trigger and open-by time.
+2. Greedy: properties are taken highest priority / longest first and given to
+   the crew that would finish it soonest (current load + travel + service).
+3. Local search: properties are moved or swapped between crews while that
+   lowers the busiest crew's finish time, then total travel.
+
+Travel is driving time from the crew's last known position (or its previous
+stop): from the shared distance matrix when one is passed, else haversine
+distance at an average road speed. The plan is identical for identical
+input and runs in milliseconds for a few hundred properties.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+from utils.spatial import haversine_miles, to_float
+
+# Average driving speed between stops (mph) and road/straight-line ratio
+AVG_TRAVEL_MPH = 25.0
+ROAD_FACTOR = 1.3
+
+# Assumed hop when either end has no coordinates (minutes)
+UNKNOWN_TRAVEL_MINUTES = 10.0
+
+# Service time model (minutes)
+SETUP_MINUTES = 10.0
+PLOW_MINUTES_PER_1000_SQFT = 1.0
+SALT_MINUTES_PER_1000_SQFT = 0.3
+SIDEWALK_MINUTES_PER_1000_SQFT = 0.5
+DEFAULT_SQFT = 20000
+
+TIER_PRIORITY = {"Premium": 3, "Standard": 2, "Basic": 1}
+
+# Local search: improving moves applied before stopping, and how many of the
+# other crew's nearest jobs are tried as swap partners
+MAX_LOCAL_SEARCH_PASSES = 200
+SWAP_CANDIDATES = 4
+
+
+def crew_type_for(equipment: Optional[str]) -> str:
+    """Same rule the assignment query uses: 'sidewalk' in the equipment name"""
+    return "sidewalk" if equipment and "sidewalk" in equipment.lower() else "non-sidewalk"
+
+
+def needs_sidewalk(prop: Dict) -> bool:
+    return bool(prop.get("sidewalk_snow_rate") or prop.get("sidewalk_deice_rate"))
+
+
+def needs_lot(prop: Dict) -> bool:
+    return bool(prop.get("plow") or prop.get("salt")) or not needs_sidewalk(prop)
+
+
+def service_minutes(prop: Dict, crew_type: str) -> float:
+    """Estimated on-site minutes for this crew type"""
+    sqft = prop.get("sqft") or DEFAULT_SQFT
+    per_k = sqft / 1000.0
+    if crew_type == "sidewalk":
+        minutes = SETUP_MINUTES + per_k * SIDEWALK_MINUTES_PER_1000_SQFT
+    else:
+        plow = prop.get("plow")
+        salt = prop.get("salt")
+        if not plow and not salt:
+            plow = True
+        minutes = SETUP_MINUTES
+        if plow:
+            minutes += per_k * PLOW_MINUTES_PER_1000_SQFT
+        if salt:
+            minutes += per_k * SALT_MINUTES_PER_1000_SQFT
+    # Zero-tolerance sites get a full clear every visit; deeper triggers mean heavier snow per visit
+    trigger = prop.get("trigger_amount")
+    if trigger is not None and float(trigger) >= 2:
+        minutes *= 1.0 + min(float(trigger) - 2, 4) * 0.1
+    return round(minutes, 1)
+
+
+def priority_score(prop: Dict) -> float:
+    """Higher is more urgent: contract tier, then tighter trigger, then earlier open-by time"""
+    score = TIER_PRIORITY.get(prop.get("contract_tier") or "Standard", 2) * 10.0
+    trigger = prop.get("trigger_amount")
+    if trigger is not None:
+        score += max(0.0, 3.0 - float(trigger))
+    open_by = prop.get("open_by_time")
+    if open_by:
+        # "06:00" / timedelta(hours=6) -> earlier deadlines score higher
+        text = str(open_by)
+        try:
+            hours, minutes = text.split(":")[:2]
+            score += max(0.0, 24 - (int(hours) + int(minutes) / 60.0)) / 6.0
+        except ValueError:
+            pass
+    return round(score, 2)
+
+
+def travel_minutes(a: Optional[Tuple[float, float]], b: Optional[Tuple[float, float]]) -> float:
+    if a is None or b is None:
+        return UNKNOWN_TRAVEL_MINUTES
+    miles = haversine_miles(a[0], a[1], b[0], b[1]) * ROAD_FACTOR
+    return miles / AVG_TRAVEL_MPH * 60.0
+
+
+def _point(row: Dict, lat_key: str, lon_key: str) -> Optional[Tuple[float, float]]:
+    lat = to_float(row.get(lat_key))
+    lon = to_float(row.get(lon_key))
+    return (lat, lon) if lat is not None and lon is not None else None
+
+
+class _Pool:
+    """One crew type's assignment problem"""
+
+    def __init__(self, crew_type: str, jobs: List[Dict], crews: List[Dict], distances=None):
+        self.crew_type = crew_type
+        self.jobs = {job["id"]: job for job in jobs}
+        self.crews = crews
+        self.start = {crew["id"]: _point(crew, "last_location_lat", "last_location_lon") for crew in crews}
+        self.routes: Dict[int, List[int]] = {crew["id"]: [] for crew in crews}
+        self._hops: Dict[Tuple, float] = {}
+        self._symmetric = True  # a->b and b->a share one hop entry
+        if distances is not None and jobs:
+            self._load_hops(distances)
+
+    def _load_hops(self, distances):
+        """Fill the hop cache from the shared distance matrix in one pass"""
+        ids = sorted(self.jobs)
+        known = lambda value: UNKNOWN_TRAVEL_MINUTES if value is None else value
+        _, minutes = distances.table(ids)
+        # Road times can differ by direction (one-way streets); keep both then
+        self._symmetric = getattr(distances.provider, "symmetric", True)
+        for i, a in enumerate(ids):
+            for j in range(i + 1, len(ids)):
+                self._hops[(a, ids[j])] = known(minutes[i][j])
+                if not self._symmetric:
+                    self._hops[(ids[j], a)] = known(minutes[j][i])
+        for crew_id, start in self.start.items():
+            if start is not None:
+                _, from_crew = distances.from_point(start, ids)
+                for job_id, value in zip(ids, from_crew):
+                    self._hops[(("crew", crew_id), job_id)] = known(value)
+
+    def hop(self, crew_id: int, prev: Optional[int], job_id: Optional[int]) -> float:
+        """Travel minutes from prev (None = crew start) to job_id (None = end of route)"""
+        if job_id is None:
+            return 0.0
+        if prev is None:
+            if self.start[crew_id] is None:
+                return 0.0  # no known start: the route begins at its first stop
+            key = (("crew", crew_id), job_id)
+            if key not in self._hops:
+                self._hops[key] = travel_minutes(self.start[crew_id], self.jobs[job_id]["point"])
+            return self._hops[key]
+        key = (prev, job_id) if prev < job_id or not self._symmetric else (job_id, prev)
+        if key not in self._hops:
+            self._hops[key] = travel_minutes(self.jobs[prev]["point"], self.jobs[job_id]["point"])
+        return self._hops[key]
+
+    def travel(self, crew_id: int, route: List[int]) -> float:
+        total, prev = 0.0, None
+        for job_id in route:
+            total += self.hop(crew_id, prev, job_id)
+            prev = job_id
+        return total
+
+    def finish(self, crew_id: int, route: List[int]) -> float:
+        return self.travel(crew_id, route) + sum(self.jobs[j]["service_minutes"] for j in route)
+
+    def removal_delta(self, crew_id: int, route: List[int], index: int) -> float:
+        prev = route[index - 1] if index > 0 else None
+        nxt = route[index + 1] if index + 1 < len(route) else None
+        job_id = route[index]
+        return (
+            self.hop(crew_id, prev, nxt)
+            - self.hop(crew_id, prev, job_id)
+            - self.hop(crew_id, job_id, nxt)
+            - self.jobs[job_id]["service_minutes"]
+        )
+
+    def best_insertion(self, crew_id: int, route: List[int], job_id: int) -> Tuple[float, int]:
+        """(added minutes, position) for the cheapest place to insert job_id"""
+        hop = self.hop
+        stops = [None] + route + [None]
+        to_job = [hop(crew_id, stop, job_id) for stop in stops[:-1]]
+        from_job = [hop(crew_id, job_id, stop) for stop in stops[1:]]
+        best_added, best_index = None, 0
+        for index in range(len(route) + 1):
+            added = to_job[index] + from_job[index] - hop(crew_id, stops[index], stops[index + 1])
+            if best_added is None or added < best_added - 1e-9:
+                best_added, best_index = added, index
+        return best_added + self.jobs[job_id]["service_minutes"], best_index
+
+    def nearest_neighbour(self, crew_id: int, job_ids: List[int]) -> List[int]:
+        """Visit order by nearest next stop, higher priority first on ties"""
+        remaining = sorted(job_ids, key=lambda j: (-self.jobs[j]["priority"], j))
+        order, prev = [], None
+        while remaining:
+            best = min(remaining, key=lambda j: (round(self.hop(crew_id, prev, j), 3), -self.jobs[j]["priority"], j))
+            order.append(best)
+            remaining.remove(best)
+            prev = best
+        return order
+
+    def greedy(self):
+        """Highest priority / longest job first, to the crew that would finish it soonest"""
+        finish = {crew["id"]: 0.0 for crew in self.crews}
+        ordered = sorted(self.jobs.values(), key=lambda j: (-j["priority"], -j["service_minutes"], j["id"]))
+        for job in ordered:
+            def cost(crew):
+                route = self.routes[crew["id"]]
+                hop = self.hop(crew["id"], route[-1] if route else None, job["id"])
+                return (finish[crew["id"]] + hop + job["service_minutes"], hop, crew["id"])
+            crew = min(self.crews, key=cost)
+            finish[crew["id"]] = cost(crew)[0]
+            self.routes[crew["id"]].append(job["id"])
+
+    def local_search(self):
+        """
+        Move or swap jobs off the busiest crew while that lowers
+        (busiest finish, total travel). Candidate moves are priced with
+        O(route) insertion/removal deltas and the first improving one is taken.
+        """
+        finish = {cid: self.finish(cid, route) for cid, route in self.routes.items()}
+        crew_ids = [crew["id"] for crew in self.crews]
+
+        for _ in range(MAX_LOCAL_SEARCH_PASSES):
+            busiest = max(crew_ids, key=lambda cid: (finish[cid], -cid))
+            source = self.routes[busiest]
+            applied = False
+
+            for i, job_id in enumerate(source):
+                removed = self.removal_delta(busiest, source, i)
+                for other in crew_ids:
+                    if other == busiest:
+                        continue
+                    target = self.routes[other]
+                    rest = max((finish[c] for c in crew_ids if c not in (busiest, other)), default=0.0)
+
+                    # Relocate (only worth pricing if the job's service time alone
+                    # doesn't already push the other crew past the busiest one),
+                    # then swaps with the closest few jobs on the other crew
+                    moves = []
+                    if finish[other] + self.jobs[job_id]["service_minutes"] < finish[busiest]:
+                        added, pos = self.best_insertion(other, target, job_id)
+                        moves.append((removed, added, pos, None, None))
+                    partners = sorted(range(len(target)), key=lambda k: (self.hop(other, job_id, target[k]), target[k]))
+                    for k in partners[:SWAP_CANDIDATES]:
+                        # Inserting never costs less than the service time, so skip
+                        # swaps that would already leave either crew past the makespan
+                        other_removed = self.removal_delta(other, target, k)
+                        if (removed + self.jobs[target[k]]["service_minutes"] > 1e-9
+                                or finish[other] + other_removed + self.jobs[job_id]["service_minutes"] > finish[busiest]):
+                            continue
+                        a = source[:i] + source[i + 1:]
+                        b = target[:k] + target[k + 1:]
+                        a_added, a_pos = self.best_insertion(busiest, a, target[k])
+                        b_added, b_pos = self.best_insertion(other, b, job_id)
+                        moves.append((removed + a_added, other_removed + b_added, b_pos, k, a_pos))
+
+                    for busiest_delta, other_delta, pos, k, a_pos in moves:
+                        new_makespan = max(rest, finish[busiest] + busiest_delta, finish[other] + other_delta)
+                        # Service minutes are conserved, so the summed delta is the change in travel
+                        if (round(new_makespan, 3), round(busiest_delta + other_delta, 3)) < (round(finish[busiest], 3), 0.0):
+                            source, target = source[:], target[:]
+                            source.pop(i)
+                            if k is not None:
+                                source.insert(a_pos, target.pop(k))
+                            target.insert(pos, job_id)
+                            self.routes[busiest], self.routes[other] = source, target
+                            finish[busiest] = self.finish(busiest, source)
+                            finish[other] = self.finish(other, target)
+                            applied = True
+                            break
+                    if applied:
+                        break
+                if applied:
+                    break
+
+            if not applied:
+                break
+
+        # Keep whichever visit order is shorter: the searched one or nearest neighbour
+        for cid, route in self.routes.items():
+            alternative = self.nearest_neighbour(cid, route)
+            if self.travel(cid, alternative) < self.travel(cid, route) - 1e-9:
+                self.routes[cid] = alternative
+
+    def solve(self) -> Tuple[List[Dict], List[Dict]]:
+        if not self.jobs or not self.crews:
+            return [], []
+        self.greedy()
+        self.local_search()
+
+        assignments, crew_plans = [], []
+        for crew in self.crews:
+            order = self.routes[crew["id"]]
+            travel = self.travel(crew["id"], order)
+            finish = self.finish(crew["id"], order)
+            position = self.start[crew["id"]]
+            prev = None
+            elapsed = 0.0
+            for sequence, job_id in enumerate(order, start=1):
+                job = self.jobs[job_id]
+                elapsed += self.hop(crew["id"], prev, job_id) + job["service_minutes"]
+                hop_miles = (
+                    round(haversine_miles(*position, *job["point"]), 2)
+                    if position is not None and job["point"] is not None else None
+                )
+                reasoning = (
+                    f"{self.crew_type.capitalize()} crew; stop {sequence} of {len(order)}, "
+                    f"~{job['service_minutes']:.0f} min on site"
+                )
+                if hop_miles is not None:
+                    reasoning += f", {hop_miles} mi from previous position"
+                reasoning += f"; crew finishes ~{finish:.0f} min (balanced across {len(self.crews)} crews)"
+                assignments.append({
+                    "property_id": job_id,
+                    "property_name": job["name"],
+                    "contractor_id": crew["id"],
+                    "contractor_name": crew["name"],
+                    "crew_type": self.crew_type,
+                    "sequence": sequence,
+                    "est_service_minutes": job["service_minutes"],
+                    "est_arrival_minutes": round(elapsed - job["service_minutes"], 1),
+                    "priority": job["priority"],
+                    "reasoning": reasoning
+                })
+                position = job["point"] or position
+                prev = job_id
+            crew_plans.append({
+                "contractor_id": crew["id"],
+                "contractor_name": crew["name"],
+                "crew_type": self.crew_type,
+                "properties": len(order),
+                "service_minutes": round(finish - travel, 1),
+                "travel_minutes": round(travel, 1),
+                "est_finish_minutes": round(finish, 1)
+            })
+        return assignments, crew_plans
+
+
+def solve_assignments(properties: List[Dict], sidewalk_crews: List[Dict], non_sidewalk_crews: List[Dict],
+                      distances=None) -> Dict:
+    """
+    Assign properties to crews. Properties with sidewalk rates go to sidewalk
+    crews; plow/salt work goes to non-sidewalk crews (a property with both
+    gets one of each). If no property in the list has sidewalk rates, the
+    lightest property goes to a sidewalk crew instead of a lot crew, so both
+    crew types still get work as under the old one-of-each-type rule; every
+    other property gets a single crew. distances is the shared DistanceMatrix
+    (services.distance_matrix).
+
+    Returns {"assignments": [...], "crews": [...], "summary": {...}}.
+    """
+    lot_properties = [p for p in properties if needs_lot(p)]
+    sidewalk_properties = [p for p in properties if needs_sidewalk(p)]
+    sidewalk_scope = "properties with sidewalk rates"
+    if not sidewalk_properties:
+        sidewalk_scope = "none"
+        if sidewalk_crews and non_sidewalk_crews and len(lot_properties) > 1:
+            lightest = min(lot_properties, key=lambda p: (service_minutes(p, "sidewalk"), p["id"]))
+            sidewalk_properties = [lightest]
+            lot_properties = [p for p in lot_properties if p is not lightest]
+            sidewalk_scope = "one property (none have sidewalk rates)"
+
+    pools = []
+    for crew_type, crews, pool_properties in (("non-sidewalk", non_sidewalk_crews, lot_properties),
+                                              ("sidewalk", sidewalk_crews, sidewalk_properties)):
+        jobs = [{
+            "id": prop["id"],
+            "name": prop["name"],
+            "point": _point(prop, "latitude", "longitude"),
+            "service_minutes": service_minutes(prop, crew_type),
+            "priority": priority_score(prop)
+        } for prop in pool_properties]
+        pools.append(_Pool(crew_type, jobs, sorted(crews, key=lambda c: c["id"]), distances))
+
+    assignments, crew_plans = [], []
+    for pool in pools:
+        pool_assignments, pool_crews = pool.solve()
+        assignments.extend(pool_assignments)
+        crew_plans.extend(pool_crews)
+
+    finishes = [c["est_finish_minutes"] for c in crew_plans if c["properties"]]
+    return {
+        "assignments": assignments,
+        "crews": crew_plans,
+        "summary": {
+            "method": "greedy + local search",
+            "est_makespan_minutes": max(finishes) if finishes else 0.0,
+            "total_travel_minutes": round(sum(c["travel_minutes"] for c in crew_plans), 1),
+            "sidewalk_scope": sidewalk_scope
+        }
+    }
@@ -0,0 +1,305 @@
+"""
+Live Crew Location Store
+In-memory positions and status of checked-in crews, keyed by (event, user).
+
+GPS pings used to cost a SELECT and an UPDATE on event_checkins each, and the
+active-crew endpoints re-read the table on every poll. Pings now only touch
+memory; changed positions are written to event_checkins in one batch every
+few seconds, and the active/available crew lists are answered from memory
+(each event's check-ins are loaded once, on first use).
+
+Other writers to event_checkins (check-in/out, status changes, SMS commands)
+call refresh() after their write so the store picks up the new row.
+Assumes one app process serves check-ins.
+"""
+
+import os
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from db import execute_many, fetch_query
+from utils.cache import TTLCache
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+ACTIVE_STATUSES = ("checked_in", "working")
+
+_CHECKINS_QUERY = """
+    SELECT
+        ec.*,
+        u.name as user_name,
+        u.role as user_role,
+        u.default_equipment,
+        u.phone as user_phone,
+        l.name as current_property_name,
+        l.address as current_property_address
+    FROM event_checkins ec
+    JOIN users u ON ec.user_id = u.id
+    LEFT JOIN locations l ON ec.current_property_id = l.id
+    WHERE ec.winter_event_id = %s AND ec.checked_out_at IS NULL
+"""
+
+# Pings own the position and current property; status only when the ping sets it
+_FLUSH_QUERY = """
+    UPDATE event_checkins
+    SET last_location_lat = %s,
+        last_location_lon = %s,
+        last_location_update = %s,
+        current_property_id = %s,
+        status = COALESCE(%s, status)
+    WHERE id = %s
+"""
+
+# Used when another handler has just written the row: keep its status/property
+_FLUSH_POSITION_QUERY = """
+    UPDATE event_checkins
+    SET last_location_lat = %s, last_location_lon = %s, last_location_update = %s
+    WHERE id = %s
+"""
+
+# Columns each endpoint returned when it queried the table directly
+_ACTIVE_FIELDS_EXCLUDED = ("user_phone",)
+_AVAILABLE_FIELDS_EXCLUDED = ("default_equipment", "current_property_name", "current_property_address")
+
+Key = Tuple[int, int]
+
+
+def _minutes_since(moment: Optional[datetime], now: datetime) -> Optional[int]:
+    """TIMESTAMPDIFF(MINUTE, moment, now)"""
+    if moment is None:
+        return None
+    return int((now - moment).total_seconds() // 60)
+
+
+class LiveCrewStore:
+    """
+    record_ping() absorbs location updates; active_checkins() and
+    available_crews() answer the dispatch endpoints from memory.
+    """
+
+    def __init__(self, flush_interval_seconds: float = 10.0):
+        self.flush_interval = flush_interval_seconds
+        self._lock = threading.RLock()
+        self._crews: Dict[Key, Dict] = {}
+        self._loaded_events: set = set()
+        self._dirty: Dict[Key, Optional[str]] = {}  # key -> status set by a ping (or None)
+        self._property_names = TTLCache(ttl_seconds=600, maxsize=5000)
+        self._listeners: List[Callable[[str, Dict], None]] = []
+        self._counts = {"pings": 0, "pings_loaded": 0, "flushed": 0, "flushes": 0}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ----- lifecycle -----
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="crew-location-flush", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the flusher and write any pending positions"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    # ----- reads -----
+
+    def active_checkins(self, event_id: int) -> List[Dict]:
+        """Crews checked in or working, as /events/{id}/checkins/active returned them"""
+        now = datetime.now()
+        rows = []
+        for crew in self._event_crews(event_id):
+            if crew["status"] not in ACTIVE_STATUSES:
+                continue
+            row = {k: v for k, v in crew.items() if k not in _ACTIVE_FIELDS_EXCLUDED}
+            row["minutes_active"] = _minutes_since(crew.get("checked_in_at"), now)
+            rows.append(row)
+        # ORDER BY status DESC, checked_in_at ASC
+        rows.sort(key=lambda r: r.get("checked_in_at") or now)
+        rows.sort(key=lambda r: r["status"], reverse=True)
+        return rows
+
+    def available_crews(self, event_id: int) -> List[Dict]:
+        """Checked-in crews not on a property, as /events/{id}/available-crews returned them"""
+        now = datetime.now()
+        rows = []
+        for crew in self._event_crews(event_id):
+            if crew["status"] != "checked_in" or crew.get("current_property_id") is not None:
+                continue
+            row = {k: v for k, v in crew.items() if k not in _AVAILABLE_FIELDS_EXCLUDED}
+            row["minutes_since_location_update"] = _minutes_since(crew.get("last_location_update"), now)
+            rows.append(row)
+        rows.sort(key=lambda r: r.get("checked_in_at") or now)
+        return rows
+
+    def get(self, event_id: int, user_id: int) -> Optional[Dict]:
+        """One crew's live check-in (None when not checked in)"""
+        with self._lock:
+            crew = self._crews.get((event_id, user_id))
+            if crew is not None or event_id in self._loaded_events:
+                return dict(crew) if crew else None
+        return self._load_one(event_id, user_id)
+
+    # ----- writes -----
+
+    def record_ping(self, event_id: int, user_id: int, lat: float, lon: float,
+                    current_property_id: Optional[int] = None, status: Optional[str] = None) -> Optional[Dict]:
+        """Apply a location ping in memory; returns the updated crew, or None if not checked in"""
+        key = (event_id, user_id)
+        with self._lock:
+            known = key in self._crews
+        if not known and self._load_one(event_id, user_id) is None:
+            return None
+
+        property_name, property_address = self._property_label(current_property_id)
+        with self._lock:
+            crew = self._crews.get(key)
+            if crew is None:
+                # Checked out between the load and now
+                return None
+            crew.update({
+                "last_location_lat": lat,
+                "last_location_lon": lon,
+                "last_location_update": datetime.now(),
+                "current_property_id": current_property_id,
+                "current_property_name": property_name,
+                "current_property_address": property_address,
+            })
+            if status:
+                crew["status"] = status
+            self._dirty[key] = status or self._dirty.get(key)
+            self._counts["pings"] += 1
+            self._counts["pings_loaded"] += not known
+            snapshot = dict(crew)
+        if not self._thread or not self._thread.is_alive():
+            self.start()
+        self._notify("location", snapshot)
+        return snapshot
+
+    def refresh(self, event_id: int, user_id: int) -> Optional[Dict]:
+        """
+        Re-read one crew after another handler wrote its event_checkins row.
+        A pending ping keeps its position but not its status or property.
+        """
+        key = (event_id, user_id)
+        with self._lock:
+            crew = self._crews.pop(key, None)
+            pending = key in self._dirty
+            self._dirty.pop(key, None)
+            if crew and pending:
+                position = (crew["last_location_lat"], crew["last_location_lon"], crew["last_location_update"], crew["id"])
+        if crew and pending:
+            execute_many(_FLUSH_POSITION_QUERY, [position])
+        fresh = self._load_one(event_id, user_id)
+        self._notify("checkin", fresh or {**(crew or {}), "winter_event_id": event_id, "user_id": user_id, "checked_out": True})
+        return fresh
+
+    def forget_event(self, event_id: int):
+        """Drop an event's crews (e.g. the event was closed)"""
+        self.flush()
+        with self._lock:
+            for key in [k for k in self._crews if k[0] == event_id]:
+                del self._crews[key]
+            self._loaded_events.discard(event_id)
+
+    def add_listener(self, callback: Callable[[str, Dict], None]):
+        """
+        callback(kind, crew) runs in the caller's thread. kind is "location"
+        after a ping or "checkin" after refresh(). A checked-out crew has
+        checked_out=True.
+        """
+        self._listeners.append(callback)
+
+    def flush(self) -> int:
+        """Write changed positions in one batch; returns how many were written"""
+        with self._lock:
+            if not self._dirty:
+                return 0
+            pending, self._dirty = self._dirty, {}
+            rows = []
+            for key, status in pending.items():
+                crew = self._crews.get(key)
+                if crew:
+                    rows.append((
+                        crew["last_location_lat"], crew["last_location_lon"], crew["last_location_update"],
+                        crew.get("current_property_id"), status, crew["id"]
+                    ))
+        try:
+            execute_many(_FLUSH_QUERY, rows)
+        except Exception as e:
+            logger.error(f"Failed to persist {len(rows)} crew locations: {e}", exc_info=True)
+            with self._lock:
+                for key, status in pending.items():
+                    self._dirty.setdefault(key, status)
+            return 0
+        with self._lock:
+            self._counts["flushed"] += len(rows)
+            self._counts["flushes"] += 1
+        return len(rows)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "crews": len(self._crews),
+                "events_loaded": len(self._loaded_events),
+                "dirty": len(self._dirty),
+                **self._counts
+            }
+
+    # ----- internals -----
+
+    def _event_crews(self, event_id: int) -> List[Dict]:
+        with self._lock:
+            if event_id in self._loaded_events:
+                return [dict(c) for k, c in self._crews.items() if k[0] == event_id]
+        rows = fetch_query(_CHECKINS_QUERY, (event_id,))
+        if rows is None:
+            raise RuntimeError("Could not load event check-ins")
+        with self._lock:
+            if event_id not in self._loaded_events:
+                for row in rows:
+                    # Keep crews that pinged while the event was loading
+                    self._crews.setdefault((event_id, row["user_id"]), row)
+                self._loaded_events.add(event_id)
+            return [dict(c) for k, c in self._crews.items() if k[0] == event_id]
+
+    def _load_one(self, event_id: int, user_id: int) -> Optional[Dict]:
+        rows = fetch_query(
+            _CHECKINS_QUERY + " AND ec.user_id = %s ORDER BY ec.checked_in_at DESC LIMIT 1",
+            (event_id, user_id)
+        )
+        if not rows:
+            return None
+        with self._lock:
+            crew = self._crews.setdefault((event_id, user_id), rows[0])
+            return dict(crew)
+
+    def _property_label(self, property_id: Optional[int]) -> Tuple[Optional[str], Optional[str]]:
+        if property_id is None:
+            return None, None
+        label = self._property_names.get(property_id)
+        if label is None:
+            rows = fetch_query("SELECT name, address FROM locations WHERE id = %s", (property_id,))
+            label = (rows[0]["name"], rows[0]["address"]) if rows else (None, None)
+            self._property_names.set(property_id, label)
+        return label
+
+    def _notify(self, kind: str, crew: Dict):
+        for listener in self._listeners:
+            try:
+                listener(kind, crew)
+            except Exception as e:
+                logger.error(f"Crew location listener failed: {e}", exc_info=True)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+
+live_crews = LiveCrewStore(flush_interval_seconds=float(os.getenv("CREW_LOCATION_FLUSH_SECONDS", "10")))
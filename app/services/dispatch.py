@@ -0,0 +1,108 @@
+"""
+Dispatch Feed
+One server-sent event channel per winter event for dispatch views: crews
+checking in/out, status and position changes, route stops starting and
+finishing, and assignments being accepted or declined.
+
+Clients load the existing endpoints once (/events/{id}/checkins/active,
+/events/{id}/available-crews, /properties/board/), then apply these deltas
+instead of polling each view. Events:
+    crew        check-in, check-out or status change (checked_out=True when gone)
+    location    GPS ping (position, status, current property)
+    route_stop  route property started or completed
+    assignment  property or route assignment accepted or declined
+    geofence    crew arrived at or left a property (see services/geofence.py)
+    eta         route assignment's projected finish changed (see services/route_eta.py)
+    reset       history unavailable, reload the views
+"""
+
+import threading
+from datetime import datetime
+from typing import Dict, List
+
+from db import fetch_query
+from services.crew_locations import live_crews
+from utils.cache import TTLCache
+from utils.event_stream import EventFeed
+
+_feeds: Dict[int, EventFeed] = {}
+_feeds_lock = threading.Lock()
+_active_events = TTLCache(ttl_seconds=30, maxsize=1)
+
+# Crew fields sent to dispatch views
+CREW_FIELDS = (
+    "user_id", "user_name", "user_role", "status", "equipment_in_use", "checked_in_at",
+    "current_property_id", "current_property_name", "last_location_lat", "last_location_lon",
+    "last_location_update"
+)
+
+
+def dispatch_feed(winter_event_id: int) -> EventFeed:
+    with _feeds_lock:
+        feed = _feeds.get(winter_event_id)
+        if feed is None:
+            feed = _feeds[winter_event_id] = EventFeed(f"dispatch-{winter_event_id}", history=2000)
+        return feed
+
+
+def publish(winter_event_id: int, event: str, data: Dict) -> int:
+    return dispatch_feed(winter_event_id).publish(event, {"winter_event_id": winter_event_id, **data})
+
+
+def active_event_ids() -> List[int]:
+    """Ids of active winter events (cached briefly)"""
+    ids = _active_events.get("ids")
+    if ids is None:
+        rows = fetch_query("SELECT id FROM winter_events WHERE status = 'active'") or []
+        ids = [r["id"] for r in rows]
+        _active_events.set("ids", ids)
+    return ids
+
+
+def invalidate_active_events():
+    _active_events.clear()
+
+
+def publish_to_active_events(event: str, data: Dict):
+    """For changes not tied to an event (assignments, route progress)"""
+    for winter_event_id in active_event_ids():
+        publish(winter_event_id, event, data)
+
+
+def publish_route_stop(action: str, assignment: Dict, property_id: int, user_id: int):
+    """action: started | completed"""
+    publish_to_active_events("route_stop", {
+        "action": action,
+        "assignment_id": assignment["id"],
+        "route_id": assignment["route_id"],
+        "property_id": property_id,
+        "user_id": user_id,
+        "at": datetime.now()
+    })
+
+
+def publish_assignment(assignment_type: str, action: str, assignment: Dict, user_id: int):
+    """assignment_type: property | route; action: accepted | declined"""
+    publish_to_active_events("assignment", {
+        "assignment_type": assignment_type,
+        "action": action,
+        "assignment_id": assignment["id"],
+        "property_id": assignment.get("property_id"),
+        "route_id": assignment.get("route_id"),
+        "user_id": user_id,
+        "at": datetime.now()
+    })
+
+
+def _on_crew_change(kind: str, crew: Dict):
+    winter_event_id = crew.get("winter_event_id")
+    if winter_event_id is None:
+        return
+    data = {field: crew.get(field) for field in CREW_FIELDS}
+    if kind == "location":
+        publish(winter_event_id, "location", data)
+    else:
+        publish(winter_event_id, "crew", {**data, "checked_out": bool(crew.get("checked_out"))})
+
+
+live_crews.add_listener(_on_crew_change)
@@ -0,0 +1,348 @@
+"""
+Property Distance Matrix
+Driving miles and minutes between properties, shared by the route optimiser,
+crew assignment and ETA estimates so pairwise distances are worked out once
+rather than on every request.
+
+Distances come from a provider: straight-line (haversine) miles times a road
+factor at an average speed by default, or a road-routing service (an OSRM
+table endpoint at ROAD_DISTANCE_URL) when one is configured. Tests and local
+setups can swap in their own with set_provider().
+
+Each property has an index; a row holds the distances from one property to
+every other as float32 arrays (NaN where either end has no coordinates).
+Rows are computed on first use, up to DISTANCE_MATRIX_MAX_ROWS of them (least
+recently used dropped first), and warmed in the background at startup.
+
+When properties change the coordinates are re-read and only the difference
+is applied: new properties are appended (existing rows grow on next use),
+a moved property's row is recomputed and its column patched in every cached
+row, and deleted properties leave an unused slot until the next compaction.
+"""
+
+import math
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from db import fetch_query
+from services import proximity
+from services.crew_assignment import AVG_TRAVEL_MPH, ROAD_FACTOR
+from utils.logger import get_logger
+from utils.spatial import haversine_miles, to_float
+
+logger = get_logger(__name__)
+
+MAX_ROWS = int(os.getenv("DISTANCE_MATRIX_MAX_ROWS", "2000"))
+
+NAN = float("nan")
+
+Point = Tuple[float, float]
+
+
+class HaversineProvider:
+    """Straight-line distance times ROAD_FACTOR, driven at AVG_TRAVEL_MPH"""
+
+    symmetric = True
+
+    def distances(self, origin: Point, destinations: Sequence[Optional[Point]]) -> Tuple[List[float], List[float]]:
+        """(miles, minutes) from origin to each destination (NaN for None)"""
+        miles, minutes = [], []
+        for point in destinations:
+            if point is None:
+                miles.append(NAN)
+                minutes.append(NAN)
+                continue
+            road_miles = haversine_miles(origin[0], origin[1], point[0], point[1]) * ROAD_FACTOR
+            miles.append(road_miles)
+            minutes.append(road_miles / AVG_TRAVEL_MPH * 60.0)
+        return miles, minutes
+
+
+class OsrmProvider:
+    """Road distances from an OSRM /table service, falling back to haversine when it fails"""
+
+    symmetric = False  # one-way streets
+    MAX_DESTINATIONS = 200  # per request (URL length)
+    METERS_PER_MILE = 1609.344
+
+    def __init__(self, base_url: str, profile: str = "driving"):
+        self.base_url = base_url.rstrip("/")
+        self.profile = profile
+        self.fallback = HaversineProvider()
+
+    def distances(self, origin: Point, destinations: Sequence[Optional[Point]]) -> Tuple[List[float], List[float]]:
+        from utils.http_clients import get_session
+
+        miles = [NAN] * len(destinations)
+        minutes = [NAN] * len(destinations)
+        located = [i for i, point in enumerate(destinations) if point is not None]
+        for start in range(0, len(located), self.MAX_DESTINATIONS):
+            batch = located[start:start + self.MAX_DESTINATIONS]
+            coordinates = ";".join(f"{lon},{lat}" for lat, lon in [origin] + [destinations[i] for i in batch])
+            try:
+                response = get_session().get(
+                    f"{self.base_url}/table/v1/{self.profile}/{coordinates}",
+                    params={"sources": "0", "annotations": "distance,duration"}
+                )
+                response.raise_for_status()
+                body = response.json()
+                if body.get("code") != "Ok":
+                    raise ValueError(body.get("message") or body.get("code"))
+                for offset, i in enumerate(batch, start=1):
+                    meters, seconds = body["distances"][0][offset], body["durations"][0][offset]
+                    if meters is not None and seconds is not None:
+                        miles[i], minutes[i] = meters / self.METERS_PER_MILE, seconds / 60.0
+            except Exception as e:
+                logger.warning(f"Road distance lookup failed, using straight-line estimates: {e}")
+            missing = [i for i in batch if math.isnan(minutes[i])]
+            if missing:
+                fallback_miles, fallback_minutes = self.fallback.distances(origin, [destinations[i] for i in missing])
+                for i, m, t in zip(missing, fallback_miles, fallback_minutes):
+                    miles[i], minutes[i] = m, t
+        return miles, minutes
+
+
+def _default_provider():
+    url = os.getenv("ROAD_DISTANCE_URL")
+    return OsrmProvider(url) if url else HaversineProvider()
+
+
+def _value(row: array, index: int) -> Optional[float]:
+    if index >= len(row):
+        return None
+    value = row[index]
+    return None if math.isnan(value) else float(value)
+
+
+class DistanceMatrix:
+    def __init__(self, provider=None, max_rows: int = MAX_ROWS):
+        self.provider = provider or HaversineProvider()
+        self.max_rows = max_rows
+        self._lock = threading.RLock()
+        self._index: Dict[int, int] = {}
+        self._ids: List[Optional[int]] = []  # index -> property id (None once deleted)
+        self._points: List[Optional[Point]] = []
+        # index -> (miles, minutes) float32 rows, most recently used last
+        self._rows: "OrderedDict[int, Tuple[array, array]]" = OrderedDict()
+        self._loaded = False
+        self._stale = False
+        self._version = 0  # bumped when cached values stop being valid
+        self._counts = {"rows_computed": 0, "columns_patched": 0, "syncs": 0}
+
+    # ----- lookups -----
+
+    def minutes(self, from_id: int, to_id: int) -> Optional[float]:
+        """Driving minutes between two properties (None when either is unknown or has no coordinates)"""
+        return self._lookup(from_id, to_id, 1)
+
+    def miles(self, from_id: int, to_id: int) -> Optional[float]:
+        return self._lookup(from_id, to_id, 0)
+
+    def table(self, ids: Sequence[int]) -> Tuple[List[List[Optional[float]]], List[List[Optional[float]]]]:
+        """(miles, minutes) between every pair of ids, in the given order"""
+        self._ensure_current()
+        rows = {property_id: self._row(property_id) for property_id in dict.fromkeys(ids)}
+        with self._lock:
+            columns = [self._index.get(property_id) for property_id in ids]
+        miles, minutes = [], []
+        for property_id in ids:
+            row = rows[property_id]
+            if row is None:
+                miles.append([0.0 if other == property_id else None for other in ids])
+                minutes.append([0.0 if other == property_id else None for other in ids])
+                continue
+            miles.append([_value(row[0], c) if c is not None else None for c in columns])
+            minutes.append([_value(row[1], c) if c is not None else None for c in columns])
+        return miles, minutes
+
+    def from_point(self, origin: Optional[Point], ids: Sequence[int]) -> Tuple[List[Optional[float]], List[Optional[float]]]:
+        """(miles, minutes) from an arbitrary point (a crew's position) to each property; not cached"""
+        if origin is None:
+            return [None] * len(ids), [None] * len(ids)
+        self._ensure_current()
+        with self._lock:
+            points = [self._points[self._index[i]] if i in self._index else None for i in ids]
+        miles, minutes = self.provider.distances(origin, points)
+        clean = lambda values: [None if math.isnan(v) else v for v in values]
+        return clean(miles), clean(minutes)
+
+    def position(self, property_id: int) -> Optional[Point]:
+        self._ensure_current()
+        with self._lock:
+            index = self._index.get(property_id)
+            return self._points[index] if index is not None else None
+
+    # ----- maintenance -----
+
+    def mark_stale(self):
+        """Properties changed; coordinates are re-read on next use"""
+        with self._lock:
+            self._stale = True
+
+    def set_provider(self, provider):
+        """Swap the distance source (drops cached rows)"""
+        with self._lock:
+            self.provider = provider
+            self._rows.clear()
+            self._version += 1
+
+    def warm(self):
+        """Compute rows for every property (up to max_rows)"""
+        self._ensure_current()
+        with self._lock:
+            ids = [i for i in self._ids if i is not None][:self.max_rows]
+        for property_id in ids:
+            self._row(property_id)
+        logger.info(f"Distance matrix warmed: {len(ids)} properties")
+
+    def start_warming(self):
+        """warm() in a background thread (startup)"""
+        def run():
+            try:
+                self.warm()
+            except Exception as e:
+                logger.error(f"Distance matrix warm-up failed: {e}", exc_info=True)
+        threading.Thread(target=run, name="distance-matrix-warm", daemon=True).start()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "provider": type(self.provider).__name__,
+                "properties": len(self._index),
+                "slots": len(self._ids),
+                "cached_rows": len(self._rows),
+                "bytes": sum(row[0].itemsize * (len(row[0]) + len(row[1])) for row in self._rows.values()),
+                **self._counts
+            }
+
+    # ----- internals -----
+
+    def _lookup(self, from_id: int, to_id: int, which: int) -> Optional[float]:
+        if from_id == to_id:
+            return 0.0
+        self._ensure_current()
+        row = self._row(from_id)
+        with self._lock:
+            column = self._index.get(to_id)
+        if row is None or column is None:
+            return None
+        return _value(row[which], column)
+
+    def _ensure_current(self):
+        with self._lock:
+            if self._loaded and not self._stale:
+                return
+            self._stale = False
+        self._sync()
+
+    def _sync(self):
+        rows = fetch_query("SELECT id, latitude, longitude FROM locations")
+        if rows is None:
+            with self._lock:
+                self._stale = True
+            raise RuntimeError("Could not load property coordinates")
+
+        current = {}
+        for row in rows:
+            lat, lon = to_float(row["latitude"]), to_float(row["longitude"])
+            current[row["id"]] = (lat, lon) if lat is not None and lon is not None else None
+
+        with self._lock:
+            removed = [i for i in self._index if i not in current]
+            for property_id in removed:
+                index = self._index.pop(property_id)
+                self._ids[index] = None
+                self._points[index] = None
+                self._rows.pop(index, None)
+            if removed:
+                # Other rows keep a value in the dead column; it is simply never read
+                if len(self._ids) > 2 * max(len(self._index), 1):
+                    self._compact()
+
+            moved = []
+            for property_id, point in current.items():
+                index = self._index.get(property_id)
+                if index is None:
+                    self._index[property_id] = len(self._ids)
+                    self._ids.append(property_id)
+                    self._points.append(point)
+                elif self._points[index] != point:
+                    self._points[index] = point
+                    self._rows.pop(index, None)
+                    moved.append(property_id)
+
+            if moved and not self.provider.symmetric:
+                # Distances into a moved property differ from the ones out of it
+                self._rows.clear()
+                self._version += 1
+                moved = []
+            self._loaded = True
+            self._counts["syncs"] += 1
+
+        for property_id in moved:
+            self._patch_column(property_id)
+
+    def _compact(self):
+        """Renumber live properties and drop cached rows (caller holds _lock)"""
+        live = [(i, self._points[idx]) for i, idx in sorted(self._index.items(), key=lambda kv: kv[1])]
+        self._ids = [i for i, _ in live]
+        self._points = [p for _, p in live]
+        self._index = {i: idx for idx, i in enumerate(self._ids)}
+        self._rows.clear()
+        self._version += 1
+
+    def _patch_column(self, property_id: int):
+        """A property moved: recompute its row and write it into every cached row's column"""
+        row = self._row(property_id)
+        with self._lock:
+            index = self._index.get(property_id)
+            if row is None or index is None:
+                return
+            for other, (miles, minutes) in self._rows.items():
+                if other != index and other < len(row[0]) and index < len(miles):
+                    miles[index] = row[0][other]
+                    minutes[index] = row[1][other]
+                    self._counts["columns_patched"] += 1
+
+    def _row(self, property_id: int) -> Optional[Tuple[array, array]]:
+        """The property's (miles, minutes) row, computed or extended as needed"""
+        with self._lock:
+            index = self._index.get(property_id)
+            if index is None or self._points[index] is None:
+                return None
+            row = self._rows.get(index)
+            size = len(self._ids)
+            if row is not None and len(row[0]) >= size:
+                self._rows.move_to_end(index)
+                return row
+            start = len(row[0]) if row is not None else 0
+            origin = self._points[index]
+            destinations = self._points[start:size]
+            version = self._version
+
+        miles, minutes = self.provider.distances(origin, destinations)
+        if start <= index < size:
+            miles[index - start] = minutes[index - start] = 0.0
+
+        with self._lock:
+            row = self._rows.get(index)
+            if (version != self._version or self._points[index] != origin
+                    or (len(row[0]) if row is not None else 0) != start):
+                # Changed while computing (property moved, rows dropped); start over
+                return self._row(property_id)
+            if row is None:
+                row = (array("f"), array("f"))
+            row[0].extend(miles)
+            row[1].extend(minutes)
+            self._rows[index] = row
+            self._rows.move_to_end(index)
+            while len(self._rows) > self.max_rows:
+                self._rows.popitem(last=False)
+            self._counts["rows_computed"] += 1
+            return row
+
+distance_matrix = DistanceMatrix(provider=_default_provider())
+proximity.on_properties_changed(distance_matrix.mark_stale)
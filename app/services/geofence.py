@@ -0,0 +1,337 @@
+"""
+Property Geofences
+Detects crews arriving at and leaving properties from their location pings
+and turns the visits into winter_ops_logs: arriving opens a log pre-filled
+with the arrival time (snapped to 15 minutes) and the crew's equipment,
+leaving closes the crew's open log for that property.
+
+Each property's fence is its geofence_polygon, or a circle of
+geofence_radius_feet (default GEOFENCE_RADIUS_FEET) around its coordinates.
+Pings are matched with a grid lookup around the crew followed by an exact
+circle or point-in-polygon test, so the cost per ping does not grow with the
+number of properties.
+
+A crew has to stay inside a fence for GEOFENCE_DWELL_SECONDS before it
+counts as arrived (driving past is ignored), and outside for
+GEOFENCE_EXIT_SECONDS before it counts as left (GPS drift, a trip to the
+truck). Arrivals and departures are published on the event's dispatch feed
+as "geofence" events.
+"""
+
+import json
+import math
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from db import execute_query, fetch_query
+from routes.ops_routes import snap_to_15_minutes
+from services import proximity
+from services.ai_context import invalidate_user_context
+from services.crew_locations import live_crews
+from services.dispatch import publish
+from services.sms_conversations import conversation_store
+from utils.logger import get_logger
+from utils.spatial import MILES_PER_DEGREE_LAT, GridIndex, haversine_miles, to_float
+
+logger = get_logger(__name__)
+
+FEET_PER_MILE = 5280
+DEFAULT_RADIUS_FEET = float(os.getenv("GEOFENCE_RADIUS_FEET", "250"))
+DWELL_SECONDS = float(os.getenv("GEOFENCE_DWELL_SECONDS", "60"))
+EXIT_SECONDS = float(os.getenv("GEOFENCE_EXIT_SECONDS", "120"))
+AUTO_START = os.getenv("GEOFENCE_AUTO_START", "true").lower() == "true"
+AUTO_CLOSE = os.getenv("GEOFENCE_AUTO_CLOSE", "true").lower() == "true"
+
+FENCE_CELL_MILES = 0.25
+
+_lock = threading.Lock()
+_fence_index: Optional["FenceIndex"] = None
+_visits: Dict[Tuple[int, int], Dict] = {}  # (event, user) -> visit state
+
+
+def point_in_polygon(lat: float, lon: float, polygon: List[Tuple[float, float]]) -> bool:
+    """Ray casting; fences are small enough to treat lat/lon as planar"""
+    inside = False
+    j = len(polygon) - 1
+    for i in range(len(polygon)):
+        lat_i, lon_i = polygon[i]
+        lat_j, lon_j = polygon[j]
+        if (lat_i > lat) != (lat_j > lat):
+            crossing = lon_i + (lat - lat_i) * (lon_j - lon_i) / (lat_j - lat_i)
+            if lon < crossing:
+                inside = not inside
+        j = i
+    return inside
+
+
+def _parse_polygon(value) -> Optional[List[Tuple[float, float]]]:
+    if not value:
+        return None
+    try:
+        points = json.loads(value) if isinstance(value, (str, bytes)) else value
+        polygon = [(float(p[0]), float(p[1])) for p in points]
+    except (ValueError, TypeError, IndexError):
+        return None
+    return polygon if len(polygon) >= 3 else None
+
+
+class FenceIndex:
+    """Property fences on a grid keyed by each property's coordinates"""
+
+    def __init__(self, rows: List[Dict]):
+        points = [(r, to_float(r["latitude"]), to_float(r["longitude"])) for r in rows]
+        points = [(r, lat, lon) for r, lat, lon in points if lat is not None and lon is not None]
+        self.grid = GridIndex(cell_miles=FENCE_CELL_MILES, reference_lat=points[0][1] if points else 42.0)
+        # Largest distance from a property's coordinates to the edge of its fence
+        self.max_reach_miles = DEFAULT_RADIUS_FEET / FEET_PER_MILE
+        for row, lat, lon in points:
+            polygon = _parse_polygon(row.get("geofence_polygon"))
+            radius_miles = (to_float(row.get("geofence_radius_feet")) or DEFAULT_RADIUS_FEET) / FEET_PER_MILE
+            reach = max(haversine_miles(lat, lon, p[0], p[1]) for p in polygon) if polygon else radius_miles
+            self.max_reach_miles = max(self.max_reach_miles, reach)
+            self.grid.upsert(row["id"], lat, lon, {
+                "id": row["id"],
+                "name": row["name"],
+                "polygon": polygon,
+                "radius_miles": radius_miles,
+            })
+
+    def __len__(self) -> int:
+        return len(self.grid)
+
+    def containing(self, lat: float, lon: float) -> List[Tuple[int, float]]:
+        """(property_id, distance) of fences containing the point, nearest first"""
+        hits = []
+        for property_id, distance in self.grid.within(lat, lon, self.max_reach_miles):
+            fence = self.grid.payload(property_id)
+            if fence["polygon"]:
+                if point_in_polygon(lat, lon, fence["polygon"]):
+                    hits.append((property_id, distance))
+            elif distance <= fence["radius_miles"]:
+                hits.append((property_id, distance))
+        return hits
+
+    def name(self, property_id: int) -> Optional[str]:
+        fence = self.grid.payload(property_id)
+        return fence["name"] if fence else None
+
+
+def _fences() -> FenceIndex:
+    global _fence_index
+    with _lock:
+        if _fence_index is not None:
+            return _fence_index
+    rows = fetch_query(
+        """SELECT id, name, latitude, longitude, geofence_radius_feet, geofence_polygon
+           FROM locations
+           WHERE latitude IS NOT NULL AND longitude IS NOT NULL"""
+    )
+    if rows is None:
+        raise RuntimeError("Could not load property geofences")
+    index = FenceIndex(rows)
+    with _lock:
+        _fence_index = index
+    return index
+
+
+def invalidate_fences():
+    global _fence_index
+    with _lock:
+        _fence_index = None
+
+
+proximity.on_properties_changed(invalidate_fences)
+
+
+def fence_outline(lat: float, lon: float, radius_feet: float, points: int = 24) -> List[List[float]]:
+    """Polygon approximating a circular fence (for drawing it on a map)"""
+    radius_lat = radius_feet / FEET_PER_MILE / MILES_PER_DEGREE_LAT
+    radius_lon = radius_lat / max(math.cos(math.radians(lat)), 0.01)
+    return [
+        [round(lat + radius_lat * math.sin(2 * math.pi * i / points), 6),
+         round(lon + radius_lon * math.cos(2 * math.pi * i / points), 6)]
+        for i in range(points)
+    ]
+
+
+# ----- visit tracking -----
+
+def _advance(state: Dict, hits: List[Tuple[int, float]], now: datetime) -> List[Tuple[str, int, datetime]]:
+    """
+    Move one crew's visit state forward for a ping; returns the (action,
+    property_id, time) transitions it caused. Caller holds _lock.
+    """
+    transitions = []
+    hit_ids = {property_id for property_id, _ in hits}
+
+    if state.get("inside"):
+        if state["inside"] in hit_ids:
+            state["last_inside_at"] = now
+            state["outside_since"] = None
+            return transitions
+        state["outside_since"] = state.get("outside_since") or now
+        if (now - state["outside_since"]).total_seconds() < EXIT_SECONDS:
+            return transitions
+        transitions.append(("exit", state["inside"], state["last_inside_at"]))
+        state.update(inside=None, entered_at=None, last_inside_at=None, outside_since=None)
+
+    nearest = hits[0][0] if hits else None
+    if nearest is None:
+        state.update(candidate=None, candidate_since=None)
+        return transitions
+    if state.get("candidate") != nearest:
+        state.update(candidate=nearest, candidate_since=now)
+    if (now - state["candidate_since"]).total_seconds() >= DWELL_SECONDS:
+        state.update(inside=nearest, entered_at=state["candidate_since"], last_inside_at=now,
+                     outside_since=None, candidate=None, candidate_since=None)
+        transitions.append(("enter", nearest, state["entered_at"]))
+    return transitions
+
+
+def _on_crew_change(kind: str, crew: Dict):
+    key = (crew.get("winter_event_id"), crew.get("user_id"))
+    if key[0] is None:
+        return
+
+    if crew.get("checked_out") or crew.get("status") not in ("checked_in", "working"):
+        # Leaving the event (or going unavailable) ends any visit at the last time seen inside
+        with _lock:
+            state = _visits.pop(key, None)
+        if state and state.get("inside"):
+            _apply(crew, "exit", state["inside"], state["last_inside_at"])
+        return
+
+    if kind != "location":
+        return
+    lat, lon = to_float(crew.get("last_location_lat")), to_float(crew.get("last_location_lon"))
+    if lat is None or lon is None:
+        return
+    fences = _fences()
+    hits = fences.containing(lat, lon)
+    now = crew.get("last_location_update") or datetime.now()
+    with _lock:
+        state = _visits.setdefault(key, {})
+        transitions = _advance(state, hits, now)
+    for action, property_id, at in transitions:
+        _apply(crew, action, property_id, at)
+
+
+live_crews.add_listener(_on_crew_change)
+
+
+def _open_logs(user_id: int) -> List[Dict]:
+    return fetch_query(
+        "SELECT id, property_id, contractor_id, time_in FROM winter_ops_logs WHERE user_id = %s AND status = 'open'",
+        (user_id,)
+    ) or []
+
+
+def _apply(crew: Dict, action: str, property_id: int, at: datetime):
+    """Open or close the crew's log for a visit and tell dispatch"""
+    user_id = crew["user_id"]
+    snapped = snap_to_15_minutes(at.isoformat())
+    log_id, log_action = None, None
+    try:
+        open_logs = _open_logs(user_id)
+        here = next((log for log in open_logs if log["property_id"] == property_id), None)
+        if action == "enter":
+            if here:
+                log_id, log_action = here["id"], "already_open"
+            elif AUTO_START and not open_logs:
+                log_id = _start_log(crew, property_id, snapped)
+                log_action = "started" if log_id else None
+        elif here and AUTO_CLOSE:
+            time_out = datetime.fromisoformat(snapped)
+            if here["time_in"] and time_out <= here["time_in"]:
+                # Visits shorter than the snapping step still bill one step
+                time_out = here["time_in"] + timedelta(minutes=15)
+            execute_query(
+                "UPDATE winter_ops_logs SET time_out = %s, status = 'closed' WHERE id = %s AND status = 'open'",
+                (time_out.isoformat(), here["id"])
+            )
+            invalidate_user_context(here["contractor_id"], user_id)
+            _release_sms_ticket(crew, here["id"])
+            log_id, log_action, snapped = here["id"], "closed", time_out.isoformat()
+    except Exception as e:
+        logger.error(f"Geofence {action} for user {user_id} at property {property_id} failed: {e}", exc_info=True)
+
+    publish(crew["winter_event_id"], "geofence", {
+        "action": action,
+        "user_id": user_id,
+        "user_name": crew.get("user_name"),
+        "property_id": property_id,
+        "property_name": _fences().name(property_id),
+        "at": at,
+        "snapped_time": snapped,
+        "log_id": log_id,
+        "log_action": log_action
+    })
+
+
+def _start_log(crew: Dict, property_id: int, time_in: str) -> Optional[int]:
+    user_id = crew["user_id"]
+    user_name = crew.get("user_name")
+    execute_query(
+        """INSERT INTO winter_ops_logs
+           (property_id, user_id, contractor_id, contractor_name, worker_name, equipment,
+            time_in, time_out, status, bulk_salt_qty, bag_salt_qty, calcium_chloride_qty,
+            customer_provided, notes, winter_event_id)
+           VALUES (%s, %s, %s, %s, %s, %s, %s, NULL, 'open', 0, 0, 0, FALSE, %s, %s)""",
+        (property_id, user_id, user_id, user_name, user_name,
+         crew.get("equipment_in_use") or crew.get("default_equipment"),
+         time_in, "Ticket started automatically on arrival (geofence)", crew["winter_event_id"])
+    )
+    invalidate_user_context(user_id)
+    ticket = fetch_query(
+        "SELECT id FROM winter_ops_logs WHERE user_id = %s AND property_id = %s AND status = 'open' ORDER BY id DESC LIMIT 1",
+        (user_id, property_id)
+    )
+    return ticket[0]["id"] if ticket else None
+
+
+def _release_sms_ticket(crew: Dict, log_id: int):
+    """An SMS conversation working on a log we just closed goes back to idle"""
+    # Conversations are keyed by users.phone_number (the SMS number), not users.phone
+    rows = fetch_query("SELECT phone_number FROM users WHERE id = %s", (crew["user_id"],))
+    phone = rows[0]["phone_number"] if rows else None
+    if not phone:
+        return
+    conversation = conversation_store.get(phone)
+    if conversation and conversation.get("active_ticket_id") == log_id:
+        conversation_store.reset(phone)
+
+
+# ----- queries -----
+
+def crew_visit(event_id: int, user_id: int) -> Dict:
+    """Where a crew is according to its fences, with a suggested time_in for a new log"""
+    with _lock:
+        state = dict(_visits.get((event_id, user_id)) or {})
+    property_id = state.get("inside")
+    if not property_id:
+        return {"inside": False, "property_id": None}
+    return {
+        "inside": True,
+        "property_id": property_id,
+        "property_name": _fences().name(property_id),
+        "entered_at": state["entered_at"],
+        "last_inside_at": state["last_inside_at"],
+        "suggested_time_in": snap_to_15_minutes(state["entered_at"].isoformat())
+    }
+
+
+def forget_event(event_id: int):
+    with _lock:
+        for key in [k for k in _visits if k[0] == event_id]:
+            del _visits[key]
+
+
+def stats() -> Dict:
+    with _lock:
+        return {
+            "fences": len(_fence_index) if _fence_index is not None else None,
+            "crews_tracked": len(_visits),
+            "crews_on_site": sum(1 for state in _visits.values() if state.get("inside"))
+        }
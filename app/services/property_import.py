@@ -0,0 +1,214 @@
+"""
+Bulk Property Import
+Loads properties from the customer onboarding spreadsheet (.xlsx/.xls with a
+'locations' sheet, or the same columns as .csv):
+    Property Name, Address, area manager, Lot Sq Ft, PLOW/SALT ("Yes/No", ...)
+
+Rows are handled PROPERTY_IMPORT_CHUNK_ROWS at a time: the chunk's columns are
+parsed with pandas in one pass, existing addresses are found with one lookup,
+and the rows go in as one multi-row upsert. Existing properties are skipped
+(INSERT IGNORE) unless update_existing is set, in which case they are updated
+from the sheet (ON DUPLICATE KEY UPDATE on the unique address). Either way an
+address that collides after the lookup cannot fail the rest of its chunk.
+CSV files are read chunk by chunk so large files are never fully in memory;
+Excel sheets are read whole and then chunked.
+
+Every row gets a result (imported / updated / skipped / error, with its row
+number in the sheet) as soon as its chunk is written.
+"""
+
+import os
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+import pandas as pd
+
+from db import execute_many, fetch_query
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+CHUNK_ROWS = int(os.getenv("PROPERTY_IMPORT_CHUNK_ROWS", "1000"))
+
+REQUIRED_COLUMNS = ['Property Name', 'Address', 'area manager', 'Lot Sq Ft', 'PLOW/SALT']
+SUPPORTED_EXTENSIONS = ('.xlsx', '.xls', '.csv')
+
+_INSERT_QUERY = """
+    INSERT IGNORE INTO locations (name, address, sqft, area_manager, plow, salt)
+    VALUES (%s, %s, %s, %s, %s, %s)
+"""
+_UPSERT_QUERY = """
+    INSERT INTO locations (name, address, sqft, area_manager, plow, salt)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        name = VALUES(name),
+        sqft = VALUES(sqft),
+        area_manager = VALUES(area_manager),
+        plow = VALUES(plow),
+        salt = VALUES(salt)
+"""
+
+
+def read_chunks(fileobj, filename: str, chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """
+    DataFrames of at most chunk_rows rows. The first chunk is read (and its
+    columns checked) before returning, so a bad file raises ValueError here
+    rather than part-way through an import.
+    """
+    name = (filename or "").lower()
+    if name.endswith('.csv'):
+        reader = pd.read_csv(fileobj, chunksize=chunk_rows, dtype=str, skip_blank_lines=True)
+    elif name.endswith(('.xlsx', '.xls')):
+        try:
+            sheet = pd.read_excel(fileobj, sheet_name='locations')
+        except ValueError as e:
+            if "not found" in str(e):
+                raise ValueError("Excel file must contain a sheet named 'locations'")
+            raise
+        reader = (sheet.iloc[start:start + chunk_rows] for start in range(0, len(sheet), chunk_rows))
+    else:
+        raise ValueError("Only Excel (.xlsx, .xls) and CSV files are supported")
+
+    try:
+        first = next(reader)
+    except StopIteration:
+        raise ValueError("File has no rows")
+    columns = set(first.columns.str.strip())
+    missing_columns = [col for col in REQUIRED_COLUMNS if col not in columns]
+    if missing_columns:
+        raise ValueError(f"Missing required columns: {', '.join(missing_columns)}")
+    return chain([first], reader)
+
+
+def parse_chunk(df: pd.DataFrame) -> Tuple[pd.DataFrame, List[Dict]]:
+    """
+    Vectorised parse of one chunk: (valid rows with row/name/address/sqft/
+    area_manager/plow/salt columns, error results for the invalid ones)
+    """
+    df = df.rename(columns=lambda c: str(c).strip())
+    # Rows without a property name are spacers/index rows in the template
+    df = df[df['Property Name'].notna()]
+    if df.empty:
+        return df, []
+
+    text = lambda column: df[column].where(df[column].notna(), "").astype(str).str.strip()
+
+    flags = text('PLOW/SALT').str.lower()
+    parts = flags.str.split('/', expand=True)
+    has_slash = flags.str.contains('/', regex=False)
+    plow = has_slash & parts[0].str.contains('yes', regex=False)
+    salt = has_slash & (parts[1].fillna("").str.contains('yes', regex=False) if 1 in parts.columns else False)
+
+    sqft = pd.to_numeric(text('Lot Sq Ft').str.replace(',', '', regex=False), errors='coerce')
+
+    parsed = pd.DataFrame({
+        "row": df.index + 2,  # header is sheet row 1
+        "name": text('Property Name'),
+        "address": text('Address'),
+        "sqft": sqft,
+        "area_manager": text('area manager'),
+        "plow": plow.astype(bool),
+        "salt": salt.astype(bool)
+    })
+
+    problems = pd.Series("", index=parsed.index)
+    problems = problems.mask(parsed["sqft"].isna(), "Lot Sq Ft must be a number")
+    problems = problems.mask(parsed["sqft"] < 0, "Lot Sq Ft cannot be negative")
+    problems = problems.mask(parsed["address"] == "", "Address is required")
+    problems = problems.mask(parsed["name"] == "", "Property Name is required")
+
+    invalid = parsed[problems != ""]
+    errors = [
+        {"row": int(row), "status": "error", "name": name, "address": address, "error": problem}
+        for row, name, address, problem in zip(invalid["row"], invalid["name"], invalid["address"], problems[problems != ""])
+    ]
+    valid = parsed[problems == ""].copy()
+    valid["sqft"] = valid["sqft"].astype("int64")
+    return valid, errors
+
+
+def existing_addresses(addresses: List[str]) -> Dict[str, int]:
+    """{lowercased address: property id} for the addresses already in locations"""
+    if not addresses:
+        return {}
+    placeholders = ", ".join(["%s"] * len(addresses))
+    rows = fetch_query(f"SELECT id, address FROM locations WHERE address IN ({placeholders})", tuple(addresses))
+    if rows is None:
+        raise RuntimeError("Could not check for existing properties")
+    return {row["address"].strip().lower(): row["id"] for row in rows}
+
+
+class PropertyImport:
+    """One import run; results() yields a result per row and keeps running totals"""
+
+    def __init__(self, update_existing: bool = False):
+        self.update_existing = update_existing
+        self.counts = {"imported": 0, "updated": 0, "skipped": 0, "error": 0}
+        self._seen: set = set()  # lowercased addresses already handled (duplicates within the file)
+
+    def results(self, chunks: Iterable[pd.DataFrame]) -> Iterator[Dict]:
+        for chunk in chunks:
+            for result in self._import_chunk(chunk):
+                self.counts[result["status"]] += 1
+                yield result
+
+    def summary(self) -> Dict:
+        message = f"Successfully imported {self.counts['imported']} properties"
+        if self.counts["updated"]:
+            message += f", updated {self.counts['updated']}"
+        if self.counts["skipped"]:
+            message += f", skipped {self.counts['skipped']} duplicates"
+        if self.counts["error"]:
+            message += f". {self.counts['error']} errors occurred."
+        return {
+            "message": message,
+            "count": self.counts["imported"],
+            "updated": self.counts["updated"],
+            "skipped": self.counts["skipped"],
+            "error_count": self.counts["error"]
+        }
+
+    def _import_chunk(self, chunk: pd.DataFrame) -> List[Dict]:
+        valid, results = parse_chunk(chunk)
+        if valid.empty:
+            return results
+
+        keys = valid["address"].str.lower()
+        repeated = keys.duplicated(keep='first') | keys.isin(self._seen)
+        self._seen.update(keys)
+
+        fresh = valid[~repeated]
+        try:
+            existing = existing_addresses(fresh["address"].tolist())
+        except RuntimeError as e:
+            return results + self._failed(valid, str(e))
+
+        found = fresh["address"].str.lower().isin(list(existing))
+        columns = ["name", "address", "sqft", "area_manager", "plow", "salt"]
+        rows = fresh if self.update_existing else fresh[~found]
+        values = [(n, a, int(sq), m or None, bool(p), bool(t))
+                  for n, a, sq, m, p, t in rows[columns].itertuples(index=False, name=None)]
+        try:
+            written = execute_many(_UPSERT_QUERY if self.update_existing else _INSERT_QUERY, values)
+        except Exception as e:
+            logger.error(f"Property import chunk failed ({len(values)} rows): {e}", exc_info=True)
+            return results + self._failed(valid, f"Database error: {e}")
+        if not self.update_existing and written < len(values):
+            # Address added since the lookup (another import, or a collation-equal spelling)
+            logger.warning(f"Property import skipped {len(values) - written} rows whose address already exists")
+
+        status = pd.Series("imported", index=valid.index)
+        status[repeated] = "skipped"
+        status[~repeated & keys.isin(list(existing))] = "updated" if self.update_existing else "skipped"
+        for row, name, address, state, is_repeat in zip(valid["row"], valid["name"], valid["address"], status, repeated):
+            result = {"row": int(row), "status": state, "name": name, "address": address}
+            if state == "skipped":
+                result["reason"] = "duplicate in file" if is_repeat else "address already exists"
+            results.append(result)
+        results.sort(key=lambda r: r["row"])
+        return results
+
+    @staticmethod
+    def _failed(valid: pd.DataFrame, message: str) -> List[Dict]:
+        return [{"row": int(row), "status": "error", "name": name, "address": address, "error": message}
+                for row, name, address in zip(valid["row"], valid["name"], valid["address"])]
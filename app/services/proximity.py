@@ -0,0 +1,185 @@
+"""
+Crew and Property Proximity
+Grid indexes over live crew positions (per winter event) and property
+coordinates, for "closest available crews to this property" and "untouched
+properties near this crew" queries.
+
+Crew grids are built from the live crew store on first use and then moved
+on every ping and check-in change, so queries never re-read event_checkins.
+The property grid is loaded from locations and reloaded when properties are
+added, edited or removed (or after PROPERTY_INDEX_TTL_SECONDS).
+"""
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from db import fetch_query
+from services.crew_locations import live_crews
+from utils.cache import TTLCache
+from utils.spatial import GridIndex, to_float
+
+CREW_CELL_MILES = 1.0
+PROPERTY_CELL_MILES = 1.0
+PROPERTY_INDEX_TTL_SECONDS = 600
+
+_lock = threading.Lock()
+_crew_grids: Dict[int, GridIndex] = {}
+_property_grid: Optional[GridIndex] = None
+_property_grid_loaded_at = 0.0
+_property_listeners: List[Callable[[], None]] = []
+
+# Properties with a ticket (open or closed) in an event, refreshed every 30s
+_serviced = TTLCache(ttl_seconds=30, maxsize=16)
+
+
+def _crew_summary(crew: Dict) -> Dict:
+    return {
+        "user_id": crew["user_id"],
+        "user_name": crew.get("user_name"),
+        "status": crew.get("status"),
+        "equipment_in_use": crew.get("equipment_in_use"),
+        "current_property_id": crew.get("current_property_id"),
+        "last_location_update": crew.get("last_location_update"),
+    }
+
+
+def _is_available(crew: Dict) -> bool:
+    return crew.get("status") == "checked_in" and crew.get("current_property_id") is None
+
+
+def _crew_grid(event_id: int) -> GridIndex:
+    """The event's crew grid, built from the live crew store on first use (caller holds _lock)"""
+    grid = _crew_grids.get(event_id)
+    if grid is None:
+        grid = GridIndex(cell_miles=CREW_CELL_MILES)
+        for crew in live_crews.active_checkins(event_id):
+            lat, lon = to_float(crew.get("last_location_lat")), to_float(crew.get("last_location_lon"))
+            if lat is not None and lon is not None:
+                grid.upsert(crew["user_id"], lat, lon, _crew_summary(crew))
+        _crew_grids[event_id] = grid
+    return grid
+
+
+def _on_crew_change(kind: str, crew: Dict):
+    event_id = crew.get("winter_event_id")
+    with _lock:
+        grid = _crew_grids.get(event_id)
+        if grid is None:
+            return  # built lazily on the first query
+        lat, lon = to_float(crew.get("last_location_lat")), to_float(crew.get("last_location_lon"))
+        if crew.get("checked_out") or crew.get("status") not in ("checked_in", "working") or lat is None or lon is None:
+            grid.remove(crew["user_id"])
+        else:
+            grid.upsert(crew["user_id"], lat, lon, _crew_summary(crew))
+
+
+live_crews.add_listener(_on_crew_change)
+
+
+def forget_event(event_id: int):
+    with _lock:
+        _crew_grids.pop(event_id, None)
+
+
+def _load_property_grid() -> GridIndex:
+    rows = fetch_query(
+        """SELECT id, name, address, latitude, longitude, contract_tier, open_by_time
+           FROM locations
+           WHERE latitude IS NOT NULL AND longitude IS NOT NULL"""
+    )
+    if rows is None:
+        raise RuntimeError("Could not load property coordinates")
+    points = [(r, to_float(r["latitude"]), to_float(r["longitude"])) for r in rows]
+    points = [(r, lat, lon) for r, lat, lon in points if lat is not None and lon is not None]
+    grid = GridIndex(cell_miles=PROPERTY_CELL_MILES, reference_lat=points[0][1] if points else 42.0)
+    for row, lat, lon in points:
+        grid.upsert(row["id"], lat, lon, {
+            "id": row["id"],
+            "name": row["name"],
+            "address": row["address"],
+            "contract_tier": row.get("contract_tier"),
+            "open_by_time": row.get("open_by_time"),
+        })
+    return grid
+
+
+def property_grid() -> GridIndex:
+    """Grid over property coordinates (reloaded when stale or invalidated)"""
+    global _property_grid, _property_grid_loaded_at
+    with _lock:
+        if _property_grid is not None and time.monotonic() - _property_grid_loaded_at < PROPERTY_INDEX_TTL_SECONDS:
+            return _property_grid
+    grid = _load_property_grid()
+    with _lock:
+        _property_grid, _property_grid_loaded_at = grid, time.monotonic()
+    return grid
+
+
+def invalidate_properties():
+    """Call after properties are added, moved or deleted"""
+    global _property_grid
+    with _lock:
+        _property_grid = None
+    for callback in _property_listeners:
+        callback()
+
+
+def on_properties_changed(callback: Callable[[], None]):
+    """Run callback() whenever invalidate_properties() is called (other property indexes)"""
+    _property_listeners.append(callback)
+
+
+def property_position(property_id: int) -> Optional[Tuple[float, float]]:
+    grid = property_grid()
+    with _lock:
+        return grid.position(property_id)
+
+
+def serviced_property_ids(event_id: int) -> set:
+    ids = _serviced.get(event_id)
+    if ids is None:
+        rows = fetch_query(
+            "SELECT DISTINCT property_id FROM winter_ops_logs WHERE winter_event_id = %s",
+            (event_id,)
+        ) or []
+        ids = {r["property_id"] for r in rows}
+        _serviced.set(event_id, ids)
+    return ids
+
+
+def nearest_crews(event_id: int, lat: float, lon: float, k: int = 5,
+                  max_miles: Optional[float] = None, available_only: bool = True) -> List[Dict]:
+    """k closest crews to a point, with haversine distance in miles"""
+    with _lock:
+        grid = _crew_grid(event_id)
+        predicate = (lambda user_id: _is_available(grid.payload(user_id))) if available_only else None
+        hits = grid.nearest(lat, lon, k=k, max_miles=max_miles, predicate=predicate)
+        results = []
+        for user_id, distance in hits:
+            crew_lat, crew_lon = grid.position(user_id)
+            results.append({
+                **grid.payload(user_id),
+                "lat": crew_lat,
+                "lon": crew_lon,
+                "distance_miles": round(distance, 2)
+            })
+    return results
+
+
+def nearby_properties(event_id: int, lat: float, lon: float, k: int = 10,
+                      max_miles: Optional[float] = None, unserviced_only: bool = True) -> List[Dict]:
+    """k closest properties to a point, skipping ones already ticketed in the event"""
+    grid = property_grid()
+    serviced = serviced_property_ids(event_id) if unserviced_only else set()
+    in_progress = set()
+    if unserviced_only:
+        with _lock:
+            crews = _crew_grid(event_id)
+            payloads = [crews.payload(user_id) for user_id, _, _ in crews.items()]
+            in_progress = {p["current_property_id"] for p in payloads if p and p.get("current_property_id")}
+    excluded = serviced | in_progress
+    with _lock:
+        hits = grid.nearest(lat, lon, k=k, max_miles=max_miles,
+                            predicate=(lambda property_id: property_id not in excluded) if excluded else None)
+        return [{**grid.payload(pid), "distance_miles": round(distance, 2)} for pid, distance in hits]
@@ -0,0 +1,438 @@
+"""
+Route ETA Engine
+Projected arrival and finish times for the stops a crew has left on an
+accepted route assignment, flagging stops that will miss their open_by_time.
+
+Service minutes per stop come from history: the median time_in→time_out of
+closed winter_ops_logs at that property with the crew's equipment (at least
+MIN_SAMPLES logs), else the property's median over all equipment, else the
+route's estimated_time_minutes, else the crew assignment model. Travel
+minutes come from the shared distance matrix, starting from the crew's live
+position when they are checked in and not on a stop.
+
+A run starts when the assignment was accepted or the active winter event
+began, whichever is later; stops completed since then are done. Deadlines
+are the first open_by_time after the run started, so a stop that is already
+past its deadline shows as late rather than as due tomorrow.
+
+Each assignment's inputs (stops, service estimates, progress) are loaded
+once, in a fixed handful of queries however many assignments are asked for,
+then kept up to date in memory: start_route_property/complete_route_property
+call stop_started()/stop_completed(), route edits call invalidate_route().
+Projections are re-derived from those inputs (no queries) when progress
+changes or PROJECTION_SECONDS pass, and inputs are reloaded after
+INPUT_TTL_SECONDS to pick up changes made elsewhere.
+"""
+
+import os
+import statistics
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from db import fetch_query
+from services.crew_assignment import UNKNOWN_TRAVEL_MINUTES, crew_type_for, service_minutes
+from services.crew_locations import live_crews
+from services.dispatch import active_event_ids, publish_to_active_events
+from services.distance_matrix import distance_matrix
+from services.route_optimizer import deadline_minutes
+from utils.cache import TTLCache
+from utils.logger import get_logger
+from utils.spatial import to_float
+
+logger = get_logger(__name__)
+
+MIN_SAMPLES = 3                 # logs needed before a property/equipment median is trusted
+HISTORY_DAYS = int(os.getenv("ETA_HISTORY_DAYS", "730"))
+MAX_SERVICE_MINUTES = 8 * 60    # longer logs were left open, not worked
+AT_RISK_MARGIN_MINUTES = float(os.getenv("ETA_AT_RISK_MARGIN_MINUTES", "15"))
+OVERRUN_MINUTES = 5.0           # still on a stop past its estimate: assume this much more
+POSITION_MAX_AGE_MINUTES = 15   # older GPS fixes are not used as the start point
+PROJECTION_SECONDS = 60
+INPUT_TTL_SECONDS = 600
+
+# (property_id) -> {"all": (median, samples), equipment: (median, samples)}
+_durations = TTLCache(ttl_seconds=3600, maxsize=20000)
+
+
+def _normalise_equipment(equipment: Optional[str]) -> Optional[str]:
+    return equipment.strip().lower() if equipment and equipment.strip() else None
+
+
+def load_service_durations(property_ids: Sequence[int]) -> Dict[int, Dict]:
+    """Median service minutes per property, overall and by equipment (cached for an hour)"""
+    result, missing = {}, []
+    for property_id in dict.fromkeys(property_ids):
+        cached = _durations.get(property_id)
+        if cached is None:
+            missing.append(property_id)
+        else:
+            result[property_id] = cached
+    if not missing:
+        return result
+
+    placeholders = ", ".join(["%s"] * len(missing))
+    rows = fetch_query(
+        f"""SELECT property_id, equipment, TIMESTAMPDIFF(MINUTE, time_in, time_out) AS minutes
+            FROM winter_ops_logs
+            WHERE property_id IN ({placeholders})
+              AND time_out IS NOT NULL AND time_out > time_in
+              AND time_in >= NOW() - INTERVAL %s DAY""",
+        (*missing, HISTORY_DAYS)
+    )
+    if rows is None:
+        raise RuntimeError("Could not load service history")
+
+    samples: Dict[int, Dict[Optional[str], List[float]]] = {property_id: {} for property_id in missing}
+    for row in rows:
+        minutes = row["minutes"]
+        if minutes is None or minutes <= 0 or minutes > MAX_SERVICE_MINUTES:
+            continue
+        by_equipment = samples[row["property_id"]]
+        by_equipment.setdefault("all", []).append(minutes)
+        equipment = _normalise_equipment(row.get("equipment"))
+        if equipment:
+            by_equipment.setdefault(equipment, []).append(minutes)
+
+    for property_id, by_equipment in samples.items():
+        medians = {key: (float(statistics.median(values)), len(values)) for key, values in by_equipment.items()}
+        _durations.set(property_id, medians)
+        result[property_id] = medians
+    return result
+
+
+def service_estimate(stop: Dict, medians: Dict, equipment: Optional[str]) -> Tuple[float, str, int]:
+    """(minutes, source, samples) for one stop: equipment median, property median, route estimate, model"""
+    equipment = _normalise_equipment(equipment)
+    for key, source in ((equipment, "equipment_history"), ("all", "property_history")):
+        if key and key in medians and medians[key][1] >= MIN_SAMPLES:
+            minutes, count = medians[key]
+            return minutes, source, count
+    if stop.get("estimated_time_minutes"):
+        return float(stop["estimated_time_minutes"]), "route_estimate", 0
+    return service_minutes(stop, crew_type_for(equipment)), "model", 0
+
+
+class _Plan:
+    """Inputs for one assignment's projection, kept current as stops start and finish"""
+
+    def __init__(self, assignment: Dict, stops: List[Dict], completed: Dict[int, datetime],
+                 run_started_at: datetime, event_id: Optional[int]):
+        self.assignment_id = assignment["id"]
+        self.route_id = assignment["route_id"]
+        self.user_id = assignment["user_id"]
+        self.user_name = assignment.get("user_name")
+        self.route_name = assignment.get("route_name")
+        self.equipment = assignment.get("equipment")
+        self.current_property_id = assignment.get("current_property_id")
+        self.current_started_at = assignment.get("current_property_started_at")
+        self.stops = stops                  # route order, with service estimates
+        self.completed = completed          # property_id -> completed at
+        self.run_started_at = run_started_at
+        self.event_id = event_id
+        self.loaded_at = time.monotonic()
+        self.projection: Optional[Dict] = None
+        self.projected_at = 0.0
+
+    def expired(self) -> bool:
+        return time.monotonic() - self.loaded_at > INPUT_TTL_SECONDS
+
+
+def _run_started_at(accepted_at: Optional[datetime], event_start: Optional[datetime], now: datetime) -> datetime:
+    moments = [m for m in (accepted_at, event_start) if m]
+    return max(moments) if moments else now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _active_event() -> Tuple[Optional[int], Optional[datetime]]:
+    """Most recently started active winter event"""
+    ids = active_event_ids()
+    if not ids:
+        return None, None
+    placeholders = ", ".join(["%s"] * len(ids))
+    rows = fetch_query(
+        f"SELECT id, start_date FROM winter_events WHERE id IN ({placeholders}) ORDER BY start_date DESC LIMIT 1",
+        tuple(ids)
+    )
+    return (rows[0]["id"], rows[0]["start_date"]) if rows else (None, None)
+
+
+def _crew_position(plan: _Plan, now: datetime) -> Optional[Tuple[float, float]]:
+    if plan.event_id is None:
+        return None
+    crew = live_crews.get(plan.event_id, plan.user_id)
+    if not crew or not crew.get("last_location_update"):
+        return None
+    if now - crew["last_location_update"] > timedelta(minutes=POSITION_MAX_AGE_MINUTES):
+        return None
+    lat, lon = to_float(crew.get("last_location_lat")), to_float(crew.get("last_location_lon"))
+    return (lat, lon) if lat is not None and lon is not None else None
+
+
+def _deadline(open_by, run_started_at: datetime) -> Optional[datetime]:
+    minutes = deadline_minutes(open_by, run_started_at)
+    return run_started_at + timedelta(minutes=minutes) if minutes is not None else None
+
+
+def project(plan: _Plan, now: Optional[datetime] = None, distances=None) -> Dict:
+    """Walk the remaining stops from the crew's current state"""
+    now = now or datetime.now()
+    distances = distances or distance_matrix
+    clock = now
+    previous: Optional[int] = None
+    current = None
+    by_id = {stop["property_id"]: stop for stop in plan.stops}
+
+    if plan.current_property_id in by_id:
+        stop = by_id[plan.current_property_id]
+        started = plan.current_started_at or now
+        expected_finish = started + timedelta(minutes=stop["service_minutes"])
+        overrun = expected_finish < now
+        if overrun:
+            expected_finish = now + timedelta(minutes=OVERRUN_MINUTES)
+        current = {
+            "property_id": stop["property_id"], "name": stop["name"], "started_at": started,
+            "eta_finish": expected_finish, "service_minutes": round(stop["service_minutes"], 1),
+            "overrun": overrun
+        }
+        clock = expected_finish
+        previous = stop["property_id"]
+    elif plan.completed:
+        previous = max(plan.completed, key=lambda property_id: plan.completed[property_id])
+
+    remaining = [stop for stop in plan.stops
+                 if stop["property_id"] not in plan.completed and stop["property_id"] != plan.current_property_id]
+
+    # A fresh GPS fix beats the last finished stop as the starting point
+    start_travel = None
+    position = None if current else _crew_position(plan, now)
+    if position and remaining:
+        _, start_travel = distances.from_point(position, [remaining[0]["property_id"]])
+
+    rows = []
+    for i, stop in enumerate(remaining):
+        if i == 0 and start_travel and start_travel[0] is not None:
+            hop = start_travel[0]
+        elif previous is None:
+            hop = 0.0
+        else:
+            hop = distances.minutes(previous, stop["property_id"])
+            hop = UNKNOWN_TRAVEL_MINUTES if hop is None else hop
+        arrival = clock + timedelta(minutes=hop)
+        clock = arrival + timedelta(minutes=stop["service_minutes"])
+        deadline = _deadline(stop.get("open_by_time"), plan.run_started_at)
+        if deadline is None:
+            status = "on_time"
+        elif clock > deadline:
+            status = "late"
+        elif clock > deadline - timedelta(minutes=AT_RISK_MARGIN_MINUTES):
+            status = "at_risk"
+        else:
+            status = "on_time"
+        rows.append({
+            "property_id": stop["property_id"],
+            "name": stop["name"],
+            "sequence_order": stop["sequence_order"],
+            "travel_minutes": round(hop, 1),
+            "service_minutes": round(stop["service_minutes"], 1),
+            "service_source": stop["service_source"],
+            "eta_arrival": arrival,
+            "eta_finish": clock,
+            "deadline": deadline,
+            "slack_minutes": round((deadline - clock).total_seconds() / 60.0, 1) if deadline else None,
+            "status": status
+        })
+        previous = stop["property_id"]
+
+    if current:
+        deadline = _deadline(by_id[current["property_id"]].get("open_by_time"), plan.run_started_at)
+        current["deadline"] = deadline
+        current["status"] = "late" if deadline and current["eta_finish"] > deadline else "on_time"
+
+    return {
+        "assignment_id": plan.assignment_id,
+        "route_id": plan.route_id,
+        "route_name": plan.route_name,
+        "user_id": plan.user_id,
+        "user_name": plan.user_name,
+        "equipment": plan.equipment,
+        "run_started_at": plan.run_started_at,
+        "projected_at": now,
+        "completed_count": sum(1 for stop in plan.stops if stop["property_id"] in plan.completed),
+        "remaining_count": len(rows) + (1 if current else 0),
+        "current": current,
+        "stops": rows,
+        "projected_completion": rows[-1]["eta_finish"] if rows else (current["eta_finish"] if current else None),
+        "at_risk_count": sum(1 for row in rows if row["status"] == "at_risk"),
+        "late_count": sum(1 for row in rows if row["status"] == "late")
+                      + (1 if current and current["status"] == "late" else 0)
+    }
+
+
+class RouteEtaEngine:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._plans: Dict[int, _Plan] = {}
+
+    # ----- reads -----
+
+    def projection(self, assignment_id: int) -> Optional[Dict]:
+        """ETA for one accepted route assignment (None when it is not accepted)"""
+        return self.projections([assignment_id]).get(assignment_id)
+
+    def projections(self, assignment_ids: Sequence[int]) -> Dict[int, Dict]:
+        with self._lock:
+            missing = [i for i in assignment_ids if i not in self._plans or self._plans[i].expired()]
+        if missing:
+            plans = self._load(missing)
+            with self._lock:
+                for assignment_id in missing:
+                    self._plans.pop(assignment_id, None)
+                self._plans.update(plans)
+
+        result = {}
+        for assignment_id in assignment_ids:
+            with self._lock:
+                plan = self._plans.get(assignment_id)
+            if plan is None:
+                continue
+            if plan.projection is None or time.monotonic() - plan.projected_at > PROJECTION_SECONDS:
+                plan.projection = project(plan)
+                plan.projected_at = time.monotonic()
+            result[assignment_id] = plan.projection
+        return result
+
+    def accepted_assignment_ids(self) -> List[int]:
+        rows = fetch_query("SELECT id FROM route_assignments WHERE acceptance_status = 'accepted'")
+        if rows is None:
+            raise RuntimeError("Could not load route assignments")
+        return [row["id"] for row in rows]
+
+    # ----- progress -----
+
+    def stop_started(self, assignment_id: int, property_id: int, at: Optional[datetime] = None):
+        with self._lock:
+            plan = self._plans.get(assignment_id)
+            if plan is None:
+                return
+            plan.current_property_id = property_id
+            plan.current_started_at = at or datetime.now()
+        self._reproject(plan)
+
+    def stop_completed(self, assignment_id: int, property_id: int, at: Optional[datetime] = None):
+        with self._lock:
+            plan = self._plans.get(assignment_id)
+            if plan is None:
+                return
+            plan.completed[property_id] = at or datetime.now()
+            if plan.current_property_id == property_id:
+                plan.current_property_id = None
+                plan.current_started_at = None
+        self._reproject(plan)
+
+    def forget(self, assignment_id: int):
+        with self._lock:
+            self._plans.pop(assignment_id, None)
+
+    def invalidate_route(self, route_id: int):
+        """Stops, order or crews on a route changed; reload its assignments on next use"""
+        with self._lock:
+            for assignment_id in [i for i, plan in self._plans.items() if plan.route_id == route_id]:
+                del self._plans[assignment_id]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"assignments": len(self._plans)}
+
+    # ----- internals -----
+
+    def _reproject(self, plan: _Plan):
+        plan.projection = project(plan)
+        plan.projected_at = time.monotonic()
+        summary = plan.projection
+        try:
+            publish_to_active_events("eta", {
+                "assignment_id": plan.assignment_id,
+                "route_id": plan.route_id,
+                "user_id": plan.user_id,
+                "remaining_count": summary["remaining_count"],
+                "projected_completion": summary["projected_completion"],
+                "at_risk_count": summary["at_risk_count"],
+                "late_count": summary["late_count"],
+                "at": datetime.now()
+            })
+        except Exception as e:
+            logger.warning(f"Could not publish ETA for assignment {plan.assignment_id}: {e}")
+
+    def _load(self, assignment_ids: List[int]) -> Dict[int, _Plan]:
+        placeholders = ", ".join(["%s"] * len(assignment_ids))
+        assignments = fetch_query(
+            f"""SELECT ra.id, ra.route_id, ra.user_id, ra.accepted_at,
+                       ra.current_property_id, ra.current_property_started_at,
+                       u.name AS user_name, u.default_equipment, r.name AS route_name
+                FROM route_assignments ra
+                JOIN users u ON ra.user_id = u.id
+                JOIN routes r ON ra.route_id = r.id
+                WHERE ra.id IN ({placeholders}) AND ra.acceptance_status = 'accepted'""",
+            tuple(assignment_ids)
+        )
+        if assignments is None:
+            raise RuntimeError("Could not load route assignments")
+        if not assignments:
+            return {}
+
+        route_ids = sorted({a["route_id"] for a in assignments})
+        route_placeholders = ", ".join(["%s"] * len(route_ids))
+        stop_rows = fetch_query(
+            f"""SELECT l.*, rp.route_id, rp.property_id, rp.sequence_order, rp.estimated_time_minutes
+                FROM route_properties rp
+                JOIN locations l ON rp.property_id = l.id
+                WHERE rp.route_id IN ({route_placeholders})
+                ORDER BY rp.route_id, rp.sequence_order""",
+            tuple(route_ids)
+        )
+        if stop_rows is None:
+            raise RuntimeError("Could not load route stops")
+
+        now = datetime.now()
+        event_id, event_start = _active_event()
+        run_starts = {a["id"]: _run_started_at(a.get("accepted_at"), event_start, now) for a in assignments}
+        history = fetch_query(
+            f"""SELECT assignment_id, property_id, MAX(action_timestamp) AS completed_at
+                FROM assignment_history
+                WHERE assignment_type = 'route' AND action = 'completed'
+                  AND assignment_id IN ({placeholders}) AND action_timestamp >= %s
+                GROUP BY assignment_id, property_id""",
+            (*[a["id"] for a in assignments], min(run_starts.values()))
+        )
+        if history is None:
+            raise RuntimeError("Could not load route progress")
+
+        medians = load_service_durations([row["property_id"] for row in stop_rows])
+
+        stops_by_route: Dict[int, List[Dict]] = {}
+        for row in stop_rows:
+            stops_by_route.setdefault(row["route_id"], []).append(row)
+
+        plans = {}
+        for assignment in assignments:
+            crew = live_crews.get(event_id, assignment["user_id"]) if event_id else None
+            equipment = (crew or {}).get("equipment_in_use") or assignment.get("default_equipment")
+            stops = []
+            for row in stops_by_route.get(assignment["route_id"], []):
+                minutes, source, samples = service_estimate(row, medians.get(row["property_id"], {}), equipment)
+                stops.append({
+                    "property_id": row["property_id"], "name": row["name"],
+                    "sequence_order": row["sequence_order"], "open_by_time": row["open_by_time"],
+                    "service_minutes": minutes, "service_source": source, "service_samples": samples
+                })
+            run_start = run_starts[assignment["id"]]
+            completed = {h["property_id"]: h["completed_at"] for h in history
+                         if h["assignment_id"] == assignment["id"] and h["completed_at"] >= run_start}
+            plans[assignment["id"]] = _Plan(
+                {**assignment, "equipment": equipment}, stops, completed, run_start, event_id
+            )
+        return plans
+
+
+route_etas = RouteEtaEngine()
@@ -0,0 +1,320 @@
+"""
+Route Sequence Optimiser
+Visiting order for one route's properties, from an optional start point
+(a crew's position or the yard).
+
+1. Construction: nearest neighbour from the start point. Without one the
+   route starts at the stop with the earliest open-by deadline, or else at
+   the stop farthest from the others (one end of the route).
+2. 2-opt: reverse a stretch of the route when that lowers the cost.
+3. Or-opt: move a run of 1-3 consecutive stops elsewhere in the route.
+Both passes repeat until neither finds an improving move.
+
+The cost is total driving minutes plus LATE_PENALTY_PER_MINUTE for every
+minute a stop is finished after its open_by_time. Open-by times are soft
+windows: a slightly longer drive wins when it gets a site open on time.
+Routes are open paths (the crew does not return to the start). Travel times
+come from the shared distance matrix when one is passed (else the crew
+assignment model's haversine estimate); service times from the route's
+estimated_time_minutes, or the crew assignment model.
+
+Identical input gives an identical order. 100 stops take well under a
+second; TIME_BUDGET_SECONDS caps larger routes.
+"""
+
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from services.crew_assignment import UNKNOWN_TRAVEL_MINUTES, needs_lot, service_minutes, travel_minutes
+from utils.spatial import to_float
+
+LATE_PENALTY_PER_MINUTE = 5.0
+OR_OPT_MAX_SEGMENT = 3
+MAX_IMPROVEMENT_PASSES = 50
+TIME_BUDGET_SECONDS = 2.0
+
+_START = -1
+_END = -2
+_EPSILON = 1e-6
+
+
+def deadline_minutes(open_by, start_time: datetime) -> Optional[float]:
+    """Minutes from start_time to the next occurrence of an open_by_time ("06:00" or a TIME timedelta)"""
+    if open_by is None or open_by == "":
+        return None
+    if isinstance(open_by, timedelta):
+        offset = open_by
+    else:
+        try:
+            parts = [int(p) for p in str(open_by).split(":")[:3]]
+        except ValueError:
+            return None
+        offset = timedelta(hours=parts[0], minutes=parts[1] if len(parts) > 1 else 0,
+                           seconds=parts[2] if len(parts) > 2 else 0)
+    deadline = datetime.combine(start_time.date(), datetime.min.time()) + offset
+    if deadline < start_time:
+        deadline += timedelta(days=1)
+    return (deadline - start_time).total_seconds() / 60.0
+
+
+def stop_service_minutes(stop: Dict) -> float:
+    if stop.get("estimated_time_minutes"):
+        return float(stop["estimated_time_minutes"])
+    return service_minutes(stop, "non-sidewalk" if needs_lot(stop) else "sidewalk")
+
+
+class _Problem:
+    """Travel/service/deadline tables indexed by stop position in the input"""
+
+    def __init__(self, travel: List[List[float]], start_travel: List[float],
+                 service: List[float], deadlines: List[Optional[float]]):
+        self.n = len(service)
+        self.travel = travel
+        self.start_travel = start_travel
+        self.service = service
+        self.deadlines = deadlines
+
+    def edge(self, a: int, b: int) -> float:
+        if b == _END:
+            return 0.0
+        if a == _START:
+            return self.start_travel[b]
+        return self.travel[a][b]
+
+    def evaluate(self, order: Sequence[int], first: int = 0,
+                 prefix: Optional[List[Tuple[float, float, float]]] = None) -> Tuple[float, float, float]:
+        """
+        (cost, travel minutes, late minutes). With the prefix() of an order
+        that shares order[:first], only the stops from `first` on are walked.
+        """
+        clock = travel = late = 0.0
+        previous = _START
+        if first and prefix:
+            clock, travel, late = prefix[first - 1]
+            previous = order[first - 1]
+        for stop in order[first:]:
+            hop = self.edge(previous, stop)
+            travel += hop
+            clock += hop + self.service[stop]
+            deadline = self.deadlines[stop]
+            if deadline is not None and clock > deadline:
+                late += clock - deadline
+            previous = stop
+        return travel + LATE_PENALTY_PER_MINUTE * late, travel, late
+
+    def prefix(self, order: Sequence[int]) -> List[Tuple[float, float, float]]:
+        """(clock, travel, late) after each stop of an order"""
+        clock = travel = late = 0.0
+        previous = _START
+        totals = []
+        for stop in order:
+            hop = self.edge(previous, stop)
+            travel += hop
+            clock += hop + self.service[stop]
+            deadline = self.deadlines[stop]
+            if deadline is not None and clock > deadline:
+                late += clock - deadline
+            totals.append((clock, travel, late))
+            previous = stop
+        return totals
+
+    def schedule(self, order: Sequence[int]) -> List[Dict]:
+        """Per-stop timings along an order"""
+        clock = 0.0
+        previous = _START
+        rows = []
+        for stop in order:
+            hop = self.edge(previous, stop)
+            arrival = clock + hop
+            clock = arrival + self.service[stop]
+            deadline = self.deadlines[stop]
+            rows.append({
+                "travel_minutes": round(hop, 1),
+                "arrival_minutes": round(arrival, 1),
+                "finish_minutes": round(clock, 1),
+                "deadline_minutes": round(deadline, 1) if deadline is not None else None,
+                "late_minutes": round(max(0.0, clock - deadline), 1) if deadline is not None else 0.0
+            })
+            previous = stop
+        return rows
+
+
+def _nearest_neighbour(problem: _Problem, has_start: bool) -> List[int]:
+    remaining = set(range(problem.n))
+    if not remaining:
+        return []
+    if has_start:
+        current = _START
+    elif any(d is not None for d in problem.deadlines):
+        current = min(remaining, key=lambda s: (problem.deadlines[s] is None, problem.deadlines[s] or 0, s))
+    else:
+        # Farthest from the others on average: an end of the route rather than its middle
+        current = max(remaining, key=lambda s: (sum(problem.travel[s]), -s))
+    order = []
+    if current != _START:
+        order.append(current)
+        remaining.discard(current)
+    while remaining:
+        current = min(remaining, key=lambda s: (problem.edge(current, s), s))
+        order.append(current)
+        remaining.discard(current)
+    return order
+
+
+def _can_improve(delta: float, late: float) -> bool:
+    """A move adding `delta` driving minutes can only pay off by cutting lateness"""
+    return delta < LATE_PENALTY_PER_MINUTE * late - _EPSILON
+
+
+def _two_opt(problem: _Problem, order: List[int], cost: Tuple[float, float, float],
+             deadline: float) -> Tuple[List[int], Tuple[float, float, float], bool]:
+    n = len(order)
+    edge = problem.edge
+    improved = False
+    prefix = problem.prefix(order)
+    for i in range(n - 1):
+        if time.monotonic() > deadline:
+            break
+        before = order[i - 1] if i > 0 else _START
+        # Change from driving order[i..j] backwards; zero unless road times differ by direction
+        reversal = 0.0
+        for j in range(i + 1, n):
+            after = order[j + 1] if j + 1 < n else _END
+            reversal += edge(order[j], order[j - 1]) - edge(order[j - 1], order[j])
+            delta = (edge(before, order[j]) + edge(order[i], after)
+                     - edge(before, order[i]) - edge(order[j], after) + reversal)
+            if not _can_improve(delta, cost[2]):
+                continue
+            candidate = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+            candidate_cost = problem.evaluate(candidate, i, prefix)
+            if candidate_cost[0] < cost[0] - _EPSILON:
+                order, cost, improved = candidate, candidate_cost, True
+                prefix = problem.prefix(order)
+                reversal = -reversal  # order[i..j] is now the reversed stretch
+    return order, cost, improved
+
+
+def _or_opt(problem: _Problem, order: List[int], cost: Tuple[float, float, float],
+            deadline: float) -> Tuple[List[int], Tuple[float, float, float], bool]:
+    edge = problem.edge
+    improved = False
+    prefix = problem.prefix(order)
+    for length in range(1, OR_OPT_MAX_SEGMENT + 1):
+        i = 0
+        while i + length <= len(order):
+            if time.monotonic() > deadline:
+                return order, cost, improved
+            segment = order[i:i + length]
+            rest = order[:i] + order[i + length:]
+            before = order[i - 1] if i > 0 else _START
+            after = order[i + length] if i + length < len(order) else _END
+            removal = edge(before, after) - edge(before, segment[0]) - edge(segment[-1], after)
+            best = None
+            for k in range(len(rest) + 1):
+                if k == i:
+                    continue
+                a = rest[k - 1] if k > 0 else _START
+                b = rest[k] if k < len(rest) else _END
+                delta = removal + edge(a, segment[0]) + edge(segment[-1], b) - edge(a, b)
+                if not _can_improve(delta, cost[2]):
+                    continue
+                candidate = rest[:k] + segment + rest[k:]
+                candidate_cost = problem.evaluate(candidate, min(i, k), prefix)
+                if candidate_cost[0] < cost[0] - _EPSILON and (best is None or candidate_cost[0] < best[1][0]):
+                    best = (candidate, candidate_cost)
+            if best:
+                order, cost = best
+                prefix = problem.prefix(order)
+                improved = True
+            else:
+                i += 1
+    return order, cost, improved
+
+
+def _points(stops: List[Dict]) -> List[Optional[Tuple[float, float]]]:
+    points = []
+    for stop in stops:
+        lat, lon = to_float(stop.get("latitude")), to_float(stop.get("longitude"))
+        points.append((lat, lon) if lat is not None and lon is not None else None)
+    return points
+
+
+def _summary(problem: _Problem, order: List[int]) -> Dict:
+    cost, travel, late = problem.evaluate(order)
+    schedule = problem.schedule(order)
+    return {
+        "travel_minutes": round(travel, 1),
+        "late_minutes": round(late, 1),
+        "late_stops": sum(1 for row in schedule if row["late_minutes"] > 0),
+        "finish_minutes": schedule[-1]["finish_minutes"] if schedule else 0.0,
+        "cost": round(cost, 1)
+    }
+
+
+def _travel_tables(stops: List[Dict], points: List[Optional[Tuple[float, float]]],
+                   start: Optional[Tuple[float, float]], distances) -> Tuple[List[List[float]], List[float]]:
+    """Minutes between stops and from the start point to each stop"""
+    n = len(stops)
+    if distances is None:
+        travel = [[0.0 if i == j else travel_minutes(points[i], points[j]) for j in range(n)] for i in range(n)]
+        return travel, [travel_minutes(start, p) if start else 0.0 for p in points]
+
+    ids = [stop["id"] for stop in stops]
+    _, minutes = distances.table(ids)
+    known = lambda value: UNKNOWN_TRAVEL_MINUTES if value is None else value
+    travel = [[0.0 if i == j else known(minutes[i][j]) for j in range(n)] for i in range(n)]
+    if not start:
+        return travel, [0.0] * n
+    _, from_start = distances.from_point(start, ids)
+    return travel, [known(value) for value in from_start]
+
+
+def optimize_route(stops: List[Dict], start: Optional[Tuple[float, float]] = None,
+                   start_time: Optional[datetime] = None, distances=None) -> Dict:
+    """
+    Best visiting order for stops (dicts with id, latitude, longitude,
+    open_by_time, estimated_time_minutes and the property fields used by the
+    service time model), given in their current order. distances is the
+    shared DistanceMatrix (services.distance_matrix).
+    """
+    start_time = start_time or datetime.now()
+    if start_time.tzinfo is not None:
+        # open_by_time and the database are local wall-clock time
+        start_time = start_time.astimezone().replace(tzinfo=None)
+    points = _points(stops)
+    travel, start_travel = _travel_tables(stops, points, start, distances)
+    problem = _Problem(
+        travel=travel,
+        start_travel=start_travel,
+        service=[stop_service_minutes(stop) for stop in stops],
+        deadlines=[deadline_minutes(stop.get("open_by_time"), start_time) for stop in stops]
+    )
+
+    current = list(range(len(stops)))
+    order = _nearest_neighbour(problem, has_start=start is not None)
+    cost = problem.evaluate(order)
+    # Improve on the route's own order instead when that is already better
+    current_cost = problem.evaluate(current)
+    if current_cost[0] < cost[0]:
+        order, cost = current, current_cost
+
+    deadline = time.monotonic() + TIME_BUDGET_SECONDS
+    for _ in range(MAX_IMPROVEMENT_PASSES):
+        order, cost, improved_2opt = _two_opt(problem, order, cost, deadline)
+        order, cost, improved_or = _or_opt(problem, order, cost, deadline)
+        if not (improved_2opt or improved_or) or time.monotonic() > deadline:
+            break
+
+    schedule = problem.schedule(order)
+    return {
+        "order": [stops[i]["id"] for i in order],
+        "stops": [
+            {"property_id": stops[i]["id"], "name": stops[i].get("name"), "sequence_order": position + 1,
+             "located": points[i] is not None, **timing}
+            for position, (i, timing) in enumerate(zip(order, schedule))
+        ],
+        "before": _summary(problem, current),
+        "after": _summary(problem, order),
+        "start_time": start_time
+    }
@@ -0,0 +1,244 @@
+"""
+SMS Command Grammar
+Local interpretation of crew texts before falling back to the LLM.
+
+Handles the fixed keywords (START, DONE, READY, WORKING, HOME, HELP and
+their aliases), numeric property picks, and ticket details such as
+"3 yards bulk salt, 5 bags calcium, plow truck". Returns the same
+interpretation dict get_ai_interpretation produces, or None when the text
+needs the LLM.
+
+Only exact keywords and aliases are acted on locally, and only when nothing
+but quantities and equipment follows them ("done 3 yards salt"). Words that
+are merely close to one ("chekin", "skidster") and commands followed by free
+text ("help me my truck broke") go to the LLM, since short replies like
+"none" or "some" sit one letter away from commands that close tickets.
+"""
+
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from db import fetch_query
+from utils.cache import TTLCache
+
+# intent -> phrases that mean it (matched as the whole message or its first words)
+COMMAND_ALIASES = {
+    "start_ticket": ["start", "omw", "on my way", "on the way", "starting", "begin", "heading over"],
+    "complete_ticket": ["done", "complete", "completed", "finished", "finish", "all done"],
+    "check_in": ["ready", "checkin", "check in", "check-in", "available", "checking in"],
+    "status_working": ["working", "busy", "on site", "onsite", "servicing"],
+    "go_home": ["home", "off", "offline", "going home", "heading home", "done for the night"],
+    "help": ["help", "commands", "?", "menu"],
+}
+
+# Intents that are explicit commands rather than ticket details
+COMMAND_INTENTS = {"start_ticket", "complete_ticket", "check_in", "status_working", "go_home", "help"}
+
+# Only words at least this long count as near misses ("chekin", "skidster"),
+# allowing one typo (two for words of 7+ letters). Near misses are sent to the
+# LLM rather than acted on.
+FUZZY_MIN_LENGTH = 6
+
+# canonical equipment name -> spellings crews use
+EQUIPMENT_ALIASES = {
+    "Plow Truck": ["plow truck", "plow", "truck", "pickup"],
+    "Skid Steer": ["skid steer", "skidsteer", "skid", "bobcat"],
+    "Loader": ["loader", "wheel loader", "front end loader"],
+    "Salt Truck": ["salt truck", "salter", "spreader"],
+    "Snow Blower": ["snow blower", "snowblower", "blower"],
+    "Shovel Crew": ["shovel", "shovels", "shoveling", "shovel crew"],
+    "Sidewalk Crew": ["sidewalk crew", "sidewalk", "walks"],
+    "Tractor": ["tractor"],
+    "ATV": ["atv", "gator", "utv"],
+}
+
+_NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "half": 0.5,
+}
+_NUMBER = r"(\d+(?:\.\d+)?|\d*\.\d+|" + "|".join(_NUMBER_WORDS) + r")"
+
+_BULK_SALT = re.compile(_NUMBER + r"\s*(?:yards?|yds?|yd|tons?|scoops?)\b(?:\s+(?:of\s+)?(?:bulk\s+)?(?:salt|rock\s+salt))?", re.I)
+_CALCIUM = re.compile(_NUMBER + r"\s*(?:bags?\s+(?:of\s+)?)?(?:calcium(?:\s+chloride)?|cacl2?|ice\s*melt)\b", re.I)
+_BAG_SALT = re.compile(_NUMBER + r"\s*bags?\b(?:\s+(?:of\s+)?(?:bag\s+)?salt)?", re.I)
+_PICK = re.compile(r"^\s*#?\s*(\d{1,2})\s*[.)]?\s*$")
+_TIME_HINT = re.compile(r"\b\d{1,2}(?::\d{2})?\s*(?:am|pm)\b|\b(?:started|finished|arrived|left)\s+at\b|\b\d+\s*(?:hours?|hrs?|minutes?|mins?)\b", re.I)
+
+_equipment_cache = TTLCache(ttl_seconds=300, maxsize=1)
+
+
+def known_equipment() -> List[str]:
+    """Equipment names from equipment_rates (cached for 5 minutes)"""
+    names = _equipment_cache.get("names")
+    if names is None:
+        rows = fetch_query("SELECT equipment_name FROM equipment_rates") or []
+        names = [r["equipment_name"] for r in rows if r.get("equipment_name")]
+        _equipment_cache.set("names", names)
+    return names
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s?#.\-]", " ", text.lower())).strip()
+
+
+def _to_number(token: str) -> float:
+    token = token.lower()
+    value = _NUMBER_WORDS[token] if token in _NUMBER_WORDS else float(token)
+    return int(value) if float(value).is_integer() else value
+
+
+def _edit_distance(a: str, b: str) -> int:
+    """Damerau-Levenshtein distance (adjacent transpositions count as one edit)"""
+    prev2, prev = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        row = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            row[j] = min(prev[j] + 1, row[j - 1] + 1, prev[j - 1] + cost)
+            if prev2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                row[j] = min(row[j], prev2[j - 2] + 1)
+        prev2, prev = prev, row
+    return prev[len(b)]
+
+
+def _similar(a: str, b: str) -> bool:
+    if len(a) < FUZZY_MIN_LENGTH or len(b) < FUZZY_MIN_LENGTH or abs(len(a) - len(b)) > 2:
+        return False
+    return _edit_distance(a, b) <= (2 if len(b) >= 7 else 1)
+
+
+def match_command(text: str) -> Tuple[Optional[str], str, bool]:
+    """
+    Leading command in the message as (intent, rest of message, whether the
+    match was only fuzzy). Exact alias first, longest alias wins; then a
+    fuzzy match on the first word.
+    """
+    normalized = _normalize(text)
+    original_words = text.split()
+    best = None
+    for intent, aliases in COMMAND_ALIASES.items():
+        for alias in aliases:
+            if normalized == alias or normalized.startswith(alias + " "):
+                if best is None or len(alias) > len(best[1]):
+                    best = (intent, alias)
+    if best:
+        return best[0], " ".join(original_words[len(best[1].split()):]), False
+
+    first = normalized.split(" ", 1)[0]
+    for intent, aliases in COMMAND_ALIASES.items():
+        for alias in aliases:
+            if " " not in alias and _similar(first, alias):
+                return intent, " ".join(original_words[1:]), True
+    return None, text, False
+
+
+def extract_details(text: str, equipment_names: Iterable[str] = ()) -> Tuple[Dict, str, bool]:
+    """
+    Pull salt/calcium quantities and equipment out of free text.
+    Returns (fields, leftover text with the recognised parts removed,
+    whether the equipment was only a fuzzy match).
+    """
+    fields: Dict = {}
+    fuzzy = False
+    remaining = " " + text + " "
+
+    for pattern, field in ((_BULK_SALT, "bulk_salt_qty"), (_CALCIUM, "calcium_chloride_qty"), (_BAG_SALT, "bag_salt_qty")):
+        match = pattern.search(remaining)
+        if match:
+            fields[field] = _to_number(match.group(1))
+            remaining = remaining[:match.start()] + " " + remaining[match.end():]
+
+    # Equipment: configured names first, then common spellings; longest phrase wins
+    lowered = remaining.lower()
+    candidates = []
+    for name in equipment_names:
+        candidates.append((name.lower(), name))
+    for canonical, aliases in EQUIPMENT_ALIASES.items():
+        display = next((n for n in equipment_names if n.lower() == canonical.lower()), canonical)
+        candidates.extend((alias, display) for alias in aliases)
+    candidates.sort(key=lambda c: -len(c[0]))
+    for phrase, display in candidates:
+        match = re.search(r"\b" + re.escape(phrase) + r"\b", lowered)
+        if match:
+            fields["equipment"] = display
+            remaining = remaining[:match.start()] + " " + remaining[match.end():]
+            break
+    else:
+        # Typos in single-word equipment ("skidster", "loder")
+        for word in re.findall(r"[a-z]+", lowered):
+            for phrase, display in candidates:
+                if " " not in phrase and _similar(word, phrase):
+                    fields["equipment"] = display
+                    fuzzy = True
+                    remaining = re.sub(r"\b" + re.escape(word) + r"\b", " ", remaining, count=1, flags=re.I)
+                    break
+            if "equipment" in fields:
+                break
+
+    leftover = re.sub(r"\s+", " ", re.sub(r"(?:^|\s)(?:and|of|with|used|,|;|\.|-|&|\+)(?=\s|$)", " ", remaining)).strip(" ,.;-")
+    return fields, leftover, fuzzy
+
+
+def parse_sms(message: str, state: str = "idle", equipment_names: Iterable[str] = ()) -> Optional[Dict]:
+    """
+    Interpret a crew text locally. Returns an interpretation dict in the
+    get_ai_interpretation format (plus "source": "rules"), or None when the
+    text is ambiguous and should go to the LLM.
+    """
+    text = (message or "").strip()
+    if not text:
+        return None
+
+    # Times ("started at 2am", "2 hours") are only understood by the LLM
+    if _TIME_HINT.search(text):
+        return None
+
+    result = {
+        "intent": None,
+        "equipment": None,
+        "bulk_salt_qty": None,
+        "bag_salt_qty": None,
+        "calcium_chloride_qty": None,
+        "address": None,
+        "notes": None,
+        "time_in": None,
+        "time_out": None,
+        "confidence": "high",
+        "source": "rules",
+    }
+
+    # Numeric pick while choosing a property ("2", "#2")
+    pick = _PICK.match(text)
+    if pick:
+        if state != "awaiting_start_confirmation":
+            return None
+        result["intent"] = "select_property"
+        result["selection"] = int(pick.group(1))
+        return result
+
+    intent, rest, fuzzy_command = match_command(text)
+    fields, leftover, fuzzy_equipment = extract_details(rest, equipment_names)
+    if fuzzy_command or fuzzy_equipment:
+        # Near misses ("chekin", "skidster") are only guesses; let the LLM decide
+        return None
+    result.update(fields)
+
+    if intent == "go_home" and rest:
+        # HOME closes open tickets; only act on it when it's the whole message
+        return None
+
+    if intent in COMMAND_INTENTS:
+        # A command plus free text may mean something else; let the LLM read it
+        if leftover:
+            return None
+        result["intent"] = intent
+        return result
+
+    if fields:
+        result["intent"] = "provide_details"
+        if leftover:
+            result["notes"] = leftover
+            result["confidence"] = "medium"
+        return result
+
+    return None
@@ -0,0 +1,220 @@
+"""
+SMS Conversation State Store
+In-memory conversation state keyed by phone number, with write-behind
+persistence to sms_conversations.
+
+Each inbound text used to re-read the conversation (and the user behind the
+phone) and then write conversation_state/context_data back several times.
+Conversations are now loaded once, served from memory, and changed state is
+flushed to the database in batches every few seconds and on shutdown.
+
+Assumes one app process handles SMS (the inbound queue already does).
+"""
+
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from db import execute_many, execute_query, fetch_query
+from utils.cache import TTLCache
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Columns owned by the store; everything else in the row is read-only here
+STATE_FIELDS = ("conversation_state", "active_ticket_id", "active_property_id", "context_data", "last_message_at")
+
+_CONVERSATION_QUERY = """
+    SELECT c.*, u.name AS user_name
+    FROM sms_conversations c
+    LEFT JOIN users u ON c.user_id = u.id
+    WHERE c.phone_number = %s
+    ORDER BY c.last_message_at DESC
+    LIMIT 1
+"""
+
+_FLUSH_QUERY = """
+    UPDATE sms_conversations
+    SET conversation_state = %s, active_ticket_id = %s, active_property_id = %s,
+        context_data = %s, last_message_at = %s
+    WHERE id = %s
+"""
+
+
+class ConversationStore:
+    """
+    get(phone) returns a copy of the conversation row (plus user_name), or
+    None for numbers that don't belong to a user. update(phone, **fields)
+    changes state in memory and schedules the write.
+    """
+
+    def __init__(self, flush_interval_seconds: float = 2.0, idle_seconds: float = 3600, unknown_ttl_seconds: float = 60):
+        self.flush_interval = flush_interval_seconds
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._conversations: Dict[str, Dict] = {}
+        self._last_used: Dict[str, float] = {}
+        self._dirty: set = set()
+        # Unregistered numbers, so repeated texts from them don't hit the database
+        self._unknown = TTLCache(ttl_seconds=unknown_ttl_seconds, maxsize=1000)
+        self._counts = {"hits": 0, "loads": 0, "created": 0, "flushed": 0, "flushes": 0}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._listeners: List[Callable[[Dict], None]] = []
+
+    # ----- lifecycle -----
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sms-state-flush", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the flusher and write any pending state"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    # ----- public API -----
+
+    def get(self, phone_number: str, user_id: int = None) -> Optional[Dict]:
+        """Conversation for a phone, creating it for a known user on first contact"""
+        with self._lock:
+            conversation = self._conversations.get(phone_number)
+            if conversation is not None:
+                self._last_used[phone_number] = time.monotonic()
+                self._counts["hits"] += 1
+                return dict(conversation)
+        if not user_id and self._unknown.get(phone_number):
+            return None
+
+        conversation = self._load(phone_number, user_id)
+        if conversation is None:
+            return None
+
+        with self._lock:
+            # Another thread may have loaded it meanwhile; keep the first copy
+            conversation = self._conversations.setdefault(phone_number, conversation)
+            self._last_used[phone_number] = time.monotonic()
+            return dict(conversation)
+
+    def update(self, phone_number: str, **fields):
+        """Change conversation state in memory; persisted by the next flush"""
+        unknown = set(fields) - set(STATE_FIELDS)
+        if unknown:
+            raise ValueError(f"Not conversation state fields: {', '.join(sorted(unknown))}")
+        fields.setdefault("last_message_at", datetime.now())
+        with self._lock:
+            conversation = self._conversations.get(phone_number)
+            if conversation is None:
+                raise KeyError(f"No cached conversation for {phone_number}")
+            conversation.update(fields)
+            self._last_used[phone_number] = time.monotonic()
+            self._dirty.add(phone_number)
+            snapshot = dict(conversation)
+        if not self._thread or not self._thread.is_alive():
+            self.start()
+        for listener in self._listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                logger.error(f"SMS conversation listener failed: {e}", exc_info=True)
+
+    def reset(self, phone_number: str):
+        """Back to idle with no active ticket (after DONE or HOME)"""
+        self.update(
+            phone_number,
+            conversation_state="idle",
+            active_ticket_id=None,
+            active_property_id=None,
+            context_data="{}"
+        )
+
+    def add_listener(self, callback: Callable[[Dict], None]):
+        """callback(conversation) runs after every state change (in the caller's thread)"""
+        self._listeners.append(callback)
+
+    def forget_user(self, user_id: int):
+        """Drop cached conversations for a user (name or phone changed, user deleted)"""
+        self.flush()
+        with self._lock:
+            for phone_number in [p for p, c in self._conversations.items() if c["user_id"] == user_id]:
+                self._conversations.pop(phone_number, None)
+                self._last_used.pop(phone_number, None)
+        self._unknown.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"cached": len(self._conversations), "dirty": len(self._dirty), **self._counts}
+
+    def flush(self) -> int:
+        """Write changed conversations in one batch; returns how many were written"""
+        with self._lock:
+            if not self._dirty:
+                return 0
+            phones = list(self._dirty)
+            self._dirty.clear()
+            rows = [
+                tuple(self._conversations[p][f] for f in STATE_FIELDS) + (self._conversations[p]["id"],)
+                for p in phones if p in self._conversations
+            ]
+        try:
+            execute_many(_FLUSH_QUERY, rows)
+        except Exception as e:
+            logger.error(f"Failed to persist {len(rows)} SMS conversations: {e}", exc_info=True)
+            with self._lock:
+                self._dirty.update(phones)
+            return 0
+        with self._lock:
+            self._counts["flushed"] += len(rows)
+            self._counts["flushes"] += 1
+        return len(rows)
+
+    # ----- internals -----
+
+    def _load(self, phone_number: str, user_id: int = None) -> Optional[Dict]:
+        conv = fetch_query(_CONVERSATION_QUERY, (phone_number,))
+        if conv:
+            with self._lock:
+                self._counts["loads"] += 1
+            return conv[0]
+
+        # First text from this phone: find its user (users.phone_number is indexed)
+        if not user_id:
+            user = fetch_query("SELECT id FROM users WHERE phone_number = %s LIMIT 1", (phone_number,))
+            if not user:
+                if user is not None:  # empty result, not a database error
+                    self._unknown.set(phone_number, True)
+                return None
+            user_id = user[0]['id']
+
+        execute_query(
+            """INSERT INTO sms_conversations (user_id, phone_number, conversation_state)
+               VALUES (%s, %s, 'idle')""",
+            (user_id, phone_number)
+        )
+        conv = fetch_query(_CONVERSATION_QUERY, (phone_number,))
+        with self._lock:
+            self._counts["created"] += 1
+        return conv[0] if conv else None
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            for phone_number in [p for p, t in self._last_used.items() if t < cutoff and p not in self._dirty]:
+                self._conversations.pop(phone_number, None)
+                self._last_used.pop(phone_number, None)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+            self._evict_idle()
+
+
+conversation_store = ConversationStore(flush_interval_seconds=float(os.getenv("SMS_STATE_FLUSH_SECONDS", "2")))
@@ -0,0 +1,243 @@
+"""
+Outbound SMS Dispatcher
+Queues outgoing texts and sends them from background threads so request
+handlers never wait on Twilio.
+
+- Account throughput is capped with a token bucket (Twilio queues or rejects
+  beyond the number's messages-per-second limit).
+- Each destination number gets a minimum gap between texts, which keeps
+  replies in order and avoids carrier spam filtering.
+- Failures with a retryable status (429/5xx) or a transport error (timeout,
+  dropped connection) are retried with exponential backoff; anything else
+  is recorded as failed.
+- Delivery records are buffered and written to sms_messages in bulk.
+"""
+
+import heapq
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# The request never completed; Twilio's client raises the requests variants
+TRANSPORT_ERRORS = (ConnectionError, TimeoutError, requests.ConnectionError, requests.Timeout)
+
+
+class PermanentSendError(Exception):
+    """Raised by a send function for failures a retry cannot fix (e.g. no credentials)"""
+
+
+def is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, PermanentSendError):
+        return False
+    status = getattr(exc, "status", None)
+    if status is not None:
+        return status in RETRYABLE_STATUSES
+    # Anything else (bad input, bugs) fails the same way on every attempt
+    return isinstance(exc, TRANSPORT_ERRORS)
+
+
+class SmsDispatcher:
+    """
+    send(to_phone, body) -> (sid, status) performs one Twilio call.
+    record(rows) persists [(conversation_id, to_phone, body, sid, status), ...].
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str, str], Tuple[str, str]],
+        record: Callable[[List[tuple]], None],
+        account_rate_per_second: float = 1.0,
+        account_burst: int = 5,
+        per_number_interval_seconds: float = 1.0,
+        workers: int = 4,
+        max_retries: int = 3,
+        backoff_seconds: float = 2.0,
+        flush_interval_seconds: float = 1.0,
+        flush_size: int = 50
+    ):
+        self._send = send
+        self._record = record
+        self.rate = account_rate_per_second
+        self.burst = max(1, account_burst)
+        self.per_number_interval = per_number_interval_seconds
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.flush_interval = flush_interval_seconds
+        self.flush_size = flush_size
+
+        self._cond = threading.Condition()
+        self._heap: List[tuple] = []  # (ready_at, seq, message)
+        self._seq = itertools.count()
+        self._next_allowed: Dict[str, float] = {}
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._records: List[tuple] = []
+        self._last_flush = time.monotonic()
+        self._in_flight = 0
+        self._counts = {"queued": 0, "sent": 0, "failed": 0, "retried": 0}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        self._stopped = False  # set by stop(); enqueue() must not quietly restart
+
+    # ----- lifecycle -----
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._stopped = False
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="sms-out")
+            self._thread = threading.Thread(target=self._run, name="sms-dispatcher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Stop scheduling; send what is ready within timeout, then flush records"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while (self._heap or self._in_flight) and time.monotonic() < deadline:
+                self._cond.wait(0.1)
+            self._running = False
+            self._stopped = True
+            self._cond.notify_all()
+            left = len(self._heap)
+        if self._thread:
+            self._thread.join(timeout=max(0.1, deadline - time.monotonic()))
+        if self._executor:
+            self._executor.shutdown(wait=True)
+        self._flush(force=True)
+        if left:
+            logger.warning(f"SMS dispatcher stopped with {left} unsent messages")
+
+    # ----- public API -----
+
+    def enqueue(self, to_phone: str, body: str, conversation_id: int = None):
+        """Queue one text; returns immediately. Refused (and logged) once stop() has run"""
+        with self._cond:
+            stopped = self._stopped
+        if stopped:
+            logger.warning(f"SMS dispatcher stopped; dropping text to {to_phone}")
+            return
+        if not self._running:
+            self.start()
+        message = {"to": to_phone, "body": body, "conversation_id": conversation_id, "attempt": 0}
+        with self._cond:
+            message["seq"] = next(self._seq)
+            heapq.heappush(self._heap, (time.monotonic(), message["seq"], message))
+            self._counts["queued"] += 1
+            self._cond.notify()
+
+    def enqueue_many(self, messages: List[Tuple[str, str]], conversation_id: int = None) -> int:
+        for to_phone, body in messages:
+            self.enqueue(to_phone, body, conversation_id)
+        return len(messages)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            now = time.monotonic()
+            return {
+                "queue": "sms-outbound",
+                "pending": len(self._heap),
+                "in_flight": self._in_flight,
+                "oldest_pending_seconds": round(now - min(h[0] for h in self._heap), 1) if self._heap else 0.0,
+                "account_rate_per_second": self.rate,
+                **self._counts
+            }
+
+    # ----- internals -----
+
+    def _take_token(self, now: float) -> float:
+        """Consume one account token; returns seconds to wait if none is available"""
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def _run(self):
+        while True:
+            to_send = None
+            with self._cond:
+                if not self._running:
+                    return
+                now = time.monotonic()
+                wait = self.flush_interval
+                if self._heap:
+                    ready_at, seq, message = self._heap[0]
+                    number_ready = self._next_allowed.get(message["to"], 0.0)
+                    if ready_at > now:
+                        wait = min(wait, ready_at - now)
+                    elif number_ready > now:
+                        # Same number sent recently: push back behind its cooldown
+                        heapq.heapreplace(self._heap, (number_ready, seq, message))
+                        continue
+                    else:
+                        token_wait = self._take_token(now)
+                        if token_wait:
+                            wait = min(wait, token_wait)
+                        else:
+                            heapq.heappop(self._heap)
+                            self._next_allowed[message["to"]] = now + self.per_number_interval
+                            self._in_flight += 1
+                            to_send = message
+                if to_send is None:
+                    self._cond.wait(wait)
+            if to_send is not None:
+                self._executor.submit(self._deliver, to_send)
+            self._flush()
+
+    def _deliver(self, message: Dict):
+        try:
+            sid, status = self._send(message["to"], message["body"])
+            row = (message["conversation_id"], message["to"], message["body"], sid, status)
+            outcome = "sent"
+        except Exception as e:
+            if is_retryable(e) and message["attempt"] < self.max_retries:
+                message["attempt"] += 1
+                delay = self.backoff_seconds * (2 ** (message["attempt"] - 1)) * (1 + random.random() * 0.25)
+                logger.warning(f"SMS to {message['to']} failed ({e}); retry {message['attempt']} in {delay:.1f}s")
+                with self._cond:
+                    # Hold the number until the retry so later texts to it stay behind this one
+                    retry_at = time.monotonic() + delay
+                    self._next_allowed[message["to"]] = max(self._next_allowed.get(message["to"], 0.0), retry_at)
+                    heapq.heappush(self._heap, (retry_at, message["seq"], message))
+                    self._counts["retried"] += 1
+                    self._in_flight -= 1
+                    self._cond.notify()
+                return
+            logger.error(f"Failed to send SMS to {message['to']}: {e}")
+            row = (message["conversation_id"], message["to"], message["body"], None, "failed")
+            outcome = "failed"
+
+        with self._cond:
+            self._records.append(row)
+            self._counts[outcome] += 1
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def _flush(self, force: bool = False):
+        with self._cond:
+            due = force or len(self._records) >= self.flush_size or (
+                self._records and time.monotonic() - self._last_flush >= self.flush_interval
+            )
+            if not due or not self._records:
+                return
+            rows, self._records = self._records, []
+            self._last_flush = time.monotonic()
+        try:
+            self._record(rows)
+        except Exception as e:
+            logger.error(f"Failed to record {len(rows)} outbound SMS: {e}", exc_info=True)
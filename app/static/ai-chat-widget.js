@@ -5,6 +5,10 @@ class AIChatWidget {
     constructor() {
         this.isOpen = false;
         this.messages = [];
+        // Lets the server memoise tool lookups for the length of this chat
+        this.conversationId = (window.crypto && crypto.randomUUID)
+            ? crypto.randomUUID()
+            : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
         this.apiBaseUrl = window.API_BASE_URL || '';
         this.currentPage = this.detectCurrentPage();
         this.init();
@@ -289,6 +293,52 @@ class AIChatWidget {
         }
     }
 
+    startStreamingMessage() {
+        const messagesDiv = this.window.querySelector('#ai-messages');
+        const messageDiv = document.createElement('div');
+        messageDiv.className = 'ai-message assistant';
+        messagesDiv.appendChild(messageDiv);
+        return messageDiv;
+    }
+
+    updateStreamingMessage(messageDiv, content) {
+        const messagesDiv = this.window.querySelector('#ai-messages');
+        messageDiv.textContent = content;
+        messagesDiv.scrollTop = messagesDiv.scrollHeight;
+    }
+
+    async readEventStream(response, onEvent) {
+        // Minimal SSE parser for fetch() bodies (EventSource can't POST or send auth headers)
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let event = 'message';
+                let data = '';
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event: ')) event = line.slice(7);
+                    else if (line.startsWith('data: ')) data += line.slice(6);
+                });
+                onEvent(event, data ? JSON.parse(data) : {});
+            }
+        }
+    }
+
+    setTypingText(text) {
+        const typing = this.window.querySelector('#ai-typing');
+        if (typing) typing.textContent = text;
+    }
+
     showTyping() {
         const messagesDiv = this.window.querySelector('#ai-messages');
         const typing = document.createElement('div');
@@ -331,7 +381,7 @@ class AIChatWidget {
                 throw new Error('Not authenticated');
             }
 
-            const response = await fetch(`${this.apiBaseUrl}/ai/chat/`, {
+            const response = await fetch(`${this.apiBaseUrl}/ai/chat/stream/`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -339,7 +389,8 @@ class AIChatWidget {
                 },
                 body: JSON.stringify({
                     messages: this.messages,
-                    page_context: this.currentPage
+                    page_context: this.currentPage,
+                    conversation_id: this.conversationId
                 })
             });
 
@@ -348,9 +399,37 @@ class AIChatWidget {
                 throw new Error(error.detail || 'AI request failed');
             }
 
-            const data = await response.json();
+            // Render tokens as they stream in
+            let bubble = null;
+            let text = '';
+
+            await this.readEventStream(response, (event, data) => {
+                if (event === 'token') {
+                    if (!bubble) {
+                        this.hideTyping();
+                        bubble = this.startStreamingMessage();
+                    }
+                    text += data.text;
+                    this.updateStreamingMessage(bubble, text);
+                } else if (event === 'tool_call') {
+                    // The answer is streamed again after tools run
+                    text = '';
+                    if (!this.window.querySelector('#ai-typing')) this.showTyping();
+                    this.setTypingText(`🔧 Running ${data.name.replace(/_/g, ' ')}...`);
+                } else if (event === 'tool_result') {
+                    this.setTypingText('AI is thinking...');
+                } else if (event === 'done') {
+                    this.hideTyping();
+                    if (!bubble) bubble = this.startStreamingMessage();
+                    text = data.message;
+                    this.updateStreamingMessage(bubble, text);
+                } else if (event === 'error') {
+                    throw new Error(data.detail || 'AI request failed');
+                }
+            });
+
             this.hideTyping();
-            this.addMessage('assistant', data.message);
+            this.messages.push({ role: 'assistant', content: text });
 
         } catch (error) {
             this.hideTyping();
@@ -0,0 +1,80 @@
+"""
+Conditional GET responses
+ETag and Last-Modified headers from utils.data_versions, and 304 Not Modified
+when the client's copy is current. Call not_modified() before querying:
+
+    @router.get("/things/")
+    def get_things(request: Request, response: Response):
+        cached = not_modified(request, response, ("things",))
+        if cached:
+            return cached
+        ...
+
+Responses are marked private/no-cache so clients revalidate every time and
+shared caches never hand one user's copy to another.
+"""
+
+import zlib
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Iterable, Optional
+
+from fastapi import Request, Response
+
+from utils.data_versions import version
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """Weak comparison against an If-None-Match list"""
+    if header.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def _not_modified_since(header: str, last_modified: float) -> bool:
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+    return since is not None and int(last_modified) <= since.timestamp()
+
+
+def not_modified(request: Request, response: Response, tables: Iterable[str],
+                 variant: str = "") -> Optional[Response]:
+    """
+    Set ETag/Last-Modified on response; return a 304 to send instead when the
+    request's validators match. variant distinguishes responses that differ
+    by caller over the same data (role, user, date).
+    """
+    data_version, last_modified = version(tables)
+    if variant:
+        data_version += f".{zlib.crc32(variant.encode()):08x}"
+    headers = {
+        "ETag": f'W/"{data_version}"',
+        "Last-Modified": formatdate(int(last_modified), usegmt=True),
+        "Cache-Control": "private, no-cache"
+    }
+    response.headers.update(headers)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        matched = _etag_matches(if_none_match, headers["ETag"])
+    else:
+        # Dates are only compared when no ETag was sent; a variant change is not a date change
+        if_modified_since = request.headers.get("if-modified-since")
+        matched = bool(if_modified_since) and not variant and _not_modified_since(if_modified_since, last_modified)
+    return Response(status_code=304, headers=headers) if matched else None
+
+
+def drop_validators(response: Response):
+    """The query failed and a fallback body is being sent: don't let clients keep it"""
+    for header in ("ETag", "Last-Modified"):
+        if header in response.headers:
+            del response.headers[header]
+    response.headers["Cache-Control"] = "no-store"
@@ -0,0 +1,71 @@
+"""
+Per-table data versions
+A change counter and last-change time for each table, bumped by the db
+helpers whenever they run an INSERT/UPDATE/DELETE/REPLACE on it. Endpoints
+build ETags from the versions of the tables their response reads, so an
+unchanged response can be answered with 304 before any query runs.
+
+Counters live in this process (the app runs as one process), with a boot id
+so tags from before a restart never match. Writes made outside the app are
+not seen, so every version also rolls over each DATA_VERSION_MAX_AGE_SECONDS.
+"""
+
+import os
+import re
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, Optional, Tuple
+
+MAX_AGE_SECONDS = int(os.getenv("DATA_VERSION_MAX_AGE_SECONDS", "600"))
+
+_WRITE_TABLE = re.compile(
+    r"^\s*(?:INSERT(?:\s+IGNORE)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+IGNORE)?|DELETE\s+FROM)\s+`?(\w+)`?",
+    re.IGNORECASE
+)
+
+_BOOT_ID = uuid.uuid4().hex[:8]
+_BOOT_TIME = time.time()
+
+_lock = threading.Lock()
+_counters: Dict[str, int] = {}
+_changed_at: Dict[str, float] = {}
+
+
+def table_written(query: str) -> Optional[str]:
+    """Table a write statement changes (None for reads and anything unrecognised)"""
+    match = _WRITE_TABLE.match(query or "")
+    return match.group(1).lower() if match else None
+
+
+def bump(*tables: str):
+    now = time.time()
+    with _lock:
+        for table in tables:
+            _counters[table] = _counters.get(table, 0) + 1
+            _changed_at[table] = now
+
+
+def record_write(query: str):
+    """Called by the db helpers for every statement they run"""
+    table = table_written(query)
+    if table:
+        bump(table)
+
+
+def version(tables: Iterable[str]) -> Tuple[str, float]:
+    """(version string, last change time) covering every table in tables"""
+    tables = sorted(set(tables))
+    now = time.time()
+    epoch = int(now // MAX_AGE_SECONDS) if MAX_AGE_SECONDS > 0 else 0
+    with _lock:
+        counts = [_counters.get(table, 0) for table in tables]
+        changed = max([_changed_at.get(table, _BOOT_TIME) for table in tables] or [_BOOT_TIME])
+    if MAX_AGE_SECONDS > 0:
+        changed = max(changed, epoch * MAX_AGE_SECONDS)
+    return f"{_BOOT_ID}.{epoch}.{'.'.join(map(str, counts))}", changed
+
+
+def stats() -> Dict:
+    with _lock:
+        return {"boot_id": _BOOT_ID, "tables": dict(_counters)}
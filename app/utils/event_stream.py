@@ -0,0 +1,143 @@
+"""
+Server-sent event feeds
+A feed keeps a short history of recent events and pushes new ones to every
+connected client. Clients reconnect with the last event id they saw
+(Last-Event-ID header or ?last_event_id=) and receive what they missed; when
+that id is no longer in the history (or from before a restart) they get a
+"reset" event and should reload their view.
+
+publish() is thread-safe, so handlers running in the threadpool or in
+background workers can publish directly.
+"""
+
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# A subscriber this far behind is disconnected; it resumes from its last id
+MAX_SUBSCRIBER_BACKLOG = 1000
+
+_CLOSE = object()
+
+
+def format_sse(event_id: Optional[int], event: str, data_json: str) -> str:
+    """Format one server-sent event (data already JSON-encoded)"""
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {data_json}\n\n"
+
+
+class EventFeed:
+    """Recent-history buffer plus live subscribers for one stream of events"""
+
+    def __init__(self, name: str, history: int = 1000):
+        self.name = name
+        self._lock = threading.Lock()
+        self._history: Deque[Tuple[int, str, str]] = deque(maxlen=history)
+        # Ids start from the clock so ids from before a restart are recognised as stale
+        self._last_id = int(time.time() * 1000)
+        self._subscribers: Dict[int, Tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = {}
+        self._next_subscriber = 0
+        self._published = 0
+
+    def publish(self, event: str, data) -> int:
+        """Record an event and push it to connected clients; returns its id"""
+        data_json = json.dumps(data, default=str)
+        with self._lock:
+            self._last_id += 1
+            item = (self._last_id, event, data_json)
+            self._history.append(item)
+            self._published += 1
+            subscribers = list(self._subscribers.items())
+        for key, (loop, queue) in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._deliver, key, queue, item)
+            except RuntimeError:
+                # Event loop already closed (shutdown)
+                self._unsubscribe(key)
+        return item[0]
+
+    def _deliver(self, key: int, queue: asyncio.Queue, item):
+        if queue.qsize() >= MAX_SUBSCRIBER_BACKLOG:
+            logger.warning(f"{self.name} feed subscriber {key} fell behind; disconnecting")
+            self._unsubscribe(key)
+            queue.put_nowait(_CLOSE)
+            return
+        queue.put_nowait(item)
+
+    def _unsubscribe(self, key: int):
+        with self._lock:
+            self._subscribers.pop(key, None)
+
+    def _register(self, last_event_id: Optional[int]) -> Tuple[int, asyncio.Queue, Optional[List], bool]:
+        """Add a subscriber and return the events it missed (None means reset)"""
+        queue: asyncio.Queue = asyncio.Queue()
+        with self._lock:
+            key = self._next_subscriber
+            self._next_subscriber += 1
+            self._subscribers[key] = (asyncio.get_running_loop(), queue)
+            if last_event_id is None:
+                return key, queue, [], False
+            oldest = self._history[0][0] if self._history else self._last_id + 1
+            if last_event_id > self._last_id or last_event_id < oldest - 1:
+                return key, queue, None, True
+            return key, queue, [item for item in self._history if item[0] > last_event_id], False
+
+    async def stream(self, last_event_id: Optional[int] = None, heartbeat_seconds: float = 15) -> AsyncIterator[str]:
+        """SSE text for one client: missed events, then live ones, with keep-alive comments"""
+        key, queue, missed, reset = self._register(last_event_id)
+        try:
+            if reset:
+                yield format_sse(self._last_id, "reset", json.dumps({"reason": "history unavailable"}))
+            for event_id, event, data_json in missed or []:
+                yield format_sse(event_id, event, data_json)
+            yield ": connected\n\n"
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout=heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if item is _CLOSE:
+                    return
+                yield format_sse(*item)
+        finally:
+            self._unsubscribe(key)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "feed": self.name,
+                "subscribers": len(self._subscribers),
+                "published": self._published,
+                "last_event_id": self._last_id
+            }
+
+
+def last_event_id_from(request: Request) -> Optional[int]:
+    """Resume point sent by the client, from the header or the query string"""
+    value = request.headers.get("last-event-id") or request.query_params.get("last_event_id")
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+def sse_response(feed: EventFeed, request: Request) -> StreamingResponse:
+    return StreamingResponse(
+        feed.stream(last_event_id_from(request)),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # don't let nginx buffer the stream
+        }
+    )
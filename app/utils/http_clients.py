@@ -0,0 +1,139 @@
+"""
+Shared HTTP clients for outbound integrations (OpenAI, OpenWeather, Jobber,
+Twilio, n8n, Discord)
+
+Clients are long-lived so DNS, TCP and TLS setup is paid once per host rather
+than once per call. Created at app startup, closed at shutdown, and lazily
+created on first use for code that runs outside the app (scripts, logging).
+"""
+
+import os
+import threading
+from typing import Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Standard policy for every outbound call
+HTTP_TIMEOUT_SECONDS = float(os.getenv("OUTBOUND_HTTP_TIMEOUT_SECONDS", "10"))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("OUTBOUND_HTTP_CONNECT_TIMEOUT_SECONDS", "5"))
+HTTP_RETRIES = int(os.getenv("OUTBOUND_HTTP_RETRIES", "2"))
+HTTP_POOL_CONNECTIONS = 20    # distinct hosts kept pooled
+HTTP_POOL_MAXSIZE = 20        # keep-alive connections per host
+HTTP_KEEPALIVE_SECONDS = 30.0
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+_lock = threading.Lock()
+_session: Optional[requests.Session] = None
+_sync_client: Optional[httpx.Client] = None
+_async_client: Optional[httpx.AsyncClient] = None
+
+
+def _httpx_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=HTTP_POOL_CONNECTIONS * HTTP_POOL_MAXSIZE,
+        max_keepalive_connections=HTTP_POOL_MAXSIZE,
+        keepalive_expiry=HTTP_KEEPALIVE_SECONDS
+    )
+
+
+def _httpx_timeout() -> httpx.Timeout:
+    return httpx.Timeout(HTTP_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS)
+
+
+class _TimeoutSession(requests.Session):
+    """requests.Session that applies the standard timeout when the caller gives none"""
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT_SECONDS, HTTP_TIMEOUT_SECONDS))
+        return super().request(method, url, **kwargs)
+
+
+def get_session() -> requests.Session:
+    """
+    Shared requests session with per-host connection pools.
+    Retries connection errors and 429/5xx responses for idempotent methods only,
+    so POSTs are never replayed.
+    """
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                retry = Retry(
+                    total=HTTP_RETRIES,
+                    connect=HTTP_RETRIES,
+                    backoff_factor=0.5,
+                    status_forcelist=(429, 502, 503, 504),
+                    respect_retry_after_header=True,
+                    raise_on_status=False
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=HTTP_POOL_MAXSIZE,
+                    max_retries=retry
+                )
+                session = _TimeoutSession()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def get_sync_client() -> httpx.Client:
+    """Shared blocking httpx client (used by the OpenAI SDK)"""
+    global _sync_client
+    if _sync_client is None:
+        with _lock:
+            if _sync_client is None:
+                _sync_client = httpx.Client(
+                    timeout=_httpx_timeout(),
+                    transport=httpx.HTTPTransport(http2=HTTP2_AVAILABLE, retries=HTTP_RETRIES, limits=_httpx_limits())
+                )
+    return _sync_client
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Shared async httpx client; retries failed connects, HTTP/2 when h2 is installed"""
+    global _async_client
+    if _async_client is None:
+        with _lock:
+            if _async_client is None:
+                _async_client = httpx.AsyncClient(
+                    timeout=_httpx_timeout(),
+                    transport=httpx.AsyncHTTPTransport(http2=HTTP2_AVAILABLE, retries=HTTP_RETRIES, limits=_httpx_limits())
+                )
+    return _async_client
+
+
+def get_openai_client(api_key: str):
+    """OpenAI SDK client that reuses the shared connection pool"""
+    from openai import OpenAI
+    return OpenAI(api_key=api_key, http_client=get_sync_client())
+
+
+def startup():
+    """Create the shared clients up front (called from app startup)"""
+    get_session()
+    get_sync_client()
+    get_async_client()
+
+
+async def shutdown():
+    """Close the shared clients (called from app shutdown)"""
+    global _session, _sync_client, _async_client
+    with _lock:
+        session, sync_client, async_client = _session, _sync_client, _async_client
+        _session = _sync_client = _async_client = None
+    if async_client is not None:
+        await async_client.aclose()
+    if sync_client is not None:
+        sync_client.close()
+    if session is not None:
+        session.close()
@@ -4,11 +4,11 @@ Sends ERROR and CRITICAL logs to Discord for monitoring
 """
 
 import logging
-import requests
 import traceback
 import os
 from datetime import datetime
 from pathlib import Path
+from utils.http_clients import get_session
 
 # Read version from VERSION file
 VERSION_FILE = Path(__file__).parent.parent.parent / "VERSION"
@@ -73,7 +73,7 @@ def send_to_discord(level: str, logger_name: str, message: str, exc_info=None):
         }
 
         # Send to Discord (timeout 5 seconds, don't block app)
-        requests.post(DISCORD_WEBHOOK_URL, json=payload, timeout=5)
+        get_session().post(DISCORD_WEBHOOK_URL, json=payload, timeout=5)
 
     except Exception as e:
         # Don't let Discord failures break the app
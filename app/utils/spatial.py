@@ -0,0 +1,273 @@
+"""
+Spatial helpers shared by weather lookups, the property map and crew proximity
+Provides haversine distances, geohash encoding and a uniform grid index
+"""
+
+import math
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_DEGREE_LAT = 69.0
+
+_GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def haversine_miles(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points in miles"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = math.radians(lat2 - lat1)
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(min(1.0, math.sqrt(a)))
+
+
+def geohash(lat: float, lon: float, precision: int = 6) -> str:
+    """Encode a coordinate as a geohash string (precision 5 ~ 3mi cell, 6 ~ 0.75mi)"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    bits = 0
+    bit_count = 0
+    even = True
+    result = []
+
+    while len(result) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if lon >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits = bits << 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if lat >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits = bits << 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+
+        if bit_count == 5:
+            result.append(_GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+
+    return "".join(result)
+
+
+def to_float(value) -> Optional[float]:
+    """Coerce a DB coordinate (Decimal, str, None) to float, or None if missing"""
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class GridIndex:
+    """
+    Uniform lat/lon grid over point items for radius and k-nearest queries.
+
+    Cells are `cell_miles` on a side (longitude width is scaled at the index's
+    reference latitude), so a radius query only scans the handful of cells that
+    overlap the search circle. Items can be inserted, moved and removed
+    incrementally, which keeps it cheap to maintain from location pings.
+    """
+
+    def __init__(self, cell_miles: float = 1.0, reference_lat: float = 42.0):
+        self.cell_miles = cell_miles
+        self.cell_lat = cell_miles / MILES_PER_DEGREE_LAT
+        self.cell_lon = cell_miles / (MILES_PER_DEGREE_LAT * max(0.1, math.cos(math.radians(reference_lat))))
+        self._cells: Dict[Tuple[int, int], Dict[Hashable, Tuple[float, float]]] = {}
+        self._items: Dict[Hashable, Tuple[float, float, Tuple[int, int]]] = {}
+        self._payloads: Dict[Hashable, object] = {}
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, item_id: Hashable) -> bool:
+        return item_id in self._items
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return (int(math.floor(lat / self.cell_lat)), int(math.floor(lon / self.cell_lon)))
+
+    def upsert(self, item_id: Hashable, lat: float, lon: float, payload: object = None):
+        """Insert an item or move it to a new position"""
+        cell = self._cell(lat, lon)
+        existing = self._items.get(item_id)
+        if existing and existing[2] != cell:
+            bucket = self._cells.get(existing[2])
+            if bucket is not None:
+                bucket.pop(item_id, None)
+                if not bucket:
+                    del self._cells[existing[2]]
+        self._cells.setdefault(cell, {})[item_id] = (lat, lon)
+        self._items[item_id] = (lat, lon, cell)
+        if payload is not None or item_id not in self._payloads:
+            self._payloads[item_id] = payload
+
+    def remove(self, item_id: Hashable):
+        existing = self._items.pop(item_id, None)
+        self._payloads.pop(item_id, None)
+        if not existing:
+            return
+        bucket = self._cells.get(existing[2])
+        if bucket is not None:
+            bucket.pop(item_id, None)
+            if not bucket:
+                del self._cells[existing[2]]
+
+    def position(self, item_id: Hashable) -> Optional[Tuple[float, float]]:
+        existing = self._items.get(item_id)
+        return (existing[0], existing[1]) if existing else None
+
+    def payload(self, item_id: Hashable):
+        return self._payloads.get(item_id)
+
+    def items(self) -> Iterable[Tuple[Hashable, float, float]]:
+        for item_id, (lat, lon, _) in self._items.items():
+            yield item_id, lat, lon
+
+    def _ring(self, center: Tuple[int, int], radius: int) -> Iterable[Tuple[int, int]]:
+        """Cells on the square ring `radius` cells away from center"""
+        ci, cj = center
+        if radius == 0:
+            yield center
+            return
+        for di in range(-radius, radius + 1):
+            yield (ci + di, cj - radius)
+            yield (ci + di, cj + radius)
+        for dj in range(-radius + 1, radius):
+            yield (ci - radius, cj + dj)
+            yield (ci + radius, cj + dj)
+
+    def within(
+        self,
+        lat: float,
+        lon: float,
+        radius_miles: float,
+        predicate: Optional[Callable[[Hashable], bool]] = None
+    ) -> List[Tuple[Hashable, float]]:
+        """All items within radius_miles, as (item_id, distance) sorted by distance"""
+        center = self._cell(lat, lon)
+        rings = int(math.ceil(radius_miles / self.cell_miles)) + 1 if math.isfinite(radius_miles) else None
+        if rings is None or (2 * rings + 1) ** 2 > len(self._cells):
+            # Search area spans more cells than are occupied; scan the occupied ones
+            cells = list(self._cells.keys())
+        else:
+            cells = [cell for r in range(rings + 1) for cell in self._ring(center, r)]
+        found = []
+        for cell in cells:
+            bucket = self._cells.get(cell)
+            if not bucket:
+                continue
+            for item_id, (ilat, ilon) in bucket.items():
+                if predicate and not predicate(item_id):
+                    continue
+                d = haversine_miles(lat, lon, ilat, ilon)
+                if d <= radius_miles:
+                    found.append((item_id, d))
+        found.sort(key=lambda x: x[1])
+        return found
+
+    def nearest(
+        self,
+        lat: float,
+        lon: float,
+        k: int = 1,
+        max_miles: Optional[float] = None,
+        predicate: Optional[Callable[[Hashable], bool]] = None
+    ) -> List[Tuple[Hashable, float]]:
+        """k nearest items as (item_id, distance), expanding ring by ring"""
+        if not self._items or k <= 0:
+            return []
+        center = self._cell(lat, lon)
+        max_ring = None
+        if max_miles is not None:
+            max_ring = int(math.ceil(max_miles / self.cell_miles)) + 1
+        candidates: List[Tuple[Hashable, float]] = []
+        visited_cells = 0
+        r = 0
+        while True:
+            for cell in self._ring(center, r):
+                visited_cells += 1
+                bucket = self._cells.get(cell)
+                if not bucket:
+                    continue
+                for item_id, (ilat, ilon) in bucket.items():
+                    if predicate and not predicate(item_id):
+                        continue
+                    d = haversine_miles(lat, lon, ilat, ilon)
+                    if max_miles is None or d <= max_miles:
+                        candidates.append((item_id, d))
+            # Everything in rings beyond r is at least r * cell_miles away, so once
+            # we hold k candidates closer than that we can stop.
+            candidates.sort(key=lambda x: x[1])
+            if len(candidates) >= k and candidates[k - 1][1] <= r * self.cell_miles:
+                break
+            if max_ring is not None and r >= max_ring:
+                break
+            if visited_cells > 4 * len(self._cells) + 16:
+                # Sparse index far from the query point: a full scan is cheaper
+                return self.within(lat, lon, max_miles if max_miles is not None else math.inf, predicate)[:k]
+            r += 1
+        return candidates[:k]
+
+
+def cluster_points(
+    points: List[Tuple[Hashable, float, float]],
+    max_error_miles: float = 3.0,
+    max_clusters: Optional[int] = None
+) -> Tuple[List[Dict], float]:
+    """
+    Group points so every member lies within a bounded distance of its cluster's
+    representative point.
+
+    Greedy leader clustering over a grid index: each point joins the nearest
+    existing cluster whose representative is within the radius, otherwise it
+    starts a new one. If a `max_clusters` budget is given and exceeded, the
+    radius is widened and clustering is repeated.
+
+    Returns (clusters, radius_used). Each cluster is
+    {"lat", "lon", "members": [ids], "max_error_miles"}.
+    """
+    if not points:
+        return [], max_error_miles
+
+    # Deterministic order: dense areas first so their leaders sit near the middle
+    ordered = sorted(points, key=lambda p: (geohash(p[1], p[2], 7), str(p[0])))
+    radius = max(0.1, max_error_miles)
+
+    while True:
+        index = GridIndex(cell_miles=radius, reference_lat=ordered[0][1])
+        clusters: List[Dict] = []
+        for item_id, lat, lon in ordered:
+            hit = index.nearest(lat, lon, k=1, max_miles=radius)
+            if hit:
+                cluster = clusters[hit[0][0]]
+                cluster["members"].append(item_id)
+                cluster["max_error_miles"] = max(cluster["max_error_miles"], hit[0][1])
+            else:
+                index.upsert(len(clusters), lat, lon)
+                clusters.append({
+                    "lat": lat,
+                    "lon": lon,
+                    "members": [item_id],
+                    "max_error_miles": 0.0
+                })
+
+        if max_clusters is None or len(clusters) <= max_clusters:
+            break
+        radius *= 1.5
+
+    for cluster in clusters:
+        cluster["lat"] = round(cluster["lat"], 4)
+        cluster["lon"] = round(cluster["lon"], 4)
+        cluster["max_error_miles"] = round(cluster["max_error_miles"], 2)
+
+    return clusters, radius
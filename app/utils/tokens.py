@@ -0,0 +1,38 @@
+"""
+Token estimation for LLM prompt budgeting
+Uses tiktoken when installed, otherwise a ~4 characters per token estimate
+"""
+
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+@lru_cache(maxsize=8)
+def _encoding(model: str):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def estimate_tokens(text: str, model: str = "gpt-4o") -> int:
+    """Approximate token count of text for the given model"""
+    if not text:
+        return 0
+    if tiktoken is not None:
+        return len(_encoding(model).encode(text))
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text: str, budget: int, model: str = "gpt-4o") -> str:
+    """Trim text to fit in budget tokens, marking the cut"""
+    if estimate_tokens(text, model) <= budget:
+        return text
+    if tiktoken is not None:
+        encoding = _encoding(model)
+        return encoding.decode(encoding.encode(text)[:max(0, budget - 2)]) + " …"
+    return text[:max(0, budget * 4 - 2)] + " …"
@@ -0,0 +1,114 @@
+"""
+Keyed background work queue
+Runs jobs on a thread pool, in parallel across keys but strictly in order
+within a key (e.g. one SMS conversation), and keeps depth/latency stats.
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Hashable, Tuple
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def _percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class KeyedWorkQueue:
+    """
+    Submit (key, job) pairs; handler(job) runs in a worker thread.
+
+    Each key has its own FIFO and at most one worker draining it, so jobs for
+    the same key never overlap or reorder while different keys run
+    concurrently up to `workers`.
+    """
+
+    def __init__(self, name: str, handler: Callable[[Any], None], workers: int = 4, latency_window: int = 500):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._pending: Dict[Hashable, Deque[Tuple[float, Any]]] = {}
+        self._active: set = set()
+        self._queued = 0
+        self._processed = 0
+        self._failed = 0
+        self._latencies: Deque[float] = deque(maxlen=latency_window)
+        self._waits: Deque[float] = deque(maxlen=latency_window)
+        self._closed = False
+
+    def submit(self, key: Hashable, job: Any):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"{self.name} queue is shut down")
+            self._pending.setdefault(key, deque()).append((time.monotonic(), job))
+            self._queued += 1
+            if key in self._active:
+                return  # the worker draining this key will pick it up
+            self._active.add(key)
+        self._executor.submit(self._drain, key)
+
+    def _drain(self, key: Hashable):
+        while True:
+            with self._lock:
+                pending = self._pending.get(key)
+                if not pending:
+                    self._pending.pop(key, None)
+                    self._active.discard(key)
+                    return
+                enqueued_at, job = pending.popleft()
+                self._queued -= 1
+
+            started_at = time.monotonic()
+            try:
+                self.handler(job)
+                failed = False
+            except Exception as e:
+                logger.error(f"{self.name} job failed for {key}: {e}", exc_info=True)
+                failed = True
+            finished_at = time.monotonic()
+
+            with self._lock:
+                self._processed += 1
+                self._failed += failed
+                self._waits.append(started_at - enqueued_at)
+                self._latencies.append(finished_at - enqueued_at)
+
+    def stats(self) -> Dict:
+        """Queue depth and recent latency (enqueue to finish) in milliseconds"""
+        with self._lock:
+            now = time.monotonic()
+            oldest = min((q[0][0] for q in self._pending.values() if q), default=None)
+            latencies = sorted(self._latencies)
+            waits = list(self._waits)
+            return {
+                "queue": self.name,
+                "workers": self.workers,
+                "queued": self._queued,
+                "active_keys": len(self._active),
+                "processed": self._processed,
+                "failed": self._failed,
+                "oldest_queued_seconds": round(now - oldest, 1) if oldest is not None else 0.0,
+                "wait_ms_avg": round(1000 * sum(waits) / len(waits), 1) if waits else 0.0,
+                "latency_ms": {
+                    "avg": round(1000 * sum(latencies) / len(latencies), 1) if latencies else 0.0,
+                    "p50": round(1000 * _percentile(latencies, 0.5), 1),
+                    "p95": round(1000 * _percentile(latencies, 0.95), 1),
+                    "max": round(1000 * latencies[-1], 1) if latencies else 0.0
+                }
+            }
+
+    def shutdown(self, wait: bool = True):
+        """Stop accepting jobs; with wait=True, finish what is already queued"""
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=wait)